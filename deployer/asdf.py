@@ -49,6 +49,7 @@ class Function:
     service: str
     platformwrapper: str
     tinyFaaS_options: typing.Optional[dict]
+    docker: bool
 
 
 def NewFunction(fName:str, fDict: dict) -> Function:
@@ -88,7 +89,6 @@ def NewFunction(fName:str, fDict: dict) -> Function:
         method = fDict["method"]
         path = fDict["path"]
         service = fDict["service"]
-        region = fDict["service"]
     except KeyError as e:
         print(e)
         print("one of [url|invokeAsync|method|path|service] is missing, using defaults for all")
@@ -97,7 +97,9 @@ def NewFunction(fName:str, fDict: dict) -> Function:
         method = "POST"
         path = name
         service = f"{name}-service"
-        region = None
+    region = fDict.get("region", None)
+    # the function is deployed as a container image built from the Dockerfile in its directory
+    docker = (fDict.get("args", None) or {}).get("docker", False)
 
     return Function(
         name=name,
@@ -111,5 +113,6 @@ def NewFunction(fName:str, fDict: dict) -> Function:
         path=path,
         service=service,
         platformwrapper=platformwrapper,
-        tinyFaaS_options=fDict.get("tinyFaaS_options", None)
+        tinyFaaS_options=fDict.get("tinyFaaS_options", None),
+        docker=docker
     )
@@ -0,0 +1,280 @@
+"""
+benchmarks for the choreography hot path and the handoff strategies
+
+- resolution: prepare_workflow, get_current_step, update_workflow and get_next_steps on chains of 10 to 10,000 steps
+- serialization: encoding and decoding of the envelope that is sent on every hop, by format, plan and payload size
+- handoff: latency from the end of a step until its successor has the input, by payload size
+    push: the input is sent along with the invocation (http POST to a local server, see invoke.post)
+    pre-fetch: the successor is already waiting and polls the handoff store (see handoff.HandoffStore.wait)
+    notified: like pre-fetch, but the successor long-polls a local notification broker (see notify.py)
+- pipeline (--pipeline): full runs of the deployed workflow under the local emulator (see emulator.py,
+  it lists what the local environment needs for the repository's workflow)
+
+all results are "lower is better" and stored as a flat json object, `--baseline` compares them to an earlier
+result and exits with 1 if one of them is slower by more than `--tolerance`
+
+usage: python benchmark.py [--save results.json] [--baseline baseline.json] [--tolerance 0.25]
+                           [--pipeline --body '{...}' --upload bucket/key=path --runs N]
+"""
+
+import argparse
+import http.server
+import importlib.util
+import json
+import os
+import platform
+import queue
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import timeit
+import typing
+
+import collector
+import emulator
+from wrapper import envelope
+from wrapper import handoff
+from wrapper import invoke
+from wrapper import notify
+from wrapper import plan
+
+
+WRAPPER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "wrapper")
+
+STEP_COUNTS = [10, 100, 1000, 10000]
+PAYLOAD_SIZES = [1024, 64 * 1024, 1024 * 1024]
+HANDOFF_REPETITIONS = 7
+
+
+def load_choreography() -> typing.Any:
+    """
+    load wrapper/wrapper.py, it imports the other wrapper modules by their top-level names
+    like it does when it's deployed next to them
+    """
+    sys.path.append(WRAPPER_DIR)
+    spec = importlib.util.spec_from_file_location("choreography", os.path.join(WRAPPER_DIR, "wrapper.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def chain(n: int) -> dict:
+    """
+    :return: a compiled workflow with `n` steps, each depending on the previous one
+    """
+    steps = [
+        {"id": i, "function_name": f"function-{i}", "pre-fetch": False, "invoke": {"type": "http", "url": f"http://127.0.0.1/{i}"}}
+        for i in range(n)
+    ]
+    return plan.compile_workflow({"steps": steps, "handoff": {"type": "local"}})
+
+
+def payload(size: int) -> dict:
+    return {"text": "x" * size}
+
+
+def per_call_us(fn: typing.Callable[[], typing.Any]) -> float:
+    """
+    :return: the best time per call of 3 repetitions in microseconds
+    """
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=3, number=number)) / number * 1e6
+
+
+def bench_resolution(choreography: typing.Any) -> dict:
+    results = {}
+    for n in STEP_COUNTS:
+        workflow = choreography.prepare_workflow(chain(n))
+        # a step in the middle of the chain
+        workflow = choreography.update_workflow(workflow, choreography.get_step(workflow, n // 2))
+        step = choreography.get_current_step(workflow)
+        results[f"resolution/prepare_workflow/{n}_us"] = per_call_us(lambda: choreography.prepare_workflow(workflow))
+        results[f"resolution/get_current_step/{n}_us"] = per_call_us(lambda: choreography.get_current_step(workflow))
+        results[f"resolution/update_workflow/{n}_us"] = per_call_us(lambda: choreography.update_workflow(workflow, step))
+        results[f"resolution/get_next_steps/{n}_us"] = per_call_us(lambda: choreography.get_next_steps(workflow))
+    return results
+
+
+def hop(choreography: typing.Any, workflow: dict, body: typing.Any) -> dict:
+    # what invoke_next sends
+    workflow = choreography.prepare_workflow(workflow)
+    return {"workflow": {**workflow, "trace": {"parent": workflow["trace"]["span"], "sent": time.time()}}, "body": body}
+
+
+def bench_serialization(choreography: typing.Any) -> dict:
+    results = {}
+    cases = [(n, 1024) for n in STEP_COUNTS] + [(10, size) for size in PAYLOAD_SIZES[1:]]
+    for n, size in cases:
+        message = hop(choreography, chain(n), payload(size))
+        for encoding in envelope.ENCODINGS:
+            encoded = envelope.encode(message, encoding)
+            results[f"serialization/encode/{encoding}/{n}-steps/{size}-bytes_us"] = per_call_us(lambda: envelope.encode(message, encoding))
+            results[f"serialization/decode/{encoding}/{n}-steps/{size}-bytes_us"] = per_call_us(lambda: envelope.decode(encoded))
+            results[f"serialization/size/{encoding}/{n}-steps/{size}-bytes_bytes"] = len(encoded)
+    return results
+
+
+class _Receiver(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self) -> None:
+        message = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.received.put((time.perf_counter(), message))
+        self.send_response(202)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format: str, *args: typing.Any) -> None:
+        pass
+
+
+def bench_push(choreography: typing.Any, size: int) -> float:
+    """
+    :return: median milliseconds from the start of the invocation until the receiver has decoded the input
+    """
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Receiver)
+    server.received = queue.Queue()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+    workflow = chain(2)
+    latencies = []
+    try:
+        for _ in range(HANDOFF_REPETITIONS):
+            start = time.perf_counter()
+            invoke.post(url, json.dumps(hop(choreography, workflow, payload(size))).encode("utf-8"))
+            end, _ = server.received.get(timeout=10)
+            latencies.append((end - start) * 1000)
+    finally:
+        server.shutdown()
+        server.server_close()
+    return statistics.median(latencies)
+
+
+def bench_prefetch(size: int, storeDelay: float, channel: typing.Optional[notify.Channel] = None) -> float:
+    """
+    :return: median milliseconds from the start of the upload until the waiting successor has decoded the input
+    """
+    latencies = []
+    with tempfile.TemporaryDirectory() as directory:
+        store = handoff.LocalStore(directory, storeDelay)
+        for i in range(HANDOFF_REPETITIONS):
+            # the broker keeps notifications, so every repetition needs a key of its own
+            key = handoff.step_key(f"benchmark-{size}-{channel is not None}", i, "input-0")
+            received = queue.Queue()
+            waiter = threading.Thread(target=lambda: received.put((json.loads(store.wait(key, 10, channel=channel)), time.perf_counter())))
+            waiter.start()
+            # the successor was invoked early, it is already polling when the predecessor finishes
+            time.sleep(0.2)
+            start = time.perf_counter()
+            record = json.dumps({"body": payload(size)}).encode("utf-8")
+            store.put(key, record)
+            if channel is not None:
+                channel.publish(key, record)
+            _, end = received.get(timeout=10)
+            waiter.join()
+            latencies.append((end - start) * 1000)
+    return statistics.median(latencies)
+
+
+def bench_handoff(choreography: typing.Any, storeDelay: float) -> dict:
+    results = {}
+    broker = notify.serve()
+    channel = notify.HttpChannel(f"http://127.0.0.1:{broker.server_address[1]}")
+    try:
+        for size in PAYLOAD_SIZES:
+            results[f"handoff/push/{size}-bytes_ms"] = bench_push(choreography, size)
+            results[f"handoff/pre-fetch/{size}-bytes_ms"] = bench_prefetch(size, storeDelay)
+            results[f"handoff/notified/{size}-bytes_ms"] = bench_prefetch(size, storeDelay, channel)
+    finally:
+        broker.shutdown()
+        broker.server_close()
+    return results
+
+
+def bench_pipeline(body: typing.Any, uploads: list[str], runs: int, profile: typing.Optional[str]) -> dict:
+    with emulator.Emulator(profile=emulator.load_profile(profile)) as e:
+        data = []
+        for value in uploads:
+            bucket, key, path = emulator.parse_upload(value)
+            e.upload(bucket, key, path)
+            data.append({"bucket": bucket, "key": key})
+        # the first run pays for the cold starts, it is reported separately
+        cold = collector.analyze_run(e.run(body, data))["duration_ms"]
+        durations = sorted(collector.analyze_run(e.run(body, data))["duration_ms"] for _ in range(runs))
+    return {
+        "pipeline/cold_ms": cold,
+        "pipeline/mean_ms": statistics.mean(durations),
+        "pipeline/p50_ms": durations[len(durations) // 2],
+        "pipeline/p95_ms": durations[min(int(len(durations) * 0.95), len(durations) - 1)]
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    :return: a description of every result that is worse than the baseline by more than `tolerance` (relative)
+    """
+    regressions = []
+    for name, value in sorted(results.items()):
+        if name not in baseline or baseline[name] <= 0:
+            continue
+        change = value / baseline[name] - 1
+        if change > tolerance:
+            regressions.append(f"{name}: {baseline[name]:.3f} -> {value:.3f} (+{change * 100:.0f}%)")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="benchmark the wrapper layer")
+    parser.add_argument("--save", default=None, help="write the results to this json file")
+    parser.add_argument("--baseline", default=None, help="compare the results to this json file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown compared to the baseline")
+    parser.add_argument("--store-delay", type=float, default=0.0, help="seconds added to every handoff store request")
+    parser.add_argument("--pipeline", action="store_true", help="also run the deployed workflow under the emulator")
+    parser.add_argument("--body", default="{}", help="input of the first step for --pipeline (json)")
+    parser.add_argument("--upload", action="append", default=[], help="bucket/key=path for --pipeline, see emulator.py")
+    parser.add_argument("--runs", type=int, default=10, help="number of warm runs for --pipeline")
+    parser.add_argument("--profile", default=None, help="emulator profile for --pipeline")
+    args = parser.parse_args()
+
+    choreography = load_choreography()
+    results = {}
+    print("benchmarking step resolution")
+    results.update(bench_resolution(choreography))
+    print("benchmarking serialization")
+    results.update(bench_serialization(choreography))
+    print("benchmarking handoff")
+    results.update(bench_handoff(choreography, args.store_delay))
+    if args.pipeline:
+        print("benchmarking the pipeline under the emulator")
+        results.update(bench_pipeline(json.loads(args.body), args.upload, args.runs, args.profile))
+
+    for name, value in results.items():
+        print(f"{name:<60} {value:>14.3f}")
+
+    if args.save is not None:
+        with open(args.save, "w") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "time": time.time(),
+                "results": results
+            }, f, indent=4)
+
+    if args.baseline is not None:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        if len(regressions) > 0:
+            print(f"{len(regressions)} results are slower than the baseline:")
+            for r in regressions:
+                print(f"  {r}")
+            sys.exit(1)
+        print("no regressions compared to the baseline")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+incremental builds for the deployer
+
+- every function directory in ../deployment stores a hash of everything it was built from
+  (sources, wrapper modules, requirements, generated files), unchanged functions are not rebuilt
+- requirements are installed once per distinct requirements file into a shared cache
+  and copied into the function directories from there, pip's download/wheel cache is shared as well
+"""
+
+import hashlib
+import os
+import shutil
+import subprocess
+import typing
+import uuid
+
+
+BUILD_HASH_FILE = ".build-hash"
+CACHE_DIR = "../deployment/.cache"
+
+
+def hash_inputs(paths: list[str], extra: typing.Optional[list[str]] = None) -> str:
+    """
+    hash the contents of files and additional strings (e.g. generated files)
+    missing files are part of the hash too, so creating them later triggers a rebuild
+    """
+    h = hashlib.sha256()
+    for path in paths:
+        h.update(path.encode("utf-8"))
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                h.update(hashlib.sha256(f.read()).digest())
+        else:
+            h.update(b"missing")
+    for s in extra or []:
+        h.update(hashlib.sha256(s.encode("utf-8")).digest())
+    return h.hexdigest()
+
+
+def is_up_to_date(targetDir: str, buildHash: str) -> bool:
+    path = os.path.join(targetDir, BUILD_HASH_FILE)
+    if not os.path.exists(path):
+        return False
+    with open(path, "r") as f:
+        return f.read().strip() == buildHash
+
+
+def mark_built(targetDir: str, buildHash: str) -> None:
+    with open(os.path.join(targetDir, BUILD_HASH_FILE), "w") as f:
+        f.write(buildHash)
+
+
+def requirements_hash(requirementsPath: str) -> str:
+    """
+    hash a requirements file independent of line order, comments and whitespace
+    """
+    with open(requirementsPath, "r") as f:
+        lines = [line.split("#")[0].strip() for line in f]
+    lines = sorted(line for line in lines if line != "")
+    return hashlib.sha256("\n".join(lines).encode("utf-8")).hexdigest()[:16]
+
+
+def install_requirements(requirementsPath: str, targetDir: str) -> None:
+    """
+    install the requirements into `targetDir`, reusing the installation of an identical requirements file
+    raises subprocess.CalledProcessError if pip fails
+    """
+    cached = os.path.join(CACHE_DIR, "requirements", requirements_hash(requirementsPath))
+    if not os.path.exists(cached):
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        # install into a private directory first, other workers might be installing the same requirements
+        tmp = f"{cached}.{uuid.uuid4().hex}.tmp"
+        cmd = ["pip", "install", "-t", tmp, "--cache-dir", os.path.join(CACHE_DIR, "pip"), "-r", requirementsPath]
+        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
+        print(f"result of requirements installation: {result.stdout}")
+        print(f"error: {result.stderr}")
+        try:
+            os.rename(tmp, cached)
+        except OSError:
+            # another worker was faster, use its installation
+            shutil.rmtree(tmp, ignore_errors=True)
+    else:
+        print(f"reusing installed requirements from {cached}")
+    shutil.copytree(cached, targetDir, dirs_exist_ok=True)
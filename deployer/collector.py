@@ -0,0 +1,188 @@
+"""
+reconstruct workflow runs from the wrappers' timing records (see wrapper/telemetry.py)
+
+reads log files (or stdin), picks out the json lines with "type": "invocation" (log prefixes like
+cloudwatch timestamps are ignored) and prints for every run:
+- a timeline of all steps relative to the start of the run
+- every handoff between two steps, labeled with the platforms it crosses
+    invoked: the step was invoked with its input, latency = received - end of the predecessor's handler
+    pre-fetch: the step was invoked early, latency = end of its input wait - end of the predecessor's handler
+- the critical path: starting at the step that finished last, always follow the predecessor that finished its handler last
+- the pre-fetch overlap per step: how much of the pre-fetching happened while the predecessors were still running
+
+timestamps come from different machines, latencies across clouds include their clock skew
+
+usage: python collector.py [--json] [logfile ...]
+"""
+
+import argparse
+import json
+import sys
+import typing
+
+
+def parse_records(lines: typing.Iterable[str]) -> list[dict]:
+    records = []
+    for line in lines:
+        start = line.find("{")
+        if start < 0:
+            continue
+        try:
+            record = json.loads(line[start:])
+        except json.JSONDecodeError:
+            continue
+        if isinstance(record, dict) and record.get("type", None) == "invocation" and "run_id" in record:
+            records.append(record)
+    return records
+
+
+def phases(record: dict, name: str) -> list[tuple[float, float]]:
+    return [(start, end) for n, start, end in record.get("timeline", []) if n == name]
+
+
+def received(record: dict) -> float:
+    return record.get("received", None) or record["start"]
+
+
+def finished(record: dict) -> float:
+    return record["start"] + record["total_ms"] / 1000
+
+
+def handler_end(record: dict) -> float:
+    handler = phases(record, "handler")
+    if len(handler) == 0:
+        return finished(record)
+    return handler[-1][1]
+
+
+def analyze_run(records: list[dict]) -> dict:
+    # retried invocations produce several records for a step, the last one is the one that counted
+    steps = {}
+    for record in sorted(records, key=lambda r: r["start"]):
+        steps[record["step_id"]] = record
+    t0 = min(received(r) for r in steps.values())
+    spans = {r.get("span", None): r for r in steps.values()}
+
+    timeline = []
+    for id, r in sorted(steps.items(), key=lambda item: received(item[1])):
+        timeline.append({
+            "step_id": id,
+            "function": r.get("function", None),
+            "platform": r["platform"],
+            "cold": r["cold"],
+            "start_ms": (received(r) - t0) * 1000,
+            "end_ms": (finished(r) - t0) * 1000,
+            "prefetch_ms": r.get("prefetch_ms", 0),
+            "input_wait_ms": r.get("input_wait_ms", 0),
+            "handler_ms": r.get("handler_ms", 0),
+            "handoff_ms": r.get("handoff_ms", 0)
+        })
+
+    handoffs = []
+    for id, r in steps.items():
+        early = len(phases(r, "input_wait")) > 0
+        invoker = spans.get(r.get("parent", None), None)
+        for predecessorId in r.get("predecessors", []):
+            p = steps.get(predecessorId, None)
+            if p is None:
+                continue
+            # joins are invoked by one of their predecessors, the outputs of the others were already waiting
+            arrived = phases(r, "input_wait")[-1][1] if early else received(r)
+            handoffs.append({
+                "from": predecessorId,
+                "to": id,
+                "kind": "pre-fetch" if early else "invoked",
+                "platforms": f"{p['platform']} -> {r['platform']}",
+                "cross_platform": p["platform"] != r["platform"],
+                "latency_ms": max(arrived - handler_end(p), 0) * 1000,
+                "invoke_latency_ms": (received(r) - r["sent"]) * 1000 if invoker is not None and r.get("sent", None) is not None else None
+            })
+
+    # critical path
+    path = []
+    current = max(steps.values(), key=finished)
+    while current is not None:
+        path.append(current["step_id"])
+        predecessors = [steps[p] for p in current.get("predecessors", []) if p in steps]
+        current = max(predecessors, key=handler_end) if len(predecessors) > 0 else None
+    path.reverse()
+
+    overlap = []
+    for id, r in steps.items():
+        prefetch = phases(r, "prefetch")
+        predecessors = [steps[p] for p in r.get("predecessors", []) if p in steps]
+        if len(prefetch) == 0 or len(predecessors) == 0:
+            continue
+        start, end = prefetch[0]
+        ready = max(handler_end(p) for p in predecessors)
+        hidden = max(min(end, ready) - start, 0)
+        overlap.append({
+            "step_id": id,
+            "prefetch_ms": (end - start) * 1000,
+            "hidden_ms": hidden * 1000,
+            # nothing to hide if the pre-fetch took no time
+            "ratio": hidden / (end - start) if end > start else None,
+            "idle_wait_ms": r.get("input_wait_ms", 0)
+        })
+
+    return {
+        "run_id": records[0]["run_id"],
+        "duration_ms": (max(finished(r) for r in steps.values()) - t0) * 1000,
+        "steps": timeline,
+        "handoffs": handoffs,
+        "critical_path": path,
+        "critical_path_functions": [steps[id].get("function", None) for id in path],
+        "prefetch_overlap": overlap
+    }
+
+
+def analyze(records: list[dict]) -> list[dict]:
+    runs = {}
+    for record in records:
+        runs.setdefault(record["run_id"], []).append(record)
+    return [analyze_run(r) for r in runs.values()]
+
+
+def print_run(run: dict) -> None:
+    print(f"run {run['run_id']}: {run['duration_ms']:.1f} ms")
+    print(f"  critical path: {' -> '.join(str(f) for f in run['critical_path_functions'])}")
+    print(f"  {'step':>4} {'function':<12} {'platform':<9} {'cold':<5} {'start':>9} {'end':>9} {'prefetch':>9} {'wait':>9} {'handler':>9} {'handoff':>9}")
+    for s in run["steps"]:
+        print(
+            f"  {s['step_id']:>4} {str(s['function']):<12} {s['platform']:<9} {str(s['cold']):<5} "
+            f"{s['start_ms']:>9.1f} {s['end_ms']:>9.1f} {s['prefetch_ms']:>9.1f} {s['input_wait_ms']:>9.1f} {s['handler_ms']:>9.1f} {s['handoff_ms']:>9.1f}"
+        )
+    print("  handoffs:")
+    for h in run["handoffs"]:
+        boundary = "cross-platform" if h["cross_platform"] else "same platform"
+        print(f"    {h['from']} -> {h['to']} ({h['kind']}, {h['platforms']}, {boundary}): {h['latency_ms']:.1f} ms")
+    if len(run["prefetch_overlap"]) > 0:
+        print("  pre-fetch overlap:")
+        for o in run["prefetch_overlap"]:
+            ratio = f"{o['ratio'] * 100:.0f}%" if o["ratio"] is not None else "n/a"
+            print(f"    step {o['step_id']}: {o['hidden_ms']:.1f} of {o['prefetch_ms']:.1f} ms hidden ({ratio}), idle wait {o['idle_wait_ms']:.1f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="reconstruct workflow runs from wrapper timing records")
+    parser.add_argument("logs", nargs="*", help="log files, default: stdin")
+    parser.add_argument("--json", action="store_true", help="print the analysis as json")
+    args = parser.parse_args()
+
+    lines = []
+    if len(args.logs) == 0:
+        lines = sys.stdin.readlines()
+    for path in args.logs:
+        with open(path, "r") as f:
+            lines.extend(f.readlines())
+
+    runs = analyze(parse_records(lines))
+    if args.json:
+        print(json.dumps(runs, indent=4))
+        return
+    for run in runs:
+        print_run(run)
+
+
+if __name__ == '__main__':
+    main()
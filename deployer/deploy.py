@@ -0,0 +1,137 @@
+"""
+deploy the services in ../deployment concurrently
+
+- every service is deployed with its own `sls deploy` subprocess, at most `jobs` at a time
+- the output of each subprocess is streamed line by line, prefixed with the service name
+- only services whose build hash (see build.py) differs from the last successful deployment are deployed
+- timing and exit status of every service are written to a json report
+
+usage: python deploy.py [--jobs N] [--force] [service ...]
+"""
+
+import argparse
+import concurrent.futures
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import build
+
+
+DEPLOYMENT_DIR = "../deployment"
+DEPLOYED_HASH_FILE = ".deployed-hash"
+REPORT_FILE = "deploy-report.json"
+
+# keeps lines of concurrent deployments from interleaving
+_printLock = threading.Lock()
+
+
+def service_dirs(deploymentDir: str = DEPLOYMENT_DIR) -> list[str]:
+    """
+    :return: the names of all built services (directories with a build hash)
+    """
+    return sorted(
+        name for name in os.listdir(deploymentDir)
+        if os.path.exists(os.path.join(deploymentDir, name, build.BUILD_HASH_FILE))
+    )
+
+
+def _read(path: str) -> str:
+    if not os.path.exists(path):
+        return ""
+    with open(path, "r") as f:
+        return f.read().strip()
+
+
+def needs_deploy(serviceDir: str) -> bool:
+    buildHash = _read(os.path.join(serviceDir, build.BUILD_HASH_FILE))
+    return buildHash == "" or buildHash != _read(os.path.join(serviceDir, DEPLOYED_HASH_FILE))
+
+
+def deploy_service(name: str, deploymentDir: str = DEPLOYMENT_DIR, cmd: str = "sls deploy") -> dict:
+    """
+    run the deploy command in the service's directory and stream its output
+    :return: the report entry for the service
+    """
+    serviceDir = os.path.join(deploymentDir, name)
+    buildHash = _read(os.path.join(serviceDir, build.BUILD_HASH_FILE))
+    start = time.time()
+    with _printLock:
+        print(f"[{name}] {cmd}")
+    try:
+        process = subprocess.Popen(cmd, shell=True, cwd=serviceDir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    except OSError as e:
+        return {"service": name, "status": "error", "exitCode": None, "error": str(e), "start": start, "duration": time.time() - start}
+    for line in process.stdout:
+        with _printLock:
+            print(f"[{name}] {line.rstrip()}")
+    exitCode = process.wait()
+    duration = time.time() - start
+
+    if exitCode == 0:
+        # remember what was deployed, an unchanged build won't be deployed again
+        with open(os.path.join(serviceDir, DEPLOYED_HASH_FILE), "w") as f:
+            f.write(buildHash)
+    with _printLock:
+        print(f"[{name}] finished with exit code {exitCode} after {duration:.1f}s")
+    return {
+        "service": name,
+        "status": "deployed" if exitCode == 0 else "failed",
+        "exitCode": exitCode,
+        "buildHash": buildHash,
+        "start": start,
+        "duration": duration
+    }
+
+
+def deploy_services(names: list[str], jobs: int = 4, force: bool = False, deploymentDir: str = DEPLOYMENT_DIR, cmd: str = "sls deploy") -> dict:
+    """
+    deploy services concurrently and write the report to <deploymentDir>/deploy-report.json
+    :return: the report
+    """
+    start = time.time()
+    results = []
+    pending = []
+    for name in names:
+        if force or needs_deploy(os.path.join(deploymentDir, name)):
+            pending.append(name)
+        else:
+            print(f"[{name}] unchanged since the last deployment, skipping")
+            results.append({"service": name, "status": "unchanged", "exitCode": None, "start": None, "duration": 0})
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        futures = [executor.submit(deploy_service, name, deploymentDir, cmd) for name in pending]
+        for future in futures:
+            results.append(future.result())
+
+    report = {
+        "start": start,
+        "duration": time.time() - start,
+        "ok": all(r["status"] in ("deployed", "unchanged") for r in results),
+        "services": sorted(results, key=lambda r: r["service"])
+    }
+    with open(os.path.join(deploymentDir, REPORT_FILE), "w") as f:
+        json.dump(report, f, indent=4)
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="deploy the services in ../deployment")
+    parser.add_argument("services", nargs="*", help="services to deploy, default: all")
+    parser.add_argument("--jobs", type=int, default=4, help="number of concurrent deployments")
+    parser.add_argument("--force", action="store_true", help="deploy services even if they didn't change")
+    args = parser.parse_args()
+
+    names = args.services if len(args.services) > 0 else service_dirs()
+    report = deploy_services(names, jobs=args.jobs, force=args.force)
+    for r in report["services"]:
+        print(f"{r['service']}: {r['status']} ({r['duration']:.1f}s)")
+    if not report["ok"]:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
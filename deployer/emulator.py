@@ -0,0 +1,449 @@
+"""
+local federation emulator: run the workflow in ../deployment end to end on one machine
+
+- every function in ../deployment is hosted by its real platform wrapper (wrapper_aws, the gcp pub/sub wrapper,
+  tinyFaaS' fn) in a separate worker process behind a local http endpoint
+- the invocation targets in the workflow are rewritten to these endpoints, lambda and pub/sub invocations
+  are queued and answered immediately (202) like the real ones, tinyFaaS invocations are synchronous
+  unless they carry X-tinyFaaS-Async (the wrappers always send it, see wrapper/invoke.py)
+- the gcp wrapper receives the invocations as pub/sub cloud events, just like in the cloud
+- the handoff store and the object store are one local directory (see handoff.LocalStore),
+  waiting steps are notified by a local broker (see wrapper/notify.py) unless `--poll` is given
+- network delay and cold-start latency are injected per provider, see PROFILE
+  an invocation is cold if all instances of its function are busy, like a new container
+- the workers' output is written to ../deployment/.emulator/logs, their timing records
+  are collected to detect the end of a run and analyzed with collector.py
+
+the emulator runs the workflow as main.py built it, every function of the workflow has to be in ../deployment
+(for the repository's workflow.json: check, virus, ocr and email)
+
+functions that aren't deployed with their requirements (gcp, tinyFaaS, docker images such as ocr) use the local
+environment, the gcp wrapper needs `functions-framework` (see Pipfile), email needs pdfminer and ocr needs
+ocrmypdf with tesseract and pikepdf (see functions/ocr/Dockerfile)
+
+usage: python emulator.py --body '{"bucket": "pdfs", "filename": "test.pdf"}' --upload pdfs/test.pdf=./test.pdf [--runs N] [--concurrency N] [--batch N] [--poll] [--profile profile.json] [--json]
+"""
+
+import argparse
+import base64
+import concurrent.futures
+import http.server
+import json
+import multiprocessing
+import os
+import queue
+import shutil
+import statistics
+import sys
+import threading
+import time
+import traceback
+import types
+import typing
+import uuid
+
+import collector
+from asdf import Provider
+from wrapper import handoff
+from wrapper import invoke
+from wrapper import notify
+from wrapper import plan
+
+
+DEPLOYMENT_DIR = "../deployment"
+WORK_DIR = "../deployment/.emulator"
+
+# seconds, "delay" is added to every invocation of a function on that provider,
+# "cold_start" to every invocation that needs a new instance
+# "store_delay" is added to every request to the handoff/object store
+PROFILE = {
+    "providers": {
+        "aws": {"delay": 0.03, "cold_start": 0.3},
+        "google": {"delay": 0.05, "cold_start": 0.8},
+        "tinyfaas": {"delay": 0.005, "cold_start": 0.05}
+    },
+    "store_delay": 0.01,
+    "concurrency": 64
+}
+
+# module and function the platform calls
+ENTRIES = {
+    Provider.AWS: ("wrapper_aws", "wrapper_aws"),
+    Provider.GCP: ("main", "wrapper_gcp"),
+    Provider.tinyFaaS: ("wrapper_tinyfaas", "fn")
+}
+
+
+def find_functions(deploymentDir: str = DEPLOYMENT_DIR) -> dict:
+    """
+    :return: function name -> {"dir": ..., "config": function.json} for all functions built by main.py
+    """
+    functions = {}
+    for name in sorted(os.listdir(deploymentDir)):
+        # tinyFaaS functions are one level deeper, see main.build_function
+        for functionDir in [os.path.join(deploymentDir, name), os.path.join(deploymentDir, name, "functions", name)]:
+            path = os.path.join(functionDir, "function.json")
+            if os.path.exists(path):
+                with open(path, "r") as f:
+                    functions[name] = {"dir": os.path.abspath(functionDir), "config": json.load(f)}
+                break
+    return functions
+
+
+def load_profile(path: typing.Optional[str]) -> dict:
+    """
+    :return: PROFILE, updated with the values in the json file at `path`
+    """
+    profile = json.loads(json.dumps(PROFILE))
+    if path is None:
+        return profile
+    with open(path, "r") as f:
+        custom = json.load(f)
+    for provider, settings in custom.get("providers", {}).items():
+        profile["providers"].setdefault(provider.lower(), {}).update(settings)
+    for key, value in custom.items():
+        if key != "providers":
+            profile[key] = value
+    return profile
+
+
+class _Output:
+    """
+    stdout of a worker: lines go to its log file, timing records are also sent to the emulator
+    """
+
+    def __init__(self, path: str, events: multiprocessing.Queue) -> None:
+        self.file = open(path, "a", buffering=1)
+        self.events = events
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def write(self, s: str) -> int:
+        # buffer per thread, print() writes the line and the newline separately
+        buffered = getattr(self.local, "buffer", "") + s
+        *lines, self.local.buffer = buffered.split("\n")
+        for line in lines:
+            with self.lock:
+                self.file.write(line + "\n")
+            if line.startswith('{"type": "invocation"'):
+                self.events.put(("record", json.loads(line)))
+        return len(s)
+
+    def flush(self) -> None:
+        self.file.flush()
+
+
+class _Worker:
+    """
+    the runtime of one function inside its worker process
+    """
+
+    def __init__(self, name: str, provider: Provider, settings: dict, concurrency: int, events: multiprocessing.Queue) -> None:
+        self.name = name
+        self.provider = provider
+        self.settings = settings
+        self.events = events
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+        self.lock = threading.Lock()
+        self.entry = None
+        self.instances = 0
+        self.busy = 0
+
+    def _entry(self) -> typing.Callable:
+        # imported on the first invocation, like on the platform
+        with self.lock:
+            if self.entry is None:
+                module, function = ENTRIES[self.provider]
+                self.entry = getattr(__import__(module), function)
+            return self.entry
+
+    def _call(self, body: bytes) -> bytes:
+        entry = self._entry()
+        match self.provider:
+            case Provider.AWS:
+                context = types.SimpleNamespace(function_name=self.name, aws_request_id=uuid.uuid4().hex)
+                entry(json.loads(body), context)
+                return b""
+            case Provider.GCP:
+                # functions-framework depends on cloudevents, so it's there if the wrapper can be imported
+                from cloudevents.http import CloudEvent
+                attributes = {
+                    "type": "google.cloud.pubsub.topic.v1.messagePublished",
+                    "source": f"//pubsub.googleapis.com/topics/{self.name}-topic"
+                }
+                message = {"message": {"data": base64.b64encode(body).decode("ascii"), "messageId": uuid.uuid4().hex}}
+                entry(CloudEvent(attributes, message))
+                return b""
+            case Provider.tinyFaaS:
+                return (entry(body.decode("utf-8")) or "").encode("utf-8")
+
+    def handle(self, body: bytes) -> tuple[int, bytes]:
+        time.sleep(self.settings.get("delay", 0))
+        with self.lock:
+            cold = self.busy >= self.instances
+            if cold:
+                self.instances += 1
+            self.busy += 1
+        try:
+            if cold:
+                time.sleep(self.settings.get("cold_start", 0))
+            return 200, self._call(body)
+        except Exception:
+            try:
+                runId = json.loads(body)["workflow"].get("run_id", None)
+            except (ValueError, KeyError, AttributeError):
+                runId = None
+            print(traceback.format_exc())
+            self.events.put(("error", self.name, runId, traceback.format_exc()))
+            return 500, b""
+        finally:
+            with self.lock:
+                self.busy -= 1
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+
+    # keep-alive, invoke.py reuses its connections
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        worker = self.server.worker
+        if worker.provider == Provider.tinyFaaS and self.headers.get("X-tinyFaaS-Async", "").lower() != "true":
+            status, response = worker.handle(body)
+        else:
+            # lambda events, pub/sub messages and async tinyFaaS requests are queued, the caller doesn't wait for the function
+            worker.executor.submit(worker.handle, body)
+            status, response = 202, b""
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format: str, *args: typing.Any) -> None:
+        pass
+
+
+def _serve(name: str, functionDir: str, provider: Provider, settings: dict, concurrency: int, env: dict, logPath: str, events: multiprocessing.Queue) -> None:
+    """
+    entry point of a worker process
+    """
+    sys.stdout = sys.stderr = _Output(logPath, events)
+    os.environ.update(env)
+    os.chdir(functionDir)
+    # the function's modules have to win over the deployer's (wrapper/, main.py)
+    for module in [m for m in sys.modules if m == "wrapper" or m.startswith("wrapper.")]:
+        del sys.modules[module]
+    sys.path.insert(0, functionDir)
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.daemon_threads = True
+    server.worker = _Worker(name, provider, settings, concurrency, events)
+    events.put(("ready", name, server.server_address[1]))
+    server.serve_forever()
+
+
+class Emulator:
+
+    def __init__(self, deploymentDir: str = DEPLOYMENT_DIR, profile: typing.Optional[dict] = None, workDir: str = WORK_DIR, notified: bool = True) -> None:
+        self.deploymentDir = deploymentDir
+        self.profile = profile or load_profile(None)
+        self.workDir = os.path.abspath(workDir)
+        self.storeOptions = {"type": "local", "path": os.path.join(self.workDir, "store"), "latency": self.profile["store_delay"]}
+        self.notified = notified
+        self.workflow = None
+        self._broker = None
+        self._context = multiprocessing.get_context("spawn")
+        self._events = self._context.Queue()
+        self._processes = []
+        self._records = {}
+        self._errors = {}
+        self._condition = threading.Condition()
+
+    def __enter__(self) -> "Emulator":
+        self.start()
+        return self
+
+    def __exit__(self, *args: typing.Any) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        """
+        start one worker per deployed function and route the workflow to them
+        """
+        with open(os.path.join(self.deploymentDir, "workflow.json"), "r") as f:
+            workflow = json.load(f)
+        functions = find_functions(self.deploymentDir)
+        missing = sorted({s["function_name"] for s in workflow["plan"]["steps"].values()} - set(functions))
+        if len(missing) > 0:
+            raise ValueError(f"functions of the workflow aren't deployed: {', '.join(missing)} (run main.py first)")
+
+        shutil.rmtree(self.workDir, ignore_errors=True)
+        os.makedirs(os.path.join(self.workDir, "logs"))
+        env = {"WORKFLOW_OBJECT_STORE": json.dumps(self.storeOptions), "PYTHONUNBUFFERED": "1"}
+
+        for name, function in functions.items():
+            provider = Provider(function["config"]["provider"].lower())
+            process = self._context.Process(
+                target=_serve,
+                args=(
+                    name, function["dir"], provider, self.profile["providers"].get(provider.value, {}), self.profile["concurrency"],
+                    env, os.path.join(self.workDir, "logs", f"{name}.log"), self._events
+                ),
+                daemon=True
+            )
+            process.start()
+            self._processes.append(process)
+
+        urls = {}
+        while len(urls) < len(functions):
+            try:
+                event = self._events.get(timeout=30)
+            except queue.Empty:
+                self.stop()
+                raise TimeoutError(f"not all workers started, see {self.workDir}/logs")
+            if event[0] == "ready":
+                urls[event[1]] = f"http://127.0.0.1:{event[2]}/"
+        threading.Thread(target=self._collect, daemon=True).start()
+
+        # the plan is shared by all steps, only the invocation targets and the store change
+        # the envelope encodings stay the same, the workers get the bytes the platform would deliver
+        for step in workflow["plan"]["steps"].values():
+            name = step["function_name"]
+            encoding = step.get("invoke", {}).get("encoding", "json")
+            if Provider(functions[name]["config"]["provider"].lower()) == Provider.tinyFaaS:
+                step["invoke"] = {"type": "tinyfaas", "urls": [urls[name]], "encoding": encoding}
+            else:
+                step["invoke"] = {"type": "http", "url": urls[name], "encoding": encoding}
+        # a new id, so receivers of interned envelopes load the routed plan from the store instead of the deployed one
+        workflow["plan"]["id"] = plan.plan_id(workflow["plan"])
+        workflow["handoff"] = {**self.storeOptions, "timeout": (workflow.get("handoff", None) or {}).get("timeout", 120)}
+        if self.notified:
+            self._broker = notify.serve()
+            workflow["handoff"]["notify"] = {"type": "http", "url": f"http://127.0.0.1:{self._broker.server_address[1]}"}
+        self.workflow = workflow
+        print(f"emulating {', '.join(f'{n} ({u})' for n, u in urls.items())}, logs in {self.workDir}/logs")
+
+    def stop(self) -> None:
+        for process in self._processes:
+            process.terminate()
+        for process in self._processes:
+            process.join()
+        self._processes = []
+        if self._broker is not None:
+            self._broker.shutdown()
+            self._broker.server_close()
+            self._broker = None
+
+    def _collect(self) -> None:
+        while True:
+            try:
+                event = self._events.get()
+            except (EOFError, OSError):
+                return
+            with self._condition:
+                match event[0]:
+                    case "record":
+                        self._records.setdefault(event[1]["run_id"], []).append(event[1])
+                    case "error":
+                        _, name, runId, message = event
+                        self._errors.setdefault(runId, []).append(f"{name}: {message}")
+                self._condition.notify_all()
+
+    def upload(self, bucket: str, key: str, path: str) -> None:
+        """
+        put an object into the local object store
+        """
+        with open(path, "rb") as f:
+            handoff.open_bucket({**self.storeOptions, "latency": 0}, bucket).put_stream(key, f)
+
+    def run(self, body: typing.Any, data: typing.Optional[list[dict]] = None, timeout: float = 300) -> list[dict]:
+        """
+        invoke the workflow's entry step and wait until every step has finished
+        :param data: objects the pre-fetching steps download, see wrapper.py
+        :return: the timing records of the run (see telemetry.py)
+        """
+        runId = uuid.uuid4().hex
+        workflow = {**self.workflow, "run_id": runId, "data": data or []}
+        # the complete envelope, the entry step doesn't know the routed plan yet
+        self._invoke_entry({"workflow": workflow, "body": body})
+        return self._wait(runId, time.monotonic() + timeout)
+
+    def run_batch(self, bodies: list[typing.Any], data: typing.Optional[list[dict]] = None, timeout: float = 300) -> list[list[dict]]:
+        """
+        like `run`, but all runs are sent to the entry step in one batch envelope (see wrapper/batch.py)
+        :return: the timing records of every run
+        """
+        items = [{"run_id": uuid.uuid4().hex, "body": body, "data": data or []} for body in bodies]
+        self._invoke_entry({"workflow": self.workflow, "batch": items})
+        deadline = time.monotonic() + timeout
+        return [self._wait(item["run_id"], deadline) for item in items]
+
+    def _invoke_entry(self, payload: dict) -> None:
+        entry = self.workflow["plan"]["steps"][str(self.workflow["plan"]["entries"][0])]
+        invoke.invoke(entry["invoke"], json.dumps(payload).encode("utf-8")).result()
+
+    def _wait(self, runId: str, deadline: float) -> list[dict]:
+        steps = len(self.workflow["plan"]["steps"])
+        with self._condition:
+            while len({r["step_id"] for r in self._records.get(runId, [])}) < steps:
+                if runId in self._errors or None in self._errors:
+                    raise RuntimeError(f"run {runId} failed:\n" + "\n".join(self._errors.get(runId, []) + self._errors.get(None, [])))
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"run {runId} didn't finish in time, see {self.workDir}/logs")
+                self._condition.wait(remaining)
+            return self._records.pop(runId)
+
+
+def parse_upload(value: str) -> tuple[str, str, str]:
+    """
+    "bucket/key=path" -> (bucket, key, path)
+    """
+    ref, path = value.split("=", 1)
+    bucket, key = ref.split("/", 1)
+    return bucket, key, path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="run the workflow in ../deployment locally")
+    parser.add_argument("--body", default="{}", help="input of the first step (json)")
+    parser.add_argument("--upload", action="append", default=[], help="bucket/key=path, uploaded before the runs and pre-fetched by the steps")
+    parser.add_argument("--runs", type=int, default=1, help="number of workflow runs")
+    parser.add_argument("--concurrency", type=int, default=1, help="number of runs at the same time")
+    parser.add_argument("--batch", type=int, default=1, help="send this many runs per invocation of the entry step")
+    parser.add_argument("--poll", action="store_true", help="waiting steps poll the handoff store instead of being notified")
+    parser.add_argument("--profile", default=None, help="json file with delays, see PROFILE")
+    parser.add_argument("--json", action="store_true", help="print the analysis of every run as json")
+    args = parser.parse_args()
+
+    with Emulator(profile=load_profile(args.profile), notified=not args.poll) as emulator:
+        data = []
+        for value in args.upload:
+            bucket, key, path = parse_upload(value)
+            emulator.upload(bucket, key, path)
+            data.append({"bucket": bucket, "key": key})
+
+        start = time.time()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(args.concurrency, 1)) as executor:
+            if args.batch > 1:
+                sizes = [min(args.batch, args.runs - i) for i in range(0, args.runs, args.batch)]
+                futures = [executor.submit(emulator.run_batch, [json.loads(args.body)] * n, data) for n in sizes]
+                runs = [collector.analyze_run(records) for future in futures for records in future.result()]
+            else:
+                futures = [executor.submit(emulator.run, json.loads(args.body), data) for _ in range(args.runs)]
+                runs = [collector.analyze_run(future.result()) for future in futures]
+        duration = time.time() - start
+
+    if args.json:
+        print(json.dumps(runs, indent=4))
+        return
+    for run in runs:
+        collector.print_run(run)
+    durations = [run["duration_ms"] for run in runs]
+    print(f"{len(runs)} runs in {duration:.2f}s ({len(runs) / duration:.2f} runs/s)")
+    print(f"latency: mean {statistics.mean(durations):.1f} ms, min {min(durations):.1f} ms, max {max(durations):.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
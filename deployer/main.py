@@ -1,14 +1,42 @@
+import argparse
+import concurrent.futures
 import json
 import os
+import re
 import sys
 import subprocess
 import shutil
 
+import build
+import deploy
+import package
 from asdf import Provider, Serverless, TinyFaaSEnv, TinyFaaSNode, Function, NewFunction
 from utils import dict2yaml
+from wrapper.plan import compile_workflow
 
 
 config = "../config.json"
+workflow = "../workflow.json"
+
+aws_runtime = "python3.10"
+
+# modules of the wrapper layer that every platform wrapper imports
+# they are copied next to the platform wrapper for each function
+wrapper_modules = [
+    "wrapper.py",
+    "adaptive.py",
+    "batch.py",
+    "cache.py",
+    "envelope.py",
+    "handoff.py",
+    "invoke.py",
+    "notify.py",
+    "objects.py",
+    "plan.py",
+    "references.py",
+    "resources.py",
+    "telemetry.py"
+]
 
 
 def create_service(provider: Provider) -> None:
@@ -48,8 +76,7 @@ def get_provider(function: dict) -> Provider:
             raise ValueError(f"Invalid provider: {function['provider']}")
 
 
-# this only works for functions, not docker containers
-# TODO add support for docker containers
+# docker functions are built from the Dockerfile in their deployment directory and pushed to ecr by serverless
 def generate_aws(sls: Serverless, fn: Function) -> str:
     result = {
         "org": sls.org,
@@ -59,7 +86,7 @@ def generate_aws(sls: Serverless, fn: Function) -> str:
         "provider": {
             "name": "aws",
             "timeout": 180,
-            "runtime": "python3.10",
+            "runtime": aws_runtime,
             "architecture": "arm64"
         },
         "functions": {
@@ -78,6 +105,12 @@ def generate_aws(sls: Serverless, fn: Function) -> str:
             }
         }
     }
+    if fn.docker:
+        # the image's CMD is the handler (wrapper_aws.wrapper_aws, see functions/ocr/Dockerfile)
+        del result["provider"]["runtime"]
+        result["provider"]["ecr"] = {"images": {fn.name: {"path": "./"}}}
+        del result["functions"][fn.name]["handler"]
+        result["functions"][fn.name]["image"] = {"name": fn.name}
     if fn.region is not None:
         result["provider"]["region"] = fn.region
     return dict2yaml(result)
@@ -100,7 +133,7 @@ def generate_gcp(sls: Serverless, project: str, fn: Function) -> str:
                     {
                         "event": {
                             "eventType": "providers/cloud.pubsub/eventTypes/topic.publish",
-                            "resource": 'projects/${self:provider.project, \"\"}/topics/my-topic'
+                            "resource": f'projects/${{self:provider.project, \"\"}}/topics/{fn.name}-topic'
                         }
                     }
                 ]
@@ -165,19 +198,84 @@ def generate_serverless(config: dict, sls: Serverless, fn: Function) -> None:
             )
 
         case _:
-            raise TypeError(f"unknown provider {fn["provider"]} is not supported")
+            raise TypeError(f"unknown provider {fn.provider} is not supported")
     return res
 
 
-def handle_aws_requirements(requirementsPath: str, targetDir: str) -> None:
+def invoke_target(config: dict, fn: Function) -> dict:
+    """
+    returns how the wrappers invoke a function (see wrapper/invoke.py)
+    the envelope encoding depends on what the transport carries (see wrapper/envelope.py):
+    lambda payloads and tinyFaaS requests have to be json, pub/sub messages are bytes
+    """
+    match fn.provider:
+        case Provider.AWS:
+            # serverless names lambda functions <service>-<stage>-<function>, the default stage is dev
+            return {"type": "lambda", "function": f"{fn.service}-dev-{fn.name}", "region": fn.region, "encoding": "compact"}
+        case Provider.GCP:
+            return {"type": "pubsub", "topic": f"projects/{config['providers']['GCP']['project']}/topics/{fn.name}-topic", "encoding": "binary"}
+        case Provider.tinyFaaS:
+            nodes = {node["name"]: node["url"] for node in config["providers"]["tinyFaaS"]["nodes"]}
+            urls = []
+            for node in fn.tinyFaaS_options["deployTo"]:
+                name = node["name"] if isinstance(node, dict) else node
+                urls.append(f"{nodes[name]}/{fn.name}")
+            return {"type": "tinyfaas", "urls": urls, "encoding": "compact"}
+        case _:
+            raise TypeError(f"unknown provider {fn.provider} is not supported")
+
+
+# packages the wrappers import to invoke a target of this type, see wrapper/invoke.py
+invoke_requirements = {
+    "lambda": ["boto3"],
+    "pubsub": ["google-cloud-pubsub"]
+}
+
+
+def invoked_steps(w: dict, function: str) -> list[dict]:
+    """
+    :return: the steps that the wrapper of `function` invokes or pings (see wrapper.get_next_steps and wrapper.prewarm)
+    """
+    plan = w["plan"]
+    steps = {}
+    for step in plan["steps"].values():
+        if step["function_name"] != function:
+            continue
+        for id in step["successors"]:
+            steps[id] = plan["steps"][str(id)]
+        # the first step of a run starts the other entry steps and pings the steps with "prewarm"
+        if len(plan["entries"]) > 0 and step["id"] == plan["entries"][0]:
+            for other in plan["steps"].values():
+                if other["id"] in plan["entries"][1:] or other.get("prewarm", False):
+                    steps[other["id"]] = other
+    return list(steps.values())
+
+
+def write_requirements(src: str, dst: str, w: dict, function: str) -> None:
+    """
+    copy the function's requirements and add the packages its wrapper needs to invoke the next steps,
+    e.g. google-cloud-pubsub for an aws function whose successor runs on gcp
+    """
+    with open(src, "r") as f:
+        lines = [line.rstrip("\n") for line in f]
+    # "boto3==1.34" -> "boto3"
+    names = {re.split(r"[\s<>=!~\[;]", line.split("#")[0].strip(), maxsplit=1)[0].lower() for line in lines}
+    for step in invoked_steps(w, function):
+        for requirement in invoke_requirements.get(step.get("invoke", {}).get("type", None), []):
+            if requirement not in names:
+                print(f"> adding {requirement} to the requirements of {function} to invoke {step['function_name']}")
+                lines.append(requirement)
+                names.add(requirement)
+    with open(dst, "w") as f:
+        f.write("\n".join(line for line in lines if line.strip() != "") + "\n")
 
-    cmd = f"pip install -t {targetDir} -r {requirementsPath}"
+
+def handle_aws_requirements(requirementsPath: str, targetDir: str) -> None:
 
     try:
         print(f"installing requirements for aws lambda function")
-        result = subprocess.run(cmd, shell=True, check=True, capture_output=True, text=True)
-        print(f"result of requirements installation: {result.stdout}")
-        print(f"error: {result.stderr}")
+        # functions with the same requirements share one installation, see build.py
+        build.install_requirements(requirementsPath, targetDir)
 
     except subprocess.CalledProcessError as e:
         print(f"couldn't install requirements {requirementsPath} for lambda function")
@@ -185,6 +283,21 @@ def handle_aws_requirements(requirementsPath: str, targetDir: str) -> None:
         sys.exit(1)
 
 
+def copy_wrapper_modules(targetDir: str) -> None:
+    for module in wrapper_modules:
+        shutil.copyfile(f"./wrapper/{module}", f"{targetDir}/{module}")
+
+
+def write_function_files(targetDir: str, fDict: dict, compiledWorkflow: dict) -> None:
+    """
+    the wrapper's resource cache loads these once per container (see wrapper/resources.py)
+    """
+    with open(f"{targetDir}/function.json", "w") as file:
+        json.dump(fDict, file, indent=4)
+    with open(f"{targetDir}/workflow.json", "w") as file:
+        json.dump(compiledWorkflow, file, indent=4)
+
+
 def generate_serverless_compose(functions: list[str]) -> str:
     res = {"services": {}}
     for function in functions:
@@ -193,13 +306,196 @@ def generate_serverless_compose(functions: list[str]) -> str:
     return res
 
 
+def build_function(c: dict, serverless: Serverless, function: str, w: dict, packaging: dict) -> tuple[str, str]:
+    """
+    create the deployment directory of one function, structured according to its provider
+    the directory is only rebuilt if one of its inputs changed since the last build (see build.py)
+    `packaging` holds the options for functions with installed requirements: {"prune": bool, "precompile": bool, "report": bool}
+    this runs in a worker process, see main()
+    :return: (function name, "built" | "unchanged")
+    """
+    fn = NewFunction(function, c["functions"][function])
+    targetDir = f"../deployment/{fn.name}"
+
+    sls = generate_serverless(c, serverless, fn)
+    buildHash = build.hash_inputs(
+        [
+            f"../functions/{fn.name}/main.py",
+            f"../functions/{fn.name}/requirements.txt",
+            f"../functions/{fn.name}/Dockerfile",
+            f"./wrapper/{fn.platformwrapper}"
+        ] + [f"./wrapper/{module}" for module in wrapper_modules],
+        [sls, json.dumps(c["functions"][function], sort_keys=True), json.dumps(w, sort_keys=True), json.dumps(packaging, sort_keys=True)]
+    )
+    if build.is_up_to_date(targetDir, buildHash):
+        print(f"> {fn.name} is up to date, reusing {targetDir}")
+        return fn.name, "unchanged"
+
+    # subdirectory
+    if os.path.exists(targetDir):
+        shutil.rmtree(targetDir)
+    print(f"> creating new subdir for {fn.name}")
+    os.makedirs(f"../deployment/{fn.name}/") # TODO adjust accordingly in serverless.yml generating functions
+
+    match fn.provider:
+        # TODO add prints?
+        case Provider.AWS:
+            """
+            expected structure:
+            ./
+            - main.py
+            - wrapper_aws.py
+            - wrapper.py, adaptive.py, batch.py, cache.py, envelope.py, handoff.py, invoke.py, notify.py, objects.py, plan.py, references.py, resources.py, telemetry.py
+            - function.json, workflow.json
+            - serverless.yml
+            - requirements.txt
+            - module-1/
+                - ...
+            - module-2/
+                - ...
+            docker functions (e.g. ocr) get their Dockerfile instead of the installed modules
+            """
+
+            # 1. main.py
+            src = f"../functions/{fn.name}/main.py"
+            dst = f"../deployment/{fn.name}/main.py"
+            shutil.copyfile(src, dst)
+
+            # 2. aws wrapper + wrapper
+            src = f"./wrapper/wrapper_aws.py"
+            dst = f"../deployment/{fn.name}/wrapper_aws.py"
+            shutil.copyfile(src, dst)
+
+            copy_wrapper_modules(f"../deployment/{fn.name}")
+            write_function_files(f"../deployment/{fn.name}", c["functions"][function], w)
+
+            # 3. serverless.yml
+            with open(f"../deployment/{fn.name}/serverless.yml", "w") as file:
+                file.write(sls)
+
+            # 4. requirements
+            src = f"../functions/{fn.name}/requirements.txt"
+            dst = f"../deployment/{fn.name}/requirements.txt"
+            write_requirements(src, dst, w, fn.name)
+
+            # 5. docker functions install their requirements when the image is built
+            if fn.docker:
+                src = f"../functions/{fn.name}/Dockerfile"
+                dst = f"../deployment/{fn.name}/Dockerfile"
+                shutil.copyfile(src, dst)
+            else:
+                # 6. download imported module code
+                own = os.listdir(targetDir)
+                handle_aws_requirements(dst, f"../deployment/{fn.name}/") 
+
+                # 7. slim down the package, it is unzipped and imported on every cold start
+                if packaging["prune"]:
+                    removed = package.prune(targetDir, own)
+                    print(f"> pruned {removed} bytes from {fn.name}")
+                if packaging["precompile"]:
+                    package.precompile(targetDir, aws_runtime)
+                if packaging["report"]:
+                    os.makedirs("../deployment/reports", exist_ok=True)
+                    with open(f"../deployment/reports/{fn.name}-package.json", "w") as file:
+                        json.dump(package.report(targetDir, own, "wrapper_aws"), file, indent=4)
+
+        case Provider.GCP:
+            """
+            expected structure:
+            ./
+            - main.py (previously `wrapper_gcp_pubsub.py`)
+            - user_main.py (previously main.py)
+            - wrapper.py, adaptive.py, batch.py, cache.py, envelope.py, handoff.py, invoke.py, notify.py, objects.py, plan.py, references.py, resources.py, telemetry.py
+            - function.json, workflow.json
+            - serverless.yml
+            - requirements.txt
+            """
+
+            # 1. main.py
+            src = f"../functions/{fn.name}/main.py" 
+            dst = f"../deployment/{fn.name}/user_main.py"
+            shutil.copyfile(src, dst)
+
+            # 2. google cloud wrapper & wrapper.py
+            src = f"./wrapper/wrapper_gcp_pubsub.py"
+            dst = f"../deployment/{fn.name}/main.py"
+            shutil.copyfile(src, dst) 
+
+            copy_wrapper_modules(f"../deployment/{fn.name}")
+            write_function_files(f"../deployment/{fn.name}", c["functions"][function], w)
+
+            # 3. serverless.yml
+            with open(f"../deployment/{fn.name}/serverless.yml", "w") as file:
+                file.write(sls)
+
+            # 4. requriements
+            src = f"../functions/{fn.name}/requirements.txt"
+            dst = f"../deployment/{fn.name}/requirements.txt"
+            write_requirements(src, dst, w, fn.name)
+
+        case Provider.tinyFaaS:
+            """
+            expected structure:
+            ./
+            - serverless.yml
+            - functions/
+                - `function-name`/
+                    - main.py
+                    - requirements.txt
+                    - wrapper.py, adaptive.py, batch.py, cache.py, envelope.py, handoff.py, invoke.py, notify.py, objects.py, plan.py, references.py, resources.py, telemetry.py
+                    - function.json, workflow.json
+                    - wrapper_tinyfaas.py
+            # TODO make sure the fn.fn import stuff from tinyfaas works if the fn function isn't in main.py
+            # TODO this sturcture should work for deploying (although sls says the opposite), but test with a different function than email
+            """
+
+            # serverless-tinyfaas expects a slightly different stucture than sls for aws/google
+            os.makedirs(f"../deployment/{fn.name}/functions/{fn.name}")
+
+            # 1. main.py
+            src = f"../functions/{fn.name}/main.py" 
+            dst = f"../deployment/{fn.name}/functions/{fn.name}/main.py"
+            shutil.copyfile(src, dst)
+
+            # 2. tinyfaas wrapper & wrapper.py
+            src = f"./wrapper/wrapper_tinyfaas.py"
+            dst = f"../deployment/{fn.name}/functions/{fn.name}/wrapper_tinyfaas.py"
+            shutil.copyfile(src, dst) 
+
+            copy_wrapper_modules(f"../deployment/{fn.name}/functions/{fn.name}")
+            write_function_files(f"../deployment/{fn.name}/functions/{fn.name}", c["functions"][function], w)
+            
+            # 3. serverless.yml
+            with open(f"../deployment/{fn.name}/serverless.yml", "w") as file:
+                file.write(sls)
+
+            # 4. requriements
+            src = f"../functions/{fn.name}/requirements.txt"
+            dst = f"../deployment/{fn.name}/functions/{fn.name}/requirements.txt"
+            write_requirements(src, dst, w, fn.name)
+
+    build.mark_built(targetDir, buildHash)
+    return fn.name, "built"
+
+
 # deploy all services 
 # - Option 1: use serverless compose: https://www.serverless.com/blog/serverless-framework-compose-multi-service-deployments
 # - Option 2: use subprocess to call `sls deploy` for each service
+#   => this is what deploy.py does, concurrently (see --deploy)
 
 
 def main() -> None:
 
+    parser = argparse.ArgumentParser(description="build the deployment directory for all functions in config.json")
+    parser.add_argument("--clean", action="store_true", help="remove the existing deployment directory and rebuild everything")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="number of functions to package in parallel")
+    parser.add_argument("--no-prune", action="store_true", help="keep tests, docs, caches etc. of installed requirements")
+    parser.add_argument("--precompile", action="store_true", help="precompile installed requirements (needs a local interpreter matching the runtime)")
+    parser.add_argument("--package-report", action="store_true", help="write size and import time per package to ../deployment/reports")
+    parser.add_argument("--deploy", action="store_true", help="deploy the changed services after building them")
+    parser.add_argument("--deploy-jobs", type=int, default=4, help="number of services to deploy concurrently")
+    args = parser.parse_args()
+
     with open(config, 'r') as f:
         c = json.load(f)
 
@@ -208,162 +504,57 @@ def main() -> None:
     serverless = Serverless(s["org"], s["app"], s["frameworkVersion"])
 
     # create a new directory for the deployment
+    # an existing one is updated incrementally unless --clean is given
+    if args.clean and os.path.exists("../deployment"):
+        print("removing existing deployment directory")
+        shutil.rmtree("../deployment")
     print("creating deployment directory")
-    if not os.path.exists("../deployment"):
-        os.makedirs("../deployment")
-    else:
-        print("error: deployment directory already exists.")
-        sys.exit(1)
-
-    deployed_fns = []
+    os.makedirs("../deployment", exist_ok=True)
+
+    # compile the workflow once, the wrappers only do lookups in the compiled plan
+    # the compiled workflow is what the first step has to be invoked with
+    with open(workflow, 'r') as f:
+        w = json.load(f)
+    for step in w["steps"]:
+        if "invoke" not in step and step["function_name"] in functions:
+            step["invoke"] = invoke_target(c, NewFunction(step["function_name"], functions[step["function_name"]]))
+    w = compile_workflow(w)
+    with open("../deployment/workflow.json", "w") as file:
+        json.dump(w, file, indent=4)
 
     # create new subdir for each function structure according to provider
+    # functions are packaged in parallel, unchanged functions are skipped
+    names = []
     for function in functions.keys():
 
-        print(function, functions[function])  # TODO remove
-        fn = NewFunction(function, functions[function])
-
         # TODO remove
-        if fn.name == "ocr" or fn.name == "tinyfaas-example":
-            print("warning: skipping function OCR")
+        if function.lower() == "tinyfaas-example":
+            print(f"warning: skipping function {function}")
             continue
+        names.append(function)
 
-        # subdirectory
-        print(f"> creating new subdir for {fn.name}")
-        os.makedirs(f"../deployment/{fn.name}/") # TODO adjust accordingly in serverless.yml generating functions
-
-        match fn.provider:
-            # TODO add prints?
-            case Provider.AWS:
-                """
-                expected structure:
-                ./
-                - main.py
-                - wrapper_aws.py
-                - wrapper.py
-                - serverless.yml
-                - requirements.txt
-                - module-1/
-                    - ...
-                - module-2/
-                    - ...
-                """
-
-                # 1. main.py
-                src = f"../functions/{fn.name}/main.py"
-                dst = f"../deployment/{fn.name}/main.py"
-                shutil.copyfile(src, dst)
-
-                # 2. aws wrapper + wrapper
-                src = f"./wrapper/wrapper_aws.py"
-                dst = f"../deployment/{fn.name}/wrapper_aws.py"
-                shutil.copyfile(src, dst)
-
-                src = f"./wrapper/wrapper.py"
-                dst = f"../deployment/{fn.name}/wrapper.py"
-                shutil.copyfile(src, dst)
-
-                # 3. serverless.yml
-                sls = generate_serverless(c, serverless, fn)
-                with open(f"../deployment/{fn.name}/serverless.yml", "w") as file:
-                    file.write(sls)
-
-                # 4. requirements
-                src = f"../functions/{fn.name}/requirements.txt"
-                dst = f"../deployment/{fn.name}/requirements.txt"
-                shutil.copyfile(src, dst)
-
-                # 5. download imported module code
-                handle_aws_requirements(dst, f"../deployment/{fn.name}/") 
-
-            case Provider.GCP:
-                """
-                expected structure:
-                ./
-                - main.py (previously `wrapper_gcp_pubsub.py`)
-                - user_main.py (previously main.py)
-                - wrapper.py
-                - serverless.yml
-                - requirements.txt
-                """
-
-                # 1. main.py
-                src = f"../functions/{fn.name}/main.py" 
-                dst = f"../deployment/{fn.name}/user_main.py"
-                shutil.copyfile(src, dst)
-
-                # 2. google cloud wrapper & wrapper.py
-                src = f"./wrapper/wrapper_gcp_pubsub.py"
-                dst = f"../deployment/{fn.name}/main.py"
-                shutil.copyfile(src, dst) 
-
-                src = f"./wrapper/wrapper.py"
-                dst = f"../deployment/{fn.name}/wrapper.py"
-                shutil.copyfile(src, dst) 
-
-                # 3. serverless.yml
-                sls = generate_serverless(c, serverless, fn)
-                with open(f"../deployment/{fn.name}/serverless.yml", "w") as file:
-                    file.write(sls)
-
-                # 4. requriements
-                src = f"../functions/{fn.name}/requirements.txt"
-                dst = f"../deployment/{fn.name}/requirements.txt"
-                shutil.copyfile(src, dst)
-
-            case Provider.tinyFaaS:
-                """
-                expected structure:
-                ./
-                - serverless.yml
-                - functions/
-                    - `function-name`/
-                        - main.py
-                        - requirements.txt
-                        - wrapper.py
-                        - wrapper_tinyfaas.py
-                # TODO make sure the fn.fn import stuff from tinyfaas works if the fn function isn't in main.py
-                # TODO this sturcture should work for deploying (although sls says the opposite), but test with a different function than email
-                """
-
-                # serverless-tinyfaas expects a slightly different stucture than sls for aws/google
-                os.makedirs(f"../deployment/{fn.name}/functions/{fn.name}")
-
-                # 1. main.py
-                src = f"../functions/{fn.name}/main.py" 
-                dst = f"../deployment/{fn.name}/functions/{fn.name}/main.py"
-                shutil.copyfile(src, dst)
-
-                # 2. tinyfaas wrapper & wrapper.py
-                src = f"./wrapper/wrapper_tinyfaas.py"
-                dst = f"../deployment/{fn.name}/functions/{fn.name}/wrapper_tinyfaas.py"
-                shutil.copyfile(src, dst) 
-
-                src = f"./wrapper/wrapper.py"
-                dst = f"../deployment/{fn.name}/functions/{fn.name}/wrapper.py"
-                shutil.copyfile(src, dst) 
-                
-                # 3. serverless.yml
-                sls = generate_serverless(c, serverless, fn)
-                with open(f"../deployment/{fn.name}/serverless.yml", "w") as file:
-                    file.write(sls)
-
-                # 4. requriements
-                src = f"../functions/{fn.name}/requirements.txt"
-                dst = f"../deployment/{fn.name}/functions/{fn.name}/requirements.txt"
-                shutil.copyfile(src, dst)
-
-        # store to create serverless compose yml later
-        deployed_fns.append(fn.name)
+    packaging = {"prune": not args.no_prune, "precompile": args.precompile, "report": args.package_report}
+    deployed_fns = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = [executor.submit(build_function, c, serverless, function, w, packaging) for function in names]
+        for future in futures:
+            name, status = future.result()
+            print(f"{name}: {status}")
+            # store to create serverless compose yml later
+            deployed_fns.append(name)
 
     # generate the serverless compose file
     sc = generate_serverless_compose(deployed_fns)
     print(sc)
     with open(f"../deployment/serverless-compose.yml", "w") as file:
         file.write(dict2yaml(sc))
-    
-    # TODO deploy!
-    #subprocess.run("cd ../deployment && sls deploy", shell=True, check=True)
+
+    # deploy the services concurrently, only the ones that changed since their last deployment
+    if args.deploy:
+        report = deploy.deploy_services(deployed_fns, jobs=args.deploy_jobs)
+        if not report["ok"]:
+            print("error: not all services were deployed, see ../deployment/deploy-report.json")
+            sys.exit(1)
     
 
 if __name__ == '__main__':
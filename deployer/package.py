@@ -0,0 +1,149 @@
+"""
+packaging stage for function directories with installed requirements (aws lambda)
+
+- prune: removes files the function never needs at runtime (bytecode caches, tests, docs,
+  dist-info extras, type stubs, c sources, console scripts), this shrinks the zip that has to be unpacked on cold starts
+- precompile: writes bytecode for the target runtime so the first import doesn't have to compile,
+  this only works if the local interpreter has the same version as the runtime
+- report: size and measured import time per top-level package
+"""
+
+import compileall
+import os
+import re
+import shutil
+import subprocess
+import sys
+import typing
+
+
+# directories and files inside installed packages that are removed by `prune`
+PRUNE_DIRS = {"__pycache__", "tests"}
+# these are only removed if they aren't packages, e.g. botocore imports botocore.docs at runtime
+PRUNE_DATA_DIRS = {"docs", "doc", "examples"}
+PRUNE_SUFFIXES = (".pyc", ".pyo", ".pyi", ".c", ".h", ".pxd", ".pyx", ".md", ".rst")
+# dist-info files that are kept, importlib.metadata needs them (e.g. for version lookups)
+KEEP_DIST_INFO = {"METADATA", "entry_points.txt", "top_level.txt"}
+
+
+def installed_entries(targetDir: str, own: typing.Iterable[str]) -> list[str]:
+    """
+    :param own: names of the files the deployer put into the directory itself (handler, wrappers, ...)
+    :return: top-level entries that were installed by pip
+    """
+    own = set(own)
+    return sorted(e for e in os.listdir(targetDir) if e not in own and not e.startswith("."))
+
+
+def prune(targetDir: str, own: typing.Iterable[str]) -> int:
+    """
+    :return: the number of bytes removed
+    """
+    removed = 0
+    for entry in installed_entries(targetDir, own):
+        path = os.path.join(targetDir, entry)
+        if entry == "bin":
+            # console scripts, lambda never runs them
+            removed += size(path)
+            shutil.rmtree(path)
+            continue
+        if entry.endswith(".dist-info"):
+            for name in os.listdir(path):
+                if name not in KEEP_DIST_INFO:
+                    p = os.path.join(path, name)
+                    removed += size(p)
+                    if os.path.isdir(p):
+                        shutil.rmtree(p)
+                    else:
+                        os.remove(p)
+            continue
+        if not os.path.isdir(path):
+            continue
+        for root, dirs, files in os.walk(path, topdown=True):
+            prunable = [
+                d for d in dirs
+                if d in PRUNE_DIRS or (d in PRUNE_DATA_DIRS and not os.path.exists(os.path.join(root, d, "__init__.py")))
+            ]
+            for d in prunable:
+                removed += size(os.path.join(root, d))
+                shutil.rmtree(os.path.join(root, d))
+                dirs.remove(d)
+            for f in files:
+                if f.endswith(PRUNE_SUFFIXES):
+                    removed += os.path.getsize(os.path.join(root, f))
+                    os.remove(os.path.join(root, f))
+    return removed
+
+
+def runtime_version(runtime: str) -> typing.Optional[tuple[int, int]]:
+    """
+    "python3.10" -> (3, 10), "python39" -> (3, 9)
+    """
+    match = re.fullmatch(r"python(\d)\.?(\d+)", runtime)
+    if match is None:
+        return None
+    return int(match.group(1)), int(match.group(2))
+
+
+def precompile(targetDir: str, runtime: str) -> bool:
+    """
+    :return: False if the local interpreter can't produce bytecode for `runtime`
+    """
+    if runtime_version(runtime) != sys.version_info[:2]:
+        print(f"warning: not precompiling for {runtime}, the local interpreter is python{sys.version_info[0]}.{sys.version_info[1]}")
+        return False
+    return compileall.compile_dir(targetDir, quiet=1, workers=0)
+
+
+def size(path: str) -> int:
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            total += os.path.getsize(os.path.join(root, f))
+    return total
+
+
+def import_time(targetDir: str, module: str) -> typing.Optional[int]:
+    """
+    measure the cumulative import time of a module in a fresh interpreter
+    :return: microseconds or None if the module can't be imported locally (e.g. binary wheels for another platform)
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=targetDir, capture_output=True, text=True, env={**os.environ, "PYTHONPATH": targetDir}
+    )
+    if result.returncode != 0:
+        return None
+    # lines look like: "import time:       123 |       4567 | module"
+    for line in reversed(result.stderr.splitlines()):
+        parts = [p.strip() for p in line.split("|")]
+        if len(parts) == 3 and parts[2] == module:
+            return int(parts[1])
+    return None
+
+
+def report(targetDir: str, own: typing.Iterable[str], entry: str) -> dict:
+    """
+    :param entry: the module the platform imports first (e.g. wrapper_aws), its import time includes all requirements
+    """
+    packages = []
+    for e in installed_entries(targetDir, own):
+        path = os.path.join(targetDir, e)
+        module = None
+        if os.path.isdir(path) and not e.endswith((".dist-info", ".data")) and e != "bin":
+            module = e
+        elif e.endswith(".py"):
+            module = e[:-3]
+        packages.append({
+            "name": e,
+            "bytes": size(path),
+            "importTimeUs": import_time(targetDir, module) if module is not None else None
+        })
+    return {
+        "totalBytes": size(targetDir),
+        "entry": entry,
+        "entryImportTimeUs": import_time(targetDir, entry),
+        "packages": sorted(packages, key=lambda p: p["bytes"], reverse=True)
+    }
@@ -0,0 +1,260 @@
+"""
+placement planner: choose the provider and region of every function from measurements
+
+a location is "<provider>/<region>", tinyFaaS locations use the node name instead of the region,
+e.g. "AWS/us-east-1", "google/europe-west10-a", "tinyFaaS/tf-node-0"
+
+# measurements example
+{
+    "data": {"location": "AWS/us-east-1", "mb": 2.5},       # the objects every step reads (the pdf)
+    "network": {                                            # symmetric, between locations
+        "AWS/us-east-1 <-> google/europe-west10-a": {"latency_ms": 95, "mb_per_s": 40},
+        "default": {"latency_ms": 150, "mb_per_s": 20}      # optional, for all other pairs
+    },
+    "functions": {                                          # a function can only be placed where it was measured
+        "check": {
+            "AWS/us-east-1": {"exec_ms": 230, "cold_start_ms": 800, "cost": 0.0000021},
+            "google/europe-west10-a": {"exec_ms": 310, "cold_start_ms": 1200, "cost": 0.0000025}
+        },
+        ...
+    },
+    "cold_start_rate": 0.1,                                 # share of invocations that are cold
+    "egress_cost_per_mb": {"AWS": 0.00009, "google": 0.00012, "tinyFaaS": 0}
+}
+timing records (see wrapper/telemetry.py) can be passed with --records, they fill in exec_ms and
+cold_start_ms (import time) of each function at its current location
+
+the estimate follows the choreography of wrapper.py:
+- pre-fetching steps are invoked when their first predecessor starts and download the data in the meantime
+- all other steps are invoked when their last predecessor has finished and download the data afterwards
+
+usage: python placement.py measurements.json [--records log ...] [--objective latency|cost] [--write]
+"""
+
+import argparse
+import itertools
+import json
+import typing
+
+import collector
+from asdf import Provider
+from wrapper.plan import compile_workflow
+
+
+config = "../config.json"
+workflow = "../workflow.json"
+
+# assignments are searched exhaustively up to this many combinations, greedily otherwise
+EXHAUSTIVE_LIMIT = 200000
+
+# telemetry platform names -> providers
+PLATFORMS = {"aws": Provider.AWS, "gcp": Provider.GCP, "gcp-http": Provider.GCP, "tinyfaas": Provider.tinyFaaS}
+
+
+def location_provider(location: str) -> Provider:
+    return Provider(location.split("/", 1)[0].lower())
+
+
+def current_location(fDict: dict) -> str:
+    match Provider(fDict["provider"].lower()):
+        case Provider.tinyFaaS:
+            node = fDict["tinyFaaS_options"]["deployTo"][0]
+            return f"{fDict['provider']}/{node['name'] if isinstance(node, dict) else node}"
+        case _:
+            return f"{fDict['provider']}/{fDict.get('region', None)}"
+
+
+def network(measurements: dict, a: str, b: str) -> dict:
+    """
+    :return: {"latency_ms": ..., "mb_per_s": ...} between two locations
+    """
+    if a == b:
+        return {"latency_ms": 0, "mb_per_s": None}
+    links = measurements.get("network", {})
+    for key in [f"{a} <-> {b}", f"{b} <-> {a}", "default"]:
+        if key in links:
+            return links[key]
+    raise ValueError(f"no network measurements between {a} and {b}")
+
+
+def transfer_ms(measurements: dict, a: str, b: str, mb: float) -> float:
+    link = network(measurements, a, b)
+    if link["mb_per_s"] is None:
+        return link["latency_ms"]
+    return link["latency_ms"] + mb / link["mb_per_s"] * 1000
+
+
+def estimate(plan: dict, measurements: dict, assignment: dict) -> dict:
+    """
+    :param assignment: function name -> location
+    :return: {"latency_ms": ..., "cost": ...} of one workflow run
+    """
+    data = measurements.get("data", None)
+    coldRate = measurements.get("cold_start_rate", 0)
+    egress = measurements.get("egress_cost_per_mb", {})
+    started = {}
+    finished = {}
+    cost = 0.0
+    for id in plan["order"]:
+        step = plan["steps"][str(id)]
+        location = assignment[step["function_name"]]
+        m = measurements["functions"][step["function_name"]][location]
+        predecessors = [plan["steps"][str(p)] for p in step["predecessors"]]
+
+        download = 0.0
+        if data is not None:
+            download = transfer_ms(measurements, data["location"], location, data["mb"])
+            if data["location"] != location:
+                cost += egress.get(data["location"].split("/", 1)[0], 0) * data["mb"]
+        cold = coldRate * m.get("cold_start_ms", 0)
+
+        # when the inputs of all predecessors have arrived
+        inputs = max(
+            [finished[p["id"]] + network(measurements, assignment[p["function_name"]], location)["latency_ms"] for p in predecessors],
+            default=0.0
+        )
+        if step["pre-fetch"] and len(predecessors) > 0:
+            invoked = min(started[p["id"]] + network(measurements, assignment[p["function_name"]], location)["latency_ms"] for p in predecessors)
+            start = max(invoked + cold + download, inputs)
+        else:
+            start = inputs + cold + download
+        started[id] = start
+        finished[id] = start + m["exec_ms"]
+        cost += m.get("cost", 0)
+
+    return {"latency_ms": max(finished.values(), default=0.0), "cost": cost}
+
+
+def locations(measurements: dict, name: str) -> list[str]:
+    """
+    :return: the locations a function can be placed at, the ones its execution time was measured for
+    """
+    return sorted(l for l, m in measurements.get("functions", {}).get(name, {}).items() if "exec_ms" in m)
+
+
+def score(result: dict, objective: str) -> tuple[float, float]:
+    if objective == "cost":
+        return result["cost"], result["latency_ms"]
+    return result["latency_ms"], result["cost"]
+
+
+def optimize(plan: dict, measurements: dict, start: dict, objective: str = "latency") -> dict:
+    """
+    :param start: the current assignment, also the starting point of the greedy search
+    :return: the best assignment found
+    """
+    names = sorted(start)
+    candidates = [locations(measurements, name) for name in names]
+    for name, c in zip(names, candidates):
+        if len(c) == 0:
+            raise ValueError(f"no execution time measured for function {name}")
+
+    combinations = 1
+    for c in candidates:
+        combinations *= len(c)
+    if combinations <= EXHAUSTIVE_LIMIT:
+        assignments = (dict(zip(names, locations)) for locations in itertools.product(*candidates))
+        return min(assignments, key=lambda a: score(estimate(plan, measurements, a), objective))
+
+    # coordinate descent: move one function at a time as long as that improves the estimate
+    best = {name: start[name] if start[name] in c else c[0] for name, c in zip(names, candidates)}
+    bestScore = score(estimate(plan, measurements, best), objective)
+    improved = True
+    while improved:
+        improved = False
+        for name, c in zip(names, candidates):
+            for location in c:
+                assignment = {**best, name: location}
+                s = score(estimate(plan, measurements, assignment), objective)
+                if s < bestScore:
+                    best, bestScore, improved = assignment, s, True
+    return best
+
+
+def add_records(measurements: dict, records: list[dict], locations: dict) -> None:
+    """
+    fill in exec_ms and cold_start_ms of every function at its current location from timing records
+    values that are already in the measurements are kept
+    """
+    byFunction = {}
+    for r in records:
+        if r.get("function", None) in locations and PLATFORMS.get(r["platform"], None) == location_provider(locations[r["function"]]):
+            byFunction.setdefault(r["function"], []).append(r)
+    for name, rs in byFunction.items():
+        m = measurements.setdefault("functions", {}).setdefault(name, {}).setdefault(locations[name], {})
+        m.setdefault("exec_ms", sum(r["handler_ms"] for r in rs) / len(rs))
+        imports = [r["import_ms"] for r in rs if r["cold"] and r.get("import_ms", None) is not None]
+        if len(imports) > 0:
+            m.setdefault("cold_start_ms", sum(imports) / len(imports))
+
+
+def apply(fDict: dict, name: str, location: str) -> dict:
+    """
+    :return: the function's config.json entry moved to `location`
+    """
+    provider, region = location.split("/", 1)
+    updated = dict(fDict)
+    updated["provider"] = provider
+    match Provider(provider.lower()):
+        case Provider.AWS:
+            updated["handler"] = "wrapper_aws.wrapper_aws"
+            updated["region"] = region
+            updated.pop("tinyFaaS_options", None)
+        case Provider.GCP:
+            updated["handler"] = "wrapper_gcp_pubsub.wrapper_gcp"
+            updated["region"] = region
+            updated.pop("tinyFaaS_options", None)
+        case Provider.tinyFaaS:
+            updated.pop("region", None)
+            # serverless-tinyfaas deploys the directory of the handler
+            updated["handler"] = f"./functions/{name}/main.py"
+            options = fDict.get("tinyFaaS_options", None) or {"env": "python3", "threads": 1, "source": ""}
+            updated["tinyFaaS_options"] = {**options, "deployTo": [region]}
+    return updated
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="choose provider and region per function")
+    parser.add_argument("measurements", help="json file with measurements, see the module docstring")
+    parser.add_argument("--records", nargs="*", default=[], help="logs with timing records of the current placement")
+    parser.add_argument("--objective", choices=["latency", "cost"], default="latency")
+    parser.add_argument("--write", action="store_true", help="write the proposed placement to ../config.json")
+    args = parser.parse_args()
+
+    with open(config, "r") as f:
+        c = json.load(f)
+    with open(workflow, "r") as f:
+        plan = compile_workflow(json.load(f))["plan"]
+    with open(args.measurements, "r") as f:
+        measurements = json.load(f)
+
+    names = sorted({step["function_name"] for step in plan["steps"].values()})
+    current = {name: current_location(c["functions"][name]) for name in names}
+    lines = []
+    for path in args.records:
+        with open(path, "r") as f:
+            lines.extend(f.readlines())
+    add_records(measurements, collector.parse_records(lines), current)
+
+    proposed = optimize(plan, measurements, current, args.objective)
+    for name in names:
+        marker = "" if proposed[name] == current[name] else " (moved)"
+        print(f"{name:<12} {current[name]:<28} -> {proposed[name]}{marker}")
+    # the current placement can only be estimated if it was measured
+    if all(current[name] in locations(measurements, name) for name in names):
+        before = estimate(plan, measurements, current)
+        print(f"current:  {before['latency_ms']:.1f} ms, {before['cost']:.8f} per run")
+    after = estimate(plan, measurements, proposed)
+    print(f"proposed: {after['latency_ms']:.1f} ms, {after['cost']:.8f} per run")
+
+    if args.write:
+        for name in names:
+            c["functions"][name] = apply(c["functions"][name], name, proposed[name])
+        with open(config, "w") as f:
+            json.dump(c, f, indent=4)
+            f.write("\n")
+        print(f"wrote the placement to {config}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+keep a minimum number of instances of the deployed functions warm
+
+functions opt in with "min_warm" in config.json:
+    "ocr": {"handler": "wrapper_aws.wrapper_aws", ..., "min_warm": 2}
+every `--interval` seconds the scheduler sends that many concurrent warm-up pings to the function (see wrapper/invoke.py),
+the wrappers answer them without running the handler and stay busy for `--hold` seconds,
+so that the platform has to start one instance per ping
+
+the invocation targets are taken from the deployed workflow (../deployment/workflow.json, run main.py first),
+functions that aren't part of the workflow are skipped
+pings within a run are configured per step in workflow.json instead ("prewarm", see wrapper/wrapper.py)
+
+usage: python prewarm.py [--interval 240] [--hold 1.0] [--once] [--warm name=N ...]
+"""
+
+import argparse
+import json
+import os
+import time
+
+from wrapper import invoke
+
+
+config = "../config.json"
+DEPLOYMENT_DIR = "../deployment"
+
+
+def load_targets(deploymentDir: str = DEPLOYMENT_DIR) -> dict:
+    """
+    :return: function name -> invocation target
+    """
+    with open(os.path.join(deploymentDir, "workflow.json"), "r") as f:
+        workflow = json.load(f)
+    return {step["function_name"]: step["invoke"] for step in workflow["plan"]["steps"].values() if "invoke" in step}
+
+
+def minimums(c: dict, overrides: list[str]) -> dict:
+    """
+    :return: function name -> number of instances to keep warm, from config.json and name=N overrides
+    """
+    warm = {name: fDict["min_warm"] for name, fDict in c["functions"].items() if fDict.get("min_warm", 0) > 0}
+    for value in overrides:
+        name, n = value.split("=", 1)
+        warm[name] = int(n)
+    return {name: n for name, n in warm.items() if n > 0}
+
+
+def ping_all(targets: dict, warm: dict, hold: float) -> None:
+    """
+    send the pings of one round at the same time and wait until they have been accepted
+    """
+    for name, n in sorted(warm.items()):
+        if name not in targets:
+            print(f"{name} isn't part of the deployed workflow, skipping it")
+            continue
+        print(f"pinging {name} {n} times")
+        for _ in range(n):
+            invoke.ping(targets[name], hold)
+    invoke.flush()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="keep instances of the deployed functions warm")
+    parser.add_argument("--interval", type=float, default=240, help="seconds between two rounds of pings")
+    parser.add_argument("--hold", type=float, default=1.0, help="seconds a pinged instance stays busy")
+    parser.add_argument("--once", action="store_true", help="send one round of pings and exit")
+    parser.add_argument("--warm", action="append", default=[], help="name=N, overrides min_warm of config.json")
+    args = parser.parse_args()
+
+    with open(config, "r") as f:
+        c = json.load(f)
+    warm = minimums(c, args.warm)
+    if len(warm) == 0:
+        print("no function has min_warm set, nothing to do")
+        return
+    targets = load_targets()
+
+    while True:
+        start = time.monotonic()
+        ping_all(targets, warm, args.hold)
+        if args.once:
+            return
+        time.sleep(max(args.interval - (time.monotonic() - start), 0))
+
+
+if __name__ == '__main__':
+    main()
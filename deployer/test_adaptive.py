@@ -0,0 +1,75 @@
+"""
+tests for choosing how "auto" steps are invoked (see wrapper/adaptive.py)
+
+usage: python -m unittest test_adaptive (or pytest)
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "wrapper"))
+
+import adaptive
+import handoff
+
+
+class DecideTest(unittest.TestCase):
+
+    def test_early_without_statistics(self) -> None:
+        self.assertEqual(adaptive.decide(None, 50.0, {}), (adaptive.EARLY, 0.0))
+        self.assertEqual(adaptive.decide(500.0, None, {}), (adaptive.EARLY, 0.0))
+
+    def test_early_if_the_step_would_wait_less_than_the_margin(self) -> None:
+        self.assertEqual(adaptive.decide(300.0, 250.0, {}), (adaptive.EARLY, 0.0))
+        self.assertEqual(adaptive.decide(300.0, 400.0, {}), (adaptive.EARLY, 0.0))
+
+    def test_push_if_the_step_gets_ready_within_the_margin(self) -> None:
+        self.assertEqual(adaptive.decide(1000.0, 50.0, {}), (adaptive.PUSH, 0.0))
+
+    def test_delayed_until_the_input_is_about_ready(self) -> None:
+        mode, delay = adaptive.decide(1000.0, 400.0, {})
+        self.assertEqual(mode, adaptive.DELAYED)
+        # waits (1000 - 400) ms minus the margin
+        self.assertAlmostEqual(delay, 0.5)
+
+    def test_joins_are_never_pushed(self) -> None:
+        mode, delay = adaptive.decide(1000.0, 50.0, {}, join=True)
+        self.assertEqual(mode, adaptive.DELAYED)
+        self.assertAlmostEqual(delay, 0.85)
+
+    def test_margin_option(self) -> None:
+        self.assertEqual(adaptive.decide(1000.0, 400.0, {"margin_ms": 700})[0], adaptive.EARLY)
+        self.assertEqual(adaptive.decide(1000.0, 50.0, {"margin_ms": 10})[0], adaptive.DELAYED)
+
+
+class StatsTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = handoff.LocalStore(self.directory.name)
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_averages_need_enough_samples(self) -> None:
+        stats = adaptive.Stats(self.store)
+        key = adaptive.Stats.key("plan", 0)
+        for _ in range(adaptive.MIN_SAMPLES - 1):
+            stats.observe(key, busy_ms=100.0)
+        self.assertIsNone(stats.get(key, "busy_ms"))
+        stats.observe(key, busy_ms=100.0)
+        self.assertEqual(stats.get(key, "busy_ms"), 100.0)
+
+    def test_published_statistics_are_read_by_other_containers(self) -> None:
+        stats = adaptive.Stats(self.store)
+        key = adaptive.Stats.key("plan", 0)
+        for _ in range(adaptive.MIN_SAMPLES):
+            stats.observe(key, startup_ms=200.0)
+        stats.publish()
+        self.assertEqual(adaptive.Stats(self.store).get(key, "startup_ms"), 200.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+"""
+tests for the result cache of steps (see wrapper/cache.py)
+
+usage: python -m unittest test_cache (or pytest)
+"""
+
+import io
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "wrapper"))
+
+import cache
+import handoff
+
+
+def prefetched(content: bytes) -> dict:
+    return {"a.pdf": io.BytesIO(content)}
+
+
+class KeyTest(unittest.TestCase):
+
+    def test_same_content_same_key(self) -> None:
+        a = cache.key("check", {}, {"filename": "a.pdf"}, prefetched(b"pdf"))
+        self.assertEqual(a, cache.key("check", {}, {"filename": "a.pdf"}, prefetched(b"pdf")))
+        self.assertNotEqual(a, cache.key("check", {}, {"filename": "a.pdf"}, prefetched(b"other pdf")))
+        self.assertNotEqual(a, cache.key("check", {}, {"filename": "b.pdf"}, prefetched(b"pdf")))
+        self.assertNotEqual(a, cache.key("virus", {}, {"filename": "a.pdf"}, prefetched(b"pdf")))
+        self.assertNotEqual(a, cache.key("check", {"version": 2}, {"filename": "a.pdf"}, prefetched(b"pdf")))
+
+    def test_data_key_ignores_names_and_rewinds(self) -> None:
+        data = prefetched(b"pdf")
+        a = cache.key("check", {"key": ["data"]}, {"filename": "a.pdf"}, data)
+        self.assertEqual(data["a.pdf"].tell(), 0)
+        self.assertEqual(a, cache.key("check", {"key": ["data"]}, {"filename": "b.pdf"}, prefetched(b"pdf")))
+
+    def test_data_key_without_prefetched_data_is_not_cached(self) -> None:
+        # the handler reads the object itself, a re-uploaded object with the same name must not hit
+        for parts in [["data"], ["input", "data"]]:
+            self.assertIsNone(cache.key("check", {"key": parts}, {"filename": "a.pdf"}, None))
+        self.assertIsNone(cache.key("check", {}, {"filename": "a.pdf"}, {}))
+
+    def test_input_key_without_prefetched_data(self) -> None:
+        self.assertIsNotNone(cache.key("check", {"key": ["input"]}, {"filename": "a.pdf"}, None))
+
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = handoff.LocalStore(self.directory.name)
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_results_are_shared_through_the_store(self) -> None:
+        cache.Cache("check", {}, self.store).put("hash", {"ok": True})
+        self.assertEqual(cache.Cache("check", {}, self.store).get("hash")["result"], {"ok": True})
+
+    def test_expired_results_are_not_used(self) -> None:
+        results = cache.Cache("check", {"ttl": 0.05}, self.store)
+        results.put("hash", {"ok": True})
+        self.assertIsNotNone(results.get("hash"))
+        time.sleep(0.1)
+        self.assertIsNone(results.get("hash"))
+        self.assertIsNone(cache.Cache("check", {"ttl": 0.05}, self.store).get("hash"))
+
+    def test_least_recently_used_results_are_evicted(self) -> None:
+        results = cache.Cache("check", {"max_entries": 2})
+        for hash in ["a", "b", "c"]:
+            results.put(hash, hash)
+        self.assertIsNone(results.get("a"))
+        self.assertEqual(results.get("c")["result"], "c")
+
+    def test_results_that_are_not_json_are_not_cached(self) -> None:
+        results = cache.Cache("check", {})
+        results.put("hash", object())
+        self.assertIsNone(results.get("hash"))
+
+
+if __name__ == "__main__":
+    unittest.main()
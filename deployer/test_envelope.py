@@ -0,0 +1,73 @@
+"""
+tests for the wire formats of the invocation envelope (see wrapper/envelope.py)
+
+usage: python -m unittest test_envelope (or pytest)
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "wrapper"))
+
+import envelope
+import plan
+
+
+def payload(current: object = 1) -> dict:
+    compiled = plan.compile_steps([{"id": 0, "function_name": "check"}, {"id": 1, "function_name": "ocr"}])
+    return {"workflow": {"plan": compiled, "run_id": "abc", "current": current}, "body": {"filename": "a.pdf"}}
+
+
+def interned(payload: dict) -> dict:
+    return {**payload, "workflow": envelope.intern(payload["workflow"])}
+
+
+class EnvelopeTest(unittest.TestCase):
+
+    def test_json_round_trip(self) -> None:
+        p = payload()
+        self.assertEqual(envelope.decode(envelope.encode(p, "json")), p)
+
+    def test_compact_round_trip_interns_the_plan(self) -> None:
+        p = payload()
+        encoded = envelope.encode(p, "compact")
+        self.assertNotIn(b" ", encoded)
+        self.assertEqual(envelope.decode(encoded), interned(p))
+
+    def test_binary_round_trip(self) -> None:
+        for current in [0, 1, envelope.MAX_CURSOR, None]:
+            p = payload(current)
+            if current is None:
+                del p["workflow"]["current"]
+            encoded = envelope.encode(p, "binary")
+            self.assertTrue(encoded.startswith(envelope.MAGIC))
+            self.assertEqual(envelope.decode(encoded), interned(p))
+
+    def test_binary_falls_back_to_compact_for_other_cursors(self) -> None:
+        for current in [envelope.MAX_CURSOR + 1, -1, True, "1"]:
+            p = payload(current)
+            encoded = envelope.encode(p, "binary")
+            self.assertFalse(encoded.startswith(envelope.MAGIC))
+            self.assertEqual(envelope.decode(encoded), interned(p))
+
+    def test_workflows_without_plan_are_sent_as_json(self) -> None:
+        p = {"workflow": {"steps": [], "current": 0}, "body": None}
+        self.assertEqual(envelope.decode(envelope.encode(p, "binary")), p)
+
+    def test_decode_accepts_strings_and_parsed_json(self) -> None:
+        p = payload()
+        self.assertEqual(envelope.decode(envelope.encode(p).decode("utf-8")), p)
+        self.assertIs(envelope.decode(p), p)
+
+    def test_unknown_encodings_and_versions_are_rejected(self) -> None:
+        with self.assertRaises(ValueError):
+            envelope.encode(payload(), "xml")
+        encoded = bytearray(envelope.encode(payload(), "binary"))
+        encoded[len(envelope.MAGIC)] = envelope.VERSION + 1
+        with self.assertRaisesRegex(ValueError, "version"):
+            envelope.decode(bytes(encoded))
+
+
+if __name__ == "__main__":
+    unittest.main()
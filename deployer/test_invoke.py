@@ -0,0 +1,125 @@
+"""
+tests for invoking the next steps over http (see wrapper/invoke.py), against a local server
+
+usage: python -m unittest test_invoke (or pytest)
+"""
+
+import http.server
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import typing
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "wrapper"))
+
+import invoke
+import telemetry
+import wrapper
+
+
+class Server(http.server.ThreadingHTTPServer):
+    """
+    records every request, answers after `delay` seconds with `status`
+    """
+
+    daemon_threads = True
+
+    def __init__(self, delay: float = 0.0, status: int = 200) -> None:
+        super().__init__(("127.0.0.1", 0), Handler)
+        self.delay = delay
+        self.status = status
+        self.requests = []
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/"
+
+    def close(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.requests.append((dict(self.headers), json.loads(body)))
+        time.sleep(self.server.delay)
+        self.send_response(self.server.status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format: str, *args: typing.Any) -> None:
+        pass
+
+
+class InvokeTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.timeout, self.backoff = invoke.TIMEOUT, invoke.BACKOFF
+        invoke.TIMEOUT, invoke.BACKOFF = 0.2, 0.01
+
+    def tearDown(self) -> None:
+        invoke.TIMEOUT, invoke.BACKOFF = self.timeout, self.backoff
+
+    def invoke(self, target: dict) -> None:
+        # a new thread, connections are kept per thread and created with the timeout
+        with invoke.tracking():
+            invoke.invoke(target, b"{}")
+            invoke.flush()
+
+    def test_unanswered_synchronous_invocation_is_not_retried(self) -> None:
+        server = Server(delay=1.0)
+        try:
+            self.invoke({"type": "http", "url": server.url})
+            self.assertEqual(len(server.requests), 1)
+        finally:
+            server.close()
+
+    def test_tinyfaas_is_invoked_asynchronously(self) -> None:
+        server = Server(status=202)
+        try:
+            self.invoke({"type": "tinyfaas", "urls": [server.url]})
+            self.assertEqual(server.requests[0][0]["X-tinyFaaS-Async"], "true")
+        finally:
+            server.close()
+
+    def test_failed_invocations_are_retried(self) -> None:
+        server = Server(status=503)
+        try:
+            with self.assertRaises(invoke.InvocationError):
+                self.invoke({"type": "http", "url": server.url})
+            self.assertEqual(len(server.requests), invoke.RETRIES + 1)
+        finally:
+            server.close()
+
+
+class SynchronousTargetTest(unittest.TestCase):
+
+    def test_prefetching_step_with_synchronous_target_is_pushed_its_input(self) -> None:
+        server = Server()
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                workflow = {"handoff": {"type": "local", "path": directory}, "steps": [
+                    {"id": 0, "function_name": "ocr", "pre-fetch": False, "invoke": {"type": "http", "url": server.url}},
+                    {"id": 1, "function_name": "email", "pre-fetch": True, "invoke": {"type": "http", "url": server.url}}
+                ]}
+                invocation = telemetry.start("test")
+                invocation.emit = lambda: None
+                wrapper.execute({"workflow": workflow, "body": {"filename": "a.pdf"}}, lambda data, input: input, invocation)
+            # one invocation, with the input, instead of an early one that waits for it
+            self.assertEqual(len(server.requests), 1)
+            self.assertEqual(server.requests[0][1]["body"], {"filename": "a.pdf"})
+        finally:
+            server.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
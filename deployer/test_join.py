@@ -0,0 +1,181 @@
+"""
+tests for joins: the atomic claims of the handoff stores and steps with several predecessors firing exactly once
+
+usage: python -m unittest test_join (or pytest)
+"""
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import types
+import typing
+import unittest
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "wrapper"))
+
+import handoff
+import invoke
+import telemetry
+import wrapper
+
+
+TIMEOUT = 5  # seconds
+
+
+class ClientError(Exception):
+
+    def __init__(self, code: str) -> None:
+        super().__init__(code)
+        self.response = {"Error": {"Code": code}}
+
+
+class FakeS3:
+    """
+    the part of the boto3 s3 client that S3Store.create uses, with s3's conditional writes
+    """
+
+    exceptions = types.SimpleNamespace(ClientError=ClientError)
+
+    def __init__(self) -> None:
+        self.objects = {}
+        self.lock = threading.Lock()
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes, IfNoneMatch: typing.Optional[str] = None) -> None:
+        with self.lock:
+            if IfNoneMatch == "*" and (Bucket, Key) in self.objects:
+                raise ClientError("PreconditionFailed")
+            self.objects[(Bucket, Key)] = Body
+
+
+def s3_store(client: FakeS3) -> handoff.S3Store:
+    # without __init__, it imports boto3
+    store = handoff.S3Store.__new__(handoff.S3Store)
+    store.bucket, store.prefix, store.client = "bucket", "handoff", client
+    return store
+
+
+def concurrently(fn: typing.Callable[[int], typing.Any], n: int) -> list:
+    """
+    :return: the results of fn(0), ..., fn(n - 1), called at the same time
+    """
+    barrier = threading.Barrier(n)
+    results = [None] * n
+
+    def run(i: int) -> None:
+        barrier.wait()
+        results[i] = fn(i)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(TIMEOUT)
+    return results
+
+
+class ClaimTest(unittest.TestCase):
+
+    def test_local_create_succeeds_once(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            store = handoff.LocalStore(directory)
+            results = concurrently(lambda i: store.create("run/2/fired", str(i).encode("utf-8")), 8)
+            self.assertEqual(results.count(True), 1)
+            # the value of the winner isn't overwritten
+            self.assertEqual(store.get("run/2/fired"), str(results.index(True)).encode("utf-8"))
+
+    def test_s3_create_succeeds_once(self) -> None:
+        client = FakeS3()
+        store = s3_store(client)
+        results = concurrently(lambda i: store.create("run/2/fired", b""), 8)
+        self.assertEqual(results.count(True), 1)
+        self.assertIn(("bucket", "handoff/run/2/fired"), client.objects)
+
+    def test_s3_create_raises_other_errors(self) -> None:
+        client = FakeS3()
+
+        def fail(**kwargs: typing.Any) -> None:
+            raise ClientError("AccessDenied")
+
+        client.put_object = fail
+        with self.assertRaises(ClientError):
+            s3_store(client).create("run/2/fired", b"")
+
+
+class JoinTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.sent = []
+        self.lock = threading.Lock()
+        self.directory = tempfile.TemporaryDirectory()
+
+        def record(target: dict, body: bytes) -> None:
+            with self.lock:
+                self.sent.append(json.loads(body))
+
+        invoke._invokers["record"] = record
+
+    def tearDown(self) -> None:
+        del invoke._invokers["record"]
+        self.directory.cleanup()
+
+    def workflow(self, prefetch: bool) -> dict:
+        """
+        :return: the workflow of workflow.json: check and virus start the run, ocr joins them
+        """
+        steps = [
+            {"id": 0, "function_name": "check", "depends_on": [], "pre-fetch": False},
+            {"id": 1, "function_name": "virus", "depends_on": [], "pre-fetch": False},
+            {"id": 2, "function_name": "ocr", "depends_on": [0, 1], "pre-fetch": prefetch}
+        ]
+        for step in steps:
+            step["invoke"] = {"type": "record"}
+        return {"handoff": {"type": "local", "path": self.directory.name}, "steps": steps}
+
+    def execute(self, workflow: dict, runId: str, i: int) -> None:
+        """
+        run check (0) or virus (1) of a run, it returns its function name
+        """
+        invocation = telemetry.start("test")
+        invocation.emit = lambda: None
+        payload = {"workflow": {**workflow, "run_id": runId, "current": i}, "body": {}}
+        wrapper.execute(payload, lambda data, input: {"from": ["check", "virus"][i]}, invocation)
+
+    def run_predecessors(self, workflow: dict) -> None:
+        """
+        run check and virus of one run at the same time
+        """
+        runId = uuid.uuid4().hex
+        concurrently(lambda i: self.execute(workflow, runId, i), 2)
+
+    def test_retried_predecessor_does_not_fire_again(self) -> None:
+        workflow, runId = self.workflow(prefetch=False), uuid.uuid4().hex
+        self.execute(workflow, runId, 0)
+        self.assertEqual(len(self.sent), 0)
+        self.execute(workflow, runId, 1)
+        self.execute(workflow, runId, 1)
+        self.assertEqual(len(self.sent), 1)
+
+    def test_join_fires_once_with_all_outputs(self) -> None:
+        for _ in range(10):
+            self.run_predecessors(self.workflow(prefetch=False))
+        self.assertEqual(len(self.sent), 10)
+        for payload in self.sent:
+            self.assertEqual(payload["workflow"]["current"], 2)
+            self.assertEqual(payload["body"], {"check": {"from": "check"}, "virus": {"from": "virus"}})
+
+    def test_prefetching_join_is_invoked_once(self) -> None:
+        for _ in range(10):
+            self.run_predecessors(self.workflow(prefetch=True))
+        # invoked early without input, it waits for both outputs in the handoff store
+        self.assertEqual(len(self.sent), 10)
+        self.assertTrue(all("body" not in payload for payload in self.sent))
+        workflow = wrapper.prepare_workflow({**self.workflow(prefetch=True), "run_id": self.sent[0]["workflow"]["run_id"], "current": 2})
+        input = wrapper.get_function_input(workflow, wrapper.get_current_step(workflow))
+        self.assertEqual(input, {"check": {"from": "check"}, "virus": {"from": "virus"}})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+"""
+tests for compiling workflow.json into a plan and the workflow state that walks it (see wrapper/plan.py)
+
+usage: python -m unittest test_plan (or pytest)
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "wrapper"))
+
+import plan
+
+
+def step(id: int, **fields: object) -> dict:
+    return {"id": id, "function_name": f"function-{id}", **fields}
+
+
+class CompileTest(unittest.TestCase):
+
+    def test_steps_without_dependencies_form_a_chain_by_id(self) -> None:
+        compiled = plan.compile_steps([step(2), step(0), step(1)])
+        self.assertEqual(compiled["entries"], [0])
+        self.assertEqual(compiled["order"], [0, 1, 2])
+        self.assertEqual(compiled["steps"]["1"]["predecessors"], [0])
+        self.assertEqual(compiled["steps"]["1"]["successors"], [2])
+
+    def test_fan_out_and_join(self) -> None:
+        compiled = plan.compile_steps([
+            step(0, depends_on=[]), step(1, depends_on=[]), step(2, depends_on=[0, 1]), step(3, depends_on=[2])
+        ])
+        self.assertEqual(compiled["entries"], [0, 1])
+        self.assertEqual(compiled["order"], [0, 1, 2, 3])
+        self.assertEqual(compiled["steps"]["2"]["predecessors"], [0, 1])
+        self.assertEqual(compiled["steps"]["0"]["successors"], [2])
+        self.assertNotIn("depends_on", compiled["steps"]["2"])
+
+    def test_cycles_are_rejected(self) -> None:
+        with self.assertRaisesRegex(ValueError, "cycle"):
+            plan.compile_steps([step(0, depends_on=[]), step(1, depends_on=[0, 2]), step(2, depends_on=[1])])
+
+    def test_unknown_dependencies_are_rejected(self) -> None:
+        with self.assertRaisesRegex(ValueError, "unknown step 7"):
+            plan.compile_steps([step(0, depends_on=[7])])
+
+    def test_duplicate_ids_are_rejected(self) -> None:
+        with self.assertRaisesRegex(ValueError, "duplicate"):
+            plan.compile_steps([step(0), step(0)])
+
+    def test_plan_id_is_a_content_hash(self) -> None:
+        a = plan.compile_steps([step(0), step(1)])
+        self.assertEqual(a["id"], plan.compile_steps([step(1), step(0)])["id"])
+        self.assertNotEqual(a["id"], plan.compile_steps([step(0), step(1, **{"pre-fetch": True})])["id"])
+        self.assertEqual(a["id"], plan.plan_id(a))
+
+    def test_compiled_workflows_are_returned_unchanged(self) -> None:
+        compiled = plan.compile_workflow({"steps": [step(0)], "handoff": {"type": "local"}})
+        self.assertNotIn("steps", compiled)
+        self.assertEqual(compiled["handoff"], {"type": "local"})
+        self.assertIs(plan.compile_workflow(compiled), compiled)
+
+
+class StateTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        compiled = plan.compile_workflow({"steps": [step(0, depends_on=[]), step(1, depends_on=[]), step(2, depends_on=[0, 1])]})
+        self.start = plan.state({**compiled, "run_id": "run"})
+
+    def test_state_before_the_first_step(self) -> None:
+        self.assertEqual(self.start.cursor, -1)
+        self.assertNotIn("current", self.start)
+        with self.assertRaises(KeyError):
+            self.start["current"]
+        self.assertEqual(self.start.current()["id"], 0)
+        self.assertEqual(sorted(self.start), ["plan", "run_id"])
+        self.assertEqual(len(self.start), 2)
+
+    def test_advance_moves_the_cursor(self) -> None:
+        current = self.start.advance(self.start.plan.step(2))
+        self.assertEqual(current["current"], 2)
+        self.assertEqual(current.current()["function_name"], "function-2")
+        self.assertEqual(len(current), 3)
+        # the state it was derived from doesn't change
+        self.assertEqual(self.start.cursor, -1)
+        self.assertIs(current.fields, self.start.fields)
+
+    def test_replace_keeps_the_cursor(self) -> None:
+        current = self.start.advance(self.start.plan.step(1))
+        item = current.replace(run_id="item")
+        self.assertEqual(item["run_id"], "item")
+        self.assertEqual(item["current"], 1)
+        self.assertEqual(current["run_id"], "run")
+
+    def test_state_round_trips_through_a_dict(self) -> None:
+        current = self.start.advance(self.start.plan.step(1))
+        # envelopes can carry the cursor as a string
+        self.assertEqual(plan.state({**dict(current), "current": "1"}).cursor, current.cursor)
+        self.assertEqual(dict(plan.state(dict(current))), dict(current))
+        self.assertIs(plan.state(current), current)
+
+    def test_unknown_steps_raise(self) -> None:
+        with self.assertRaisesRegex(KeyError, "no step with id 7"):
+            self.start.plan.step(7)
+
+
+if __name__ == "__main__":
+    unittest.main()
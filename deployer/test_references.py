@@ -0,0 +1,70 @@
+"""
+tests for passing large inputs by reference (see wrapper/references.py)
+
+usage: python -m unittest test_references (or pytest)
+"""
+
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "wrapper"))
+
+import handoff
+import references
+
+
+class ReferencesTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = handoff.LocalStore(self.directory.name)
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_small_values_are_sent_inline(self) -> None:
+        value = {"filename": "a.pdf"}
+        self.assertIs(references.spill(self.store, "run/1/body", value, threshold=1024), value)
+        self.assertIsNone(self.store.get("run/1/body"))
+
+    def test_large_values_are_spilled(self) -> None:
+        value = {"text": "x" * 100}
+        reference = references.spill(self.store, "run/1/body", value, threshold=64)
+        self.assertTrue(references.is_reference(reference))
+        self.assertEqual(reference["$ref"]["key"], "run/1/body")
+        self.assertEqual(reference["$ref"]["bytes"], len(json.dumps(value)))
+        self.assertEqual(json.loads(self.store.get("run/1/body")), value)
+
+    def test_resolved_reference_loads_the_value(self) -> None:
+        value = {"text": "x" * 100, "pages": 3}
+        lazy = references.resolve(self.store, references.spill(self.store, "run/1/body", value, threshold=64))
+        self.assertIsInstance(lazy, references.LazyInput)
+        self.assertEqual(lazy["pages"], 3)
+        self.assertEqual(dict(lazy), value)
+        with lazy.open() as stream:
+            self.assertEqual(json.load(stream), value)
+
+    def test_references_in_joined_inputs_are_resolved(self) -> None:
+        reference = references.spill(self.store, "run/1/body", {"text": "x" * 100}, threshold=64)
+        resolved = references.resolve(self.store, {"check": {"ok": True}, "ocr": reference})
+        self.assertEqual(resolved["check"], {"ok": True})
+        self.assertEqual(resolved["ocr"]["text"], "x" * 100)
+
+    def test_forwarded_lazy_input_is_sent_as_its_reference(self) -> None:
+        reference = references.spill(self.store, "run/1/body", {"text": "x" * 100}, threshold=64)
+        lazy = references.resolve(self.store, reference)
+        # inline, the lazy input is replaced by its reference without loading it
+        self.assertEqual(references.spill(self.store, "run/2/body", {"ocr": lazy}, threshold=1024), {"ocr": reference})
+        self.assertFalse(lazy._loaded)
+
+    def test_missing_reference_raises(self) -> None:
+        lazy = references.resolve(self.store, {"$ref": {"key": "run/1/missing", "bytes": 10}})
+        with self.assertRaises(FileNotFoundError):
+            lazy["text"]
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+"""
+tests for the concurrency of the wrapper: early invocations, batches and pending invocations
+
+the invocations are recorded instead of sent, the handoff store is a local directory
+usage: python -m unittest test_wrapper (or pytest)
+"""
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import typing
+import unittest
+
+# the wrapper modules import each other by their top-level names, like they do when they are deployed
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "wrapper"))
+
+import invoke
+import telemetry
+import wrapper
+
+
+TIMEOUT = 5  # seconds, an invocation that takes longer is considered hanging
+
+
+def entries(batch: typing.Optional[dict] = None) -> dict:
+    """
+    :return: a workflow like workflow.json: check and virus both start the run, virus is batched
+    """
+    virus = {"id": 1, "function_name": "virus", "depends_on": [], "pre-fetch": False, "invoke": {"type": "record"}}
+    if batch is not None:
+        virus["batch"] = batch
+    return {
+        "handoff": {"type": "local", "path": tempfile.mkdtemp()},
+        "steps": [
+            {"id": 0, "function_name": "check", "depends_on": [], "pre-fetch": False, "invoke": {"type": "record"}},
+            virus
+        ]
+    }
+
+
+class WrapperTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.sent = []
+        self.lock = threading.Lock()
+        self.delay = {}  # function name -> seconds an invocation of it takes
+        self.invokeEarly = wrapper.invoke_early
+
+        def record(target: dict, body: bytes) -> None:
+            payload = json.loads(body)
+            step = wrapper.get_current_step(wrapper.prepare_workflow(payload["workflow"]))
+            time.sleep(self.delay.get(step["function_name"], 0))
+            with self.lock:
+                self.sent.append(payload)
+
+        invoke._invokers["record"] = record
+
+    def tearDown(self) -> None:
+        wrapper.invoke_early = self.invokeEarly
+        del invoke._invokers["record"]
+
+    def execute(self, workflow: dict, body: typing.Any) -> threading.Thread:
+        """
+        run one invocation in a thread, like a platform would, records are kept out of the output
+        """
+        invocation = telemetry.start("test")
+        invocation.emit = lambda: None
+        thread = threading.Thread(target=wrapper.execute, args=({"workflow": workflow, "body": body}, lambda data, input: input, invocation), daemon=True)
+        thread.start()
+        return thread
+
+    def assertReturns(self, thread: threading.Thread) -> None:
+        thread.join(TIMEOUT)
+        self.assertFalse(thread.is_alive(), "the invocation didn't return")
+
+    def test_slow_early_invocation_sends_its_batch(self) -> None:
+        # the batch is opened after wait_for_invocations has started, it's sent anyway
+        def slow(*args: typing.Any) -> None:
+            time.sleep(0.2)
+            self.invokeEarly(*args)
+
+        wrapper.invoke_early = slow
+        self.assertReturns(self.execute(entries({"size": 10}), {"filename": "a.pdf"}))
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(self.sent[0]["workflow"]["current"], 1)
+
+    def test_early_invocations_into_batches_return(self) -> None:
+        for _ in range(20):
+            self.assertReturns(self.execute(entries({"size": 10}), {"filename": "a.pdf"}))
+        self.assertEqual(len(self.sent), 20)
+
+    def test_concurrent_invocations_wait_for_their_own_invocations(self) -> None:
+        # a slow invocation of one run doesn't hold back another run that is handled by the same container
+        self.delay["virus"] = 1.0
+        slow = self.execute(entries(), {"filename": "slow.pdf"})
+        time.sleep(0.1)
+        self.delay["virus"] = 0.0
+        start = time.monotonic()
+        self.assertReturns(self.execute(entries(), {"filename": "fast.pdf"}))
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertReturns(slow)
+        self.assertEqual(len(self.sent), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+"""
+runtime choice of how a pre-fetching step is invoked, for steps with "pre-fetch": "auto" in workflow.json
+
+invoking a step early hides its cold start and download behind its predecessor, but the step is billed while it waits
+for its input, so the predecessor chooses per invocation from rolling statistics of both steps:
+- "early": invoke it now, like "pre-fetch": true, if it would wait less than the margin or not enough is known yet
+- "delayed": invoke it later, so that it is ready about when the input is
+- "push": invoke it with the input once it's there, like "pre-fetch": false, if it gets ready within the margin anyway
+joins are never pushed, their other predecessors rely on the input being picked up from the handoff store
+
+the statistics are exponential moving averages in milliseconds, every step measures its own:
+- "busy_ms": from receiving the invocation until the handler is done (how long the step keeps its successors waiting)
+- "startup_ms": from being invoked until the pre-fetch is done, cold starts included (how long the step needs to get ready)
+every container keeps its own and writes them to the handoff store (stats/<plan id>/<step id>) at most every
+PUBLISH_INTERVAL seconds, the last writer wins, predecessors read them from there and keep them for the same time
+
+options, in the "adaptive" section of the step: {"margin_ms": 100, "min_samples": 5}
+"""
+
+import concurrent.futures
+import contextvars
+import json
+import threading
+import time
+import typing
+
+import handoff
+
+
+EARLY = "early"
+DELAYED = "delayed"
+PUSH = "push"
+
+ALPHA = 0.2             # weight of a new sample
+PUBLISH_INTERVAL = 10   # seconds
+MARGIN_MS = 100
+MIN_SAMPLES = 5
+
+
+def is_auto(step: dict) -> bool:
+    return step.get("pre-fetch", False) == "auto"
+
+
+def decide(busy: typing.Optional[float], startup: typing.Optional[float], options: dict, join: bool = False) -> tuple[str, float]:
+    """
+    :param busy: busy_ms of the invoking step, startup: startup_ms of the invoked step, None if not known yet
+    :return: the mode and, for "delayed", the delay in seconds
+    """
+    if busy is None or startup is None:
+        return EARLY, 0.0
+    margin = options.get("margin_ms", MARGIN_MS)
+    # how long the step would wait for its input if it was invoked now
+    idle = busy - startup
+    if idle <= margin:
+        return EARLY, 0.0
+    if startup <= margin and not join:
+        return PUSH, 0.0
+    return DELAYED, (idle - margin) / 1000
+
+
+class Stats:
+    """
+    the statistics of the steps this container runs and the last published statistics of other steps
+    """
+
+    def __init__(self, store: handoff.HandoffStore) -> None:
+        self.store = store
+        self._local = {}      # key -> {"busy_ms": ..., "startup_ms": ..., "samples": {"busy_ms": n, ...}}
+        self._published = {}  # key -> when it was written last
+        self._remote = {}     # key -> (when it was read, statistics or None)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(planId: str, stepId: typing.Any) -> str:
+        return f"stats/{planId}/{stepId}"
+
+    def observe(self, key: str, **samples: float) -> None:
+        with self._lock:
+            stats = self._local.setdefault(key, {"samples": {}})
+            for name, value in samples.items():
+                n = stats["samples"].get(name, 0)
+                stats[name] = value if n == 0 else (1 - ALPHA) * stats[name] + ALPHA * value
+                stats["samples"][name] = n + 1
+
+    def publish(self) -> None:
+        """
+        write the statistics that haven't been written for PUBLISH_INTERVAL seconds
+        """
+        now = time.monotonic()
+        with self._lock:
+            due = {k: json.dumps(v) for k, v in self._local.items() if now - self._published.get(k, -PUBLISH_INTERVAL) >= PUBLISH_INTERVAL}
+            for k in due:
+                self._published[k] = now
+        for k, data in due.items():
+            self.store.put(k, data.encode("utf-8"))
+
+    def get(self, key: str, name: str, minSamples: int = MIN_SAMPLES) -> typing.Optional[float]:
+        """
+        :return: the average `name` of a step, measured by this container or published by another one,
+                 None if it's based on less than `minSamples` samples
+        """
+        now = time.monotonic()
+        with self._lock:
+            local = self._local.get(key, None)
+            if local is not None and local["samples"].get(name, 0) >= minSamples:
+                return local[name]
+            cached = self._remote.get(key, None)
+        if cached is None or now - cached[0] >= PUBLISH_INTERVAL:
+            cached = (now, self.store.get_json(key))
+            with self._lock:
+                self._remote[key] = cached
+        stats = cached[1]
+        if stats is None or stats["samples"].get(name, 0) < minSamples:
+            return None
+        return stats[name]
+
+
+class Delayed:
+    """
+    an invocation that is sent `delay` seconds after `start` or, with `fire`, as soon as it's needed, but only once
+    """
+
+    def __init__(self, delay: float, send: typing.Callable[[], typing.Any]) -> None:
+        self.delay = delay
+        self.send = send
+        self.future = concurrent.futures.Future()
+        self._fired = False
+        self._lock = threading.Lock()
+        # the timer sends in the context of the invocation that created it (see invoke.tracking)
+        self._timer = threading.Timer(delay, contextvars.copy_context().run, (self.fire,))
+        self._timer.daemon = True
+
+    def start(self) -> concurrent.futures.Future:
+        """
+        :return: a future that is done once the invocation has been sent
+        """
+        self._timer.start()
+        return self.future
+
+    def fire(self) -> None:
+        with self._lock:
+            if self._fired:
+                return
+            self._fired = True
+        self._timer.cancel()
+        try:
+            self.send()
+        except Exception as e:
+            self.future.set_exception(e)
+        else:
+            self.future.set_result(None)
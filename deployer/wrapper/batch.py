@@ -0,0 +1,163 @@
+"""
+batching: several runs of the workflow share one invocation of a step
+
+a step opts in with a "batch" section in workflow.json:
+    {"id": 2, "function_name": "ocr", "batch": {"size": 20, "window": 0.5}, ...}
+- "size": the maximum number of items per invocation (default: no limit)
+- "window": seconds an invocation of the step is held back to collect items of other invocations
+  that are handled by the same container (default 0: only the items of one invocation are grouped)
+batches without a window are sent when the invocation waits for its invocations (see wrapper.wait_for_invocations),
+so entry steps shouldn't have one: the entry steps a run starts with would only start after the first one's handler,
+clients send them batch envelopes instead (see `envelope`)
+
+a batch envelope carries one item per run instead of the "body":
+    {"workflow": {...}, "batch": [{"run_id": "...", "body": ..., "data": [...]}, ...]}
+the items share the step, its clients (see resources.py) and the pre-fetched objects, which are downloaded once,
+every item then continues its own run (see wrapper.handle_batch)
+"""
+
+import concurrent.futures
+import contextvars
+import os
+import threading
+import time
+import typing
+import uuid
+
+import handoff
+import objects
+
+
+class Batcher:
+    """
+    collects items per key until a batch is full or its window has passed, then sends them with `send`
+    """
+
+    def __init__(self, send: typing.Callable[[list], concurrent.futures.Future]) -> None:
+        self.send = send
+        self._lock = threading.Lock()
+        self._pending = {}  # key -> {"items": [...], "futures": [...], "deadline": ..., "timer": ...}
+
+    def add(self, key: typing.Hashable, item: typing.Any, size: typing.Optional[int] = None, window: float = 0.0) -> concurrent.futures.Future:
+        """
+        :return: a future that resolves once the batch containing `item` has been sent
+        """
+        future = concurrent.futures.Future()
+        with self._lock:
+            batch = self._pending.get(key, None)
+            if batch is None:
+                batch = self._pending[key] = {"items": [], "futures": [], "deadline": time.monotonic() + window, "timer": None}
+                if window > 0:
+                    # the batch is sent in the context of the invocation that opened it (see invoke.tracking)
+                    batch["timer"] = threading.Timer(window, contextvars.copy_context().run, (self._expire, key, batch))
+                    batch["timer"].daemon = True
+                    batch["timer"].start()
+            batch["items"].append(item)
+            batch["futures"].append(future)
+            full = size is not None and len(batch["items"]) >= size
+            if full:
+                del self._pending[key]
+        if full:
+            self._send(batch)
+        return future
+
+    def flush_due(self) -> None:
+        """
+        send all batches whose window has passed, batches without a window are always due
+        """
+        now = time.monotonic()
+        with self._lock:
+            due = [key for key, batch in self._pending.items() if batch["deadline"] <= now]
+            batches = [self._pending.pop(key) for key in due]
+        for batch in batches:
+            self._send(batch)
+
+    def _expire(self, key: typing.Hashable, batch: dict) -> None:
+        with self._lock:
+            if self._pending.get(key, None) is not batch:
+                # already sent because it was full
+                return
+            del self._pending[key]
+        self._send(batch)
+
+    def _send(self, batch: dict) -> None:
+        if batch["timer"] is not None:
+            batch["timer"].cancel()
+        try:
+            sent = self.send(batch["items"])
+        except Exception as e:
+            for future in batch["futures"]:
+                future.set_exception(e)
+            return
+
+        def done(f: concurrent.futures.Future) -> None:
+            error = f.exception()
+            for future in batch["futures"]:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(f.result())
+
+        sent.add_done_callback(done)
+
+
+def chunks(items: list, size: typing.Optional[int]) -> list[list]:
+    if size is None or size <= 0:
+        return [items]
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def envelope(workflow: dict, bodies: list[typing.Any], data: typing.Optional[list[list[dict]]] = None) -> dict:
+    """
+    :return: a batch envelope with a new run for every body, e.g. for a client that collects documents
+    :param data: the data objects of every run, if they differ between runs
+    """
+    items = []
+    for i, body in enumerate(bodies):
+        item = {"run_id": uuid.uuid4().hex, "body": body}
+        if data is not None:
+            item["data"] = data[i]
+        items.append(item)
+    return {"workflow": workflow, "batch": items}
+
+
+class SharedObjects:
+    """
+    the pre-fetched objects of a batch, every object is downloaded once into a directory
+    and each item gets its own file handle, handlers can read and close them independently
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.paths = {}  # (bucket, key) -> path, or None if the object doesn't exist
+        self._opened = []
+
+    def fetch(self, store: handoff.HandoffStore, bucket: str, key: str) -> None:
+        if (bucket, key) in self.paths:
+            return
+        # numbered, objects in different buckets or "directories" can have the same name
+        path = objects.path(self.directory, f"{len(self.paths)}-{os.path.basename(key)}")
+        try:
+            self.paths[(bucket, key)] = objects.download(store, key, path)
+        except FileNotFoundError:
+            print(f"pre-fetching {bucket}/{key} failed: object doesn't exist")
+            self.paths[(bucket, key)] = None
+
+    def open(self, refs: list[dict]) -> typing.Optional[dict]:
+        """
+        :return: object key -> readable file, like wrapper.prefetch_data, or None if there is nothing to pre-fetch
+        """
+        if len(refs) == 0:
+            return None
+        data = {}
+        for ref in refs:
+            path = self.paths.get((ref["bucket"], ref["key"]), None)
+            data[ref["key"]] = None if path is None else open(path, "rb")
+            if data[ref["key"]] is not None:
+                self._opened.append(data[ref["key"]])
+        return data
+
+    def close(self) -> None:
+        for f in self._opened:
+            f.close()
+        self._opened.clear()
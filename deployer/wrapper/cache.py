@@ -0,0 +1,136 @@
+"""
+memoization of step results, keyed by a hash of what the result depends on
+
+a step opts in with "cache" in workflow.json, only for steps whose output depends on nothing else (e.g. check, virus):
+    {"id": 0, "function_name": "check", "cache": {"ttl": 86400, "key": ["data"]}, ...}   # or "cache": true
+- "key": what the result depends on, "input" (the function input) and/or "data" (the content of the
+         pre-fetched objects, not their names), default both
+         with "data", invocations that didn't pre-fetch anything aren't cached: the handler reads the objects
+         itself and their content isn't known, a key of the input alone would return stale results once they change
+- "backend": "store" (default) keeps the results in the handoff store under cache/<function>/<hash>,
+             shared by all containers, "local" only in the container's memory
+- "ttl": seconds a result is used (default one day), expired results in the store are replaced on the next miss
+- "max_entries", "max_bytes": size of the in-memory LRU in front of the backend (default 1000 results, 16 MiB),
+                              the least recently used results are evicted first
+- "version": change it when the function's code changes, results of other versions aren't used
+
+results that aren't json serializable (e.g. a forwarded LazyInput) aren't cached
+"""
+
+import collections
+import hashlib
+import json
+import threading
+import time
+import typing
+
+import handoff
+import objects
+import references
+
+
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_ENTRIES = 1000
+DEFAULT_BYTES = 16 * 1024 * 1024
+
+
+def _canonical(value: typing.Any) -> bytes:
+
+    def default(v: typing.Any) -> typing.Any:
+        if not isinstance(v, references.LazyInput):
+            raise TypeError(f"object of type {type(v).__name__} is not json serializable")
+        # a referenced input is identified by its content, the reference is new for every run
+        with v.open() as stream:
+            return {"sha256": objects.sha256_stream(stream)}
+
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), default=default).encode("utf-8")
+
+
+def key(function: str, options: dict, input: typing.Any, prefetched: typing.Optional[dict]) -> typing.Optional[str]:
+    """
+    :return: the hash of the step's result, pre-fetched buffers are rewound afterwards
+             or None if the result depends on data and nothing was pre-fetched, then it can't be cached
+    """
+    parts = options.get("key", ["input", "data"])
+    if "data" in parts and not prefetched:
+        return None
+    hasher = hashlib.sha256()
+    hasher.update(_canonical([function, str(options.get("version", ""))]))
+    if "input" in parts:
+        hasher.update(_canonical(input))
+    if "data" in parts:
+        for name in sorted(prefetched or {}):
+            buffer = prefetched[name]
+            if buffer is None:
+                hasher.update(b"missing")
+                continue
+            hasher.update(objects.sha256_stream(buffer).encode("utf-8"))
+            buffer.seek(0)
+    return hasher.hexdigest()
+
+
+class Cache:
+    """
+    an LRU of {"result": ..., "created": ...} entries in memory, optionally backed by a store
+    """
+
+    def __init__(self, function: str, options: dict, store: typing.Optional[handoff.HandoffStore] = None) -> None:
+        self.function = function
+        self.store = store
+        self.ttl = options.get("ttl", DEFAULT_TTL)
+        self.maxEntries = options.get("max_entries", DEFAULT_ENTRIES)
+        self.maxBytes = options.get("max_bytes", DEFAULT_BYTES)
+        self._entries = collections.OrderedDict()  # hash -> (entry, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _key(self, hash: str) -> str:
+        return f"cache/{self.function}/{hash}"
+
+    def _fresh(self, entry: dict) -> bool:
+        return time.time() - entry["created"] < self.ttl
+
+    def _remember(self, hash: str, entry: dict, size: int) -> None:
+        with self._lock:
+            if hash in self._entries:
+                self._bytes -= self._entries.pop(hash)[1]
+            if size > self.maxBytes:
+                return
+            self._entries[hash] = (entry, size)
+            self._bytes += size
+            while len(self._entries) > self.maxEntries or self._bytes > self.maxBytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+
+    def get(self, hash: str) -> typing.Optional[dict]:
+        """
+        :return: the entry for `hash` if there is one that hasn't expired
+        """
+        with self._lock:
+            cached = self._entries.get(hash, None)
+            if cached is not None:
+                if self._fresh(cached[0]):
+                    self._entries.move_to_end(hash)
+                    return cached[0]
+                self._bytes -= self._entries.pop(hash)[1]
+        if self.store is None:
+            return None
+        data = self.store.get(self._key(hash))
+        if data is None:
+            return None
+        entry = json.loads(data)
+        if not self._fresh(entry):
+            return None
+        self._remember(hash, entry, len(data))
+        return entry
+
+    def put(self, hash: str, result: typing.Any) -> None:
+        entry = {"result": result, "created": time.time()}
+        try:
+            data = json.dumps(entry).encode("utf-8")
+        except TypeError as e:
+            print(f"not caching the result of {self.function}: {e}")
+            return
+        if self.store is not None:
+            self.store.put(self._key(hash), data)
+        self._remember(hash, entry, len(data))
@@ -0,0 +1,80 @@
+"""
+wire formats of the invocation envelope {"workflow": ..., "body": ...}
+
+the plan is the same for every hop of a run, so the compact formats send its id instead ("interning"),
+the receiver uses the plan deployed next to it (workflow.json) or loads it from the handoff store,
+where every sender publishes the plans it interns (see wrapper.prepare_workflow)
+
+- "json": the complete envelope, understood by every wrapper version
+- "compact": json without the plan and without whitespace, for transports that need json (lambda, tinyFaaS, http)
+- "binary": for transports that carry bytes (pub/sub), a fixed header followed by compact json
+    magic (3 bytes) | version (1 byte) | plan id (8 bytes) | cursor (4 bytes, signed, -1 = none) | json
+    the plan id and the cursor (the id of the current step) are taken out of the json,
+    step ids that aren't integers from 0 to 2**31 - 1 fall back to "compact"
+
+the deployer chooses the encoding per provider and stores it in the invocation target ("encoding"),
+targets without one get "json", receivers detect the format themselves
+"""
+
+import json
+import struct
+import typing
+
+
+MAGIC = b"\x00WF"  # json never starts with a zero byte
+VERSION = 1
+HEADER = struct.Struct("!3sBQi")
+MAX_CURSOR = 2 ** 31 - 1
+ENCODINGS = ("json", "compact", "binary")
+
+
+def intern(workflow: dict) -> dict:
+    """
+    :return: the workflow with the plan replaced by its id
+    """
+    interned = {k: v for k, v in workflow.items() if k != "plan"}
+    interned["plan_id"] = workflow["plan"]["id"]
+    return interned
+
+
+def _compact(value: typing.Any) -> bytes:
+    return json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+
+def encode(payload: dict, encoding: str = "json") -> bytes:
+    if encoding == "json" or "plan" not in payload["workflow"]:
+        return json.dumps(payload).encode("utf-8")
+    if encoding not in ENCODINGS:
+        raise ValueError(f"unknown envelope encoding: {encoding}")
+    workflow = intern(payload["workflow"])
+    cursor = workflow.get("current", None)
+    # negative cursors mean "no current step" in the header
+    binary = cursor is None or (isinstance(cursor, int) and not isinstance(cursor, bool) and 0 <= cursor <= MAX_CURSOR)
+    if encoding == "compact" or not binary:
+        return _compact({**payload, "workflow": workflow})
+
+    rest = {k: v for k, v in workflow.items() if k not in ("plan_id", "current")}
+    header = HEADER.pack(MAGIC, VERSION, int(workflow["plan_id"], 16), -1 if cursor is None else cursor)
+    return header + _compact({**payload, "workflow": rest})
+
+
+def decode(data: typing.Union[bytes, str, dict]) -> dict:
+    """
+    decode an envelope in any of the formats, interned plans are resolved by the wrapper
+    """
+    if isinstance(data, dict):
+        # lambda has already parsed the json
+        return data
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    if not data.startswith(MAGIC):
+        return json.loads(data)
+
+    _, version, planId, cursor = HEADER.unpack_from(data)
+    if version != VERSION:
+        raise ValueError(f"unsupported binary envelope version {version}")
+    payload = json.loads(data[HEADER.size:])
+    payload["workflow"]["plan_id"] = f"{planId:016x}"
+    if cursor >= 0:
+        payload["workflow"]["current"] = cursor
+    return payload
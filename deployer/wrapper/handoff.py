@@ -0,0 +1,257 @@
+"""
+handoff store: the data plane between workflow steps
+
+a step that pre-fetches is invoked before its predecessor has finished,
+the predecessor later writes the (small) function input record into the
+handoff store and the pre-fetching step picks it up from there.
+
+all records are keyed by workflow run id and step id:
+    <prefix>/<run_id>/<step_id>/<name>
+
+the store is configured in the "handoff" section of the workflow, e.g.
+    {"type": "local", "path": "/tmp/workflow-handoff"}
+    {"type": "local", "path": "...", "latency": 0.01}   # seconds added to every request, see emulator.py
+    {"type": "s3", "bucket": "my-bucket", "prefix": "handoff", "region": "us-east-1"}
+an "endpoint_url" can be added to the s3 options to use any s3-compatible store (e.g. minio)
+waiting steps can be notified instead of polling the store, see "notify" in notify.py
+"""
+
+import json
+import os
+import shutil
+import time
+import typing
+import uuid
+
+
+# seconds between reads of a waiting step that polls the store, the interval doubles after every miss up to the maximum
+# a step that polls misses its input by up to the maximum, a lower one costs more requests
+# (at 0.1s about ten GETs per second and waiting step, a few cents per million on s3),
+# steps that wait long or often should be notified instead (see notify.py)
+POLL_INTERVAL = 0.05
+MAX_POLL_INTERVAL = 0.1
+
+DEFAULT_OPTIONS = {
+    "type": "local",
+    "path": "/tmp/workflow-handoff"
+}
+
+
+def step_key(run_id: str, step_id: typing.Any, name: str) -> str:
+    return f"{run_id}/{step_id}/{name}"
+
+
+class HandoffStore:
+
+    def put(self, key: str, value: bytes) -> None:
+        raise NotImplementedError
+
+    def get(self, key: str) -> typing.Optional[bytes]:
+        """
+        :return: the stored value or None if the key doesn't exist (yet)
+        """
+        raise NotImplementedError
+
+    def create(self, key: str, value: bytes) -> bool:
+        """
+        store a value only if the key doesn't exist yet, atomically
+        :return: True if this call created the key
+        """
+        raise NotImplementedError
+
+    def open(self, key: str) -> typing.Optional[typing.BinaryIO]:
+        """
+        :return: a readable stream for the value or None if the key doesn't exist (yet)
+        the caller has to close it
+        """
+        raise NotImplementedError
+
+    def put_stream(self, key: str, stream: typing.BinaryIO) -> None:
+        """
+        store the contents of a readable stream without loading it into memory
+        """
+        raise NotImplementedError
+
+    def put_json(self, key: str, value: typing.Any) -> None:
+        self.put(key, json.dumps(value).encode("utf-8"))
+
+    def get_json(self, key: str) -> typing.Any:
+        value = self.get(key)
+        if value is None:
+            return None
+        return json.loads(value)
+
+    def wait(self, key: str, timeout: float, interval: float = POLL_INTERVAL, maxInterval: float = MAX_POLL_INTERVAL, channel: typing.Any = None) -> typing.Optional[bytes]:
+        """
+        wait for a key until it exists or the timeout is reached
+        with a notification `channel` (see notify.py), the value is taken from the notification if it was passed along,
+        otherwise the key is read again once it's published or a long poll ends
+        without a channel, or once it fails, the store is polled and the interval is doubled after every miss, up to `maxInterval`
+        :return: the value or None on timeout
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            value = self.get(key)
+            if value is not None:
+                return value
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            if channel is not None:
+                try:
+                    notified, value = channel.wait(key, remaining)
+                    if value is not None:
+                        return value
+                    if notified:
+                        # the next read should find it, if it doesn't (yet), the store is polled
+                        channel = None
+                except Exception as e:
+                    print(f"notification channel failed, polling the store instead: {e}")
+                    channel = None
+                continue
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 2, maxInterval)
+
+
+class LocalStore(HandoffStore):
+    """
+    filesystem backend, one file per key
+    useful for tinyFaaS nodes, shared volumes and local testing
+    """
+
+    def __init__(self, path: str, latency: float = 0.0) -> None:
+        self.path = path
+        self.latency = latency
+
+    def _path(self, key: str) -> str:
+        # every request goes through here, so this is where the simulated network latency is added
+        if self.latency > 0:
+            time.sleep(self.latency)
+        return os.path.join(self.path, *key.split("/"))
+
+    def put(self, key: str, value: bytes) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first so readers never see partial records
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(value)
+        os.replace(tmp, path)
+
+    def put_stream(self, key: str, stream: typing.BinaryIO) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "wb") as f:
+            shutil.copyfileobj(stream, f)
+        os.replace(tmp, path)
+
+    def create(self, key: str, value: bytes) -> bool:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "wb") as f:
+            f.write(value)
+        return True
+
+    def get(self, key: str) -> typing.Optional[bytes]:
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def open(self, key: str) -> typing.Optional[typing.BinaryIO]:
+        try:
+            return open(self._path(key), "rb")
+        except FileNotFoundError:
+            return None
+
+
+class S3Store(HandoffStore):
+    """
+    s3 (or s3-compatible) backend
+    boto3 is only imported when this store is actually used
+    """
+
+    def __init__(self, bucket: str, prefix: str = "", region: typing.Optional[str] = None, endpoint_url: typing.Optional[str] = None) -> None:
+        import boto3
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.client = boto3.client("s3", region_name=region, endpoint_url=endpoint_url)
+
+    def _key(self, key: str) -> str:
+        if self.prefix == "":
+            return key
+        return f"{self.prefix}/{key}"
+
+    def put(self, key: str, value: bytes) -> None:
+        self.client.put_object(Bucket=self.bucket, Key=self._key(key), Body=value)
+
+    def put_stream(self, key: str, stream: typing.BinaryIO) -> None:
+        # upload_fileobj switches to (parallel) multipart uploads for large streams
+        self.client.upload_fileobj(stream, self.bucket, self._key(key))
+
+    def create(self, key: str, value: bytes) -> bool:
+        # conditional write, fails with 412 if the object already exists
+        try:
+            self.client.put_object(Bucket=self.bucket, Key=self._key(key), Body=value, IfNoneMatch="*")
+        except self.client.exceptions.ClientError as e:
+            if e.response["Error"]["Code"] in ("PreconditionFailed", "412"):
+                return False
+            raise
+        return True
+
+    def get(self, key: str) -> typing.Optional[bytes]:
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._key(key))
+        except self.client.exceptions.NoSuchKey:
+            return None
+        return response["Body"].read()
+
+    def open(self, key: str) -> typing.Optional[typing.BinaryIO]:
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._key(key))
+        except self.client.exceptions.NoSuchKey:
+            return None
+        # botocore's StreamingBody supports read(n) and close()
+        return response["Body"]
+
+
+def new_store(options: typing.Optional[dict]) -> HandoffStore:
+    """
+    create a store from the "handoff" section of a workflow
+    """
+    # no match statement here: the wrapper layer has to run on python 3.9 (gcp)
+    if options is None:
+        options = DEFAULT_OPTIONS
+    type = options.get("type", "local").lower()
+    if type == "local":
+        return LocalStore(options.get("path", DEFAULT_OPTIONS["path"]), options.get("latency", 0.0))
+    if type == "s3":
+        return S3Store(
+            options["bucket"],
+            prefix=options.get("prefix", ""),
+            region=options.get("region", None),
+            endpoint_url=options.get("endpoint_url", None)
+        )
+    raise ValueError(f"unknown handoff store type: {options['type']}")
+
+
+def open_bucket(options: typing.Optional[dict], bucket: str) -> HandoffStore:
+    """
+    create a store with the same backend as the handoff store but bound to another bucket
+    this is used to read the workflow's data objects (e.g. the pdf that every step needs)
+    for the local backend, buckets are subdirectories of the configured path
+    """
+    if options is None:
+        options = DEFAULT_OPTIONS
+    type = options.get("type", "local").lower()
+    if type == "local":
+        return LocalStore(os.path.join(options.get("path", DEFAULT_OPTIONS["path"]), bucket), options.get("latency", 0.0))
+    if type == "s3":
+        return S3Store(bucket, region=options.get("region", None), endpoint_url=options.get("endpoint_url", None))
+    raise ValueError(f"unknown handoff store type: {options['type']}")
@@ -0,0 +1,314 @@
+"""
+invocation client for the next workflow steps
+
+the invocation target of a step is stored in its "invoke" field, the deployer fills it in from config.json:
+    {"type": "lambda", "function": "check-service-dev-check", "region": "us-east-1"}    # async lambda invoke
+    {"type": "http", "url": "https://...lambda-url.us-east-1.on.aws/"}                  # e.g. a lambda function url
+    {"type": "pubsub", "topic": "projects/<project>/topics/<topic>"}                    # gcp pub/sub trigger
+    {"type": "tinyfaas", "urls": ["http://127.0.0.1:8080/email", ...]}                  # tinyfaas nodes, tried in order
+
+all targets but "http" are asynchronous: they return once the invocation is queued (tinyFaaS with X-tinyFaaS-Async)
+"http" targets answer when the function is done, so the wrapper doesn't invoke them early (see wrapper.invoked_early),
+and a request that was sent but not answered within TIMEOUT is not retried, the function is running already
+
+- invocations are sent from a thread pool so the caller doesn't wait for the round trip,
+  the wrappers call `flush` before returning because frozen containers don't run background threads
+- pending invocations are tracked per workflow invocation (see `tracking`), so concurrent invocations of a
+  container (tinyFaaS threads, the emulator) only wait for their own, threads that work for an invocation
+  have to run in its context (contextvars.copy_context)
+- the pool, http keep-alive connections and sdk clients are module-level, so warm invocations reuse them
+- failed invocations are retried with exponential backoff, unless they might have reached the function
+- payloads arrive encoded, in the format of the target's "encoding" (see envelope.py)
+- `ping` sends a warm-up invocation that the wrappers answer without running the handler:
+    {"ping": {"sent": 1700000000.0, "hold": 1.0}}   # "hold": seconds the instance stays busy
+  it's plain json, every wrapper recognizes it before decoding the envelope
+"""
+
+import concurrent.futures
+import contextlib
+import contextvars
+import http.client
+import json
+import random
+import socket
+import threading
+import time
+import typing
+import urllib.parse
+
+
+RETRIES = 3
+BACKOFF = 0.1  # seconds, doubled for every retry
+TIMEOUT = 10   # seconds, per http request
+
+
+class InvocationError(Exception):
+
+    def __init__(self, message: str, retryable: bool = True) -> None:
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class InvocationTimeout(InvocationError):
+    """
+    the request was sent, but not answered in time: the function may be running, so it's not sent again
+    """
+
+    def __init__(self, message: str) -> None:
+        super().__init__(message, retryable=False)
+
+
+def is_synchronous(target: dict) -> bool:
+    """
+    :return: True if invoking `target` waits until the function is done
+    """
+    return target["type"] == "http"
+
+
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=16, thread_name_prefix="invoke")
+
+# one keep-alive connection per (thread, host)
+_local = threading.local()
+
+_clients = {}
+_clientsLock = threading.Lock()
+
+
+def _client(key: tuple, factory: typing.Callable[[], typing.Any]) -> typing.Any:
+    with _clientsLock:
+        if key not in _clients:
+            _clients[key] = factory()
+        return _clients[key]
+
+
+def _connection(scheme: str, netloc: str) -> http.client.HTTPConnection:
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    if (scheme, netloc) not in connections:
+        if scheme == "https":
+            connections[(scheme, netloc)] = http.client.HTTPSConnection(netloc, timeout=TIMEOUT)
+        else:
+            connections[(scheme, netloc)] = http.client.HTTPConnection(netloc, timeout=TIMEOUT)
+    return connections[(scheme, netloc)]
+
+
+def _drop_connection(scheme: str, netloc: str) -> None:
+    connection = getattr(_local, "connections", {}).pop((scheme, netloc), None)
+    if connection is not None:
+        connection.close()
+
+
+def post(url: str, body: bytes, headers: typing.Optional[dict] = None) -> int:
+    """
+    POST `body` on a reused connection
+    raises InvocationTimeout if the request was sent but not answered within TIMEOUT
+    :return: the http status code
+    """
+    parsed = urllib.parse.urlsplit(url)
+    path = parsed.path or "/"
+    if parsed.query != "":
+        path = f"{path}?{parsed.query}"
+    connection = _connection(parsed.scheme, parsed.netloc)
+    try:
+        connection.request("POST", path, body=body, headers={"Content-Type": "application/json", **(headers or {})})
+    except (http.client.HTTPException, OSError) as e:
+        _drop_connection(parsed.scheme, parsed.netloc)
+        raise InvocationError(f"POST {url} failed: {e}")
+    try:
+        response = connection.getresponse()
+        response.read()  # the response has to be consumed before the connection can be reused
+    except socket.timeout as e:
+        _drop_connection(parsed.scheme, parsed.netloc)
+        raise InvocationTimeout(f"POST {url} wasn't answered within {TIMEOUT}s: {e}")
+    except (http.client.HTTPException, OSError) as e:
+        # e.g. a keep-alive connection the server had closed, the request didn't get through
+        _drop_connection(parsed.scheme, parsed.netloc)
+        raise InvocationError(f"POST {url} failed: {e}")
+    if response.will_close:
+        _drop_connection(parsed.scheme, parsed.netloc)
+    if response.status == 429 or response.status >= 500:
+        raise InvocationError(f"POST {url} returned {response.status}")
+    if response.status >= 400:
+        raise InvocationError(f"POST {url} returned {response.status}", retryable=False)
+    return response.status
+
+
+def _invoke_http(target: dict, body: bytes) -> None:
+    try:
+        post(target["url"], body)
+    except InvocationTimeout as e:
+        # synchronous: the function got the invocation and is still running
+        print(f"not waiting for the function any longer: {e}")
+
+
+def _invoke_tinyfaas(target: dict, body: bytes) -> None:
+    # try the nodes in order, the function is deployed to all of them
+    # asynchronous: the node answers 202 once it has accepted the invocation
+    error = None
+    for url in target["urls"]:
+        try:
+            post(url, body, {"X-tinyFaaS-Async": "true"})
+            return
+        except InvocationError as e:
+            if not e.retryable:
+                # the node might run the function, another node would run it a second time
+                raise
+            print(f"tinyFaaS node {url} failed: {e}")
+            error = e
+    raise error
+
+
+def _invoke_lambda(target: dict, body: bytes) -> None:
+    region = target.get("region", None)
+
+    def factory():
+        import boto3
+        return boto3.client("lambda", region_name=region)
+
+    client = _client(("lambda", region), factory)
+    # InvocationType "Event" returns as soon as lambda has queued the event
+    response = client.invoke(FunctionName=target["function"], InvocationType="Event", Payload=body)
+    if response["StatusCode"] >= 300:
+        raise InvocationError(f"invoking lambda {target['function']} returned {response['StatusCode']}")
+
+
+def _invoke_pubsub(target: dict, body: bytes) -> None:
+
+    def factory():
+        from google.cloud import pubsub_v1
+        return pubsub_v1.PublisherClient()
+
+    publisher = _client(("pubsub",), factory)
+    publisher.publish(target["topic"], body).result(timeout=TIMEOUT)
+
+
+class Pending:
+    """
+    the futures one workflow invocation has to wait for before it returns
+    """
+
+    def __init__(self) -> None:
+        self._futures = []
+        self._lock = threading.Lock()
+
+    def track(self, future: concurrent.futures.Future) -> concurrent.futures.Future:
+        with self._lock:
+            self._futures.append(future)
+        return future
+
+    def flush(self, timeout: typing.Optional[float] = None, due: typing.Optional[typing.Callable[[], None]] = None) -> None:
+        """
+        wait for all tracked futures, raises the first error after all of them are done
+        :param due: called every time before waiting, e.g. to send the batches that tracked futures added items to
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        done = []
+        # tracked futures can start more invocations while they run, so wait until nothing is left
+        while True:
+            with self._lock:
+                pending = list(self._futures)
+                self._futures.clear()
+            if len(pending) == 0:
+                break
+            # only after taking the futures: what they add to a batch from now on is sent in the next round
+            if due is not None:
+                due()
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            finished, notDone = concurrent.futures.wait(pending, timeout=remaining)
+            if len(notDone) > 0:
+                raise TimeoutError(f"{len(notDone)} invocations didn't finish in time")
+            done.extend(finished)
+        for future in done:
+            future.result()
+
+
+# futures tracked outside of `tracking`, e.g. by scripts that ping functions (see prewarm.py)
+_default = Pending()
+_current = contextvars.ContextVar("pending", default=None)
+
+
+@contextlib.contextmanager
+def tracking() -> typing.Iterator[Pending]:
+    """
+    track the invocations started in this context separately, the wrappers use one per workflow invocation
+    """
+    token = _current.set(Pending())
+    try:
+        yield _current.get()
+    finally:
+        _current.reset(token)
+
+
+def _pending() -> Pending:
+    pending = _current.get()
+    return _default if pending is None else pending
+
+
+_invokers = {
+    "http": _invoke_http,
+    "tinyfaas": _invoke_tinyfaas,
+    "lambda": _invoke_lambda,
+    "pubsub": _invoke_pubsub
+}
+
+
+def _invoke_with_retries(target: dict, body: bytes) -> None:
+    invoker = _invokers[target["type"]]
+    delay = BACKOFF
+    for attempt in range(RETRIES + 1):
+        try:
+            return invoker(target, body)
+        except Exception as e:
+            # sdk errors (boto3, pubsub) are treated as retryable
+            if not getattr(e, "retryable", True) or attempt == RETRIES:
+                raise
+            # jitter so that concurrent fan-out retries don't hit the target at the same time
+            sleep = delay * (1 + random.random())
+            print(f"invocation failed, retrying in {sleep:.2f}s: {e}")
+        time.sleep(sleep)
+        delay *= 2
+
+
+def invoke(target: dict, body: bytes) -> concurrent.futures.Future:
+    """
+    send the encoded envelope `body` to `target` in the background
+    :return: a future that resolves once the target has accepted the invocation
+    """
+    if target["type"] not in _invokers:
+        raise ValueError(f"unknown invocation target type: {target['type']}")
+    return track(_executor.submit(_invoke_with_retries, target, body))
+
+
+def _ping(target: dict, body: bytes) -> None:
+    try:
+        _invoke_with_retries(target, body)
+    except Exception as e:
+        # a missed warm-up only costs a cold start later
+        print(f"warm-up ping failed: {e}")
+
+
+def ping(target: dict, hold: float = 0.0) -> concurrent.futures.Future:
+    """
+    send a warm-up ping to `target` in the background, failures are only logged
+    pings that are sent at the same time with a `hold` start one instance each
+    """
+    if target["type"] not in _invokers:
+        raise ValueError(f"unknown invocation target type: {target['type']}")
+    body = json.dumps({"ping": {"sent": time.time(), "hold": hold}}).encode("utf-8")
+    return track(_executor.submit(_ping, target, body))
+
+
+def track(future: concurrent.futures.Future) -> concurrent.futures.Future:
+    """
+    let `flush` wait for a future that sends invocations itself, e.g. a batch that is still collecting items
+    """
+    return _pending().track(future)
+
+
+def flush(timeout: typing.Optional[float] = None, due: typing.Optional[typing.Callable[[], None]] = None) -> None:
+    """
+    wait for all invocations pending in this context, raises the first error after all of them are done
+    :param due: see `Pending.flush`
+    """
+    _pending().flush(timeout, due)
@@ -0,0 +1,185 @@
+"""
+notification channel for the handoff store: waiting steps are woken up instead of polling the store
+
+configured in the "notify" part of the "handoff" section of the workflow:
+    {"type": "local", ..., "notify": {"type": "http", "url": "http://10.0.0.2:8090", "long_poll": 20}}
+- a step that waits for its input long-polls the broker at "url" (GET /wait/<key>?timeout=<long_poll>)
+- the step that writes the input publishes it afterwards (POST /publish/<key> with the value as body),
+  values up to MAX_VALUE bytes are passed along, so the waiter doesn't have to read them from the store,
+  for larger ones and after a long poll that timed out, the waiter reads the key from the store
+- notifications are kept by the broker for TTL seconds, so one that is sent before the waiter subscribes isn't lost
+- if the broker can't be reached, the waiter falls back to polling the store (see handoff.HandoffStore.wait),
+  the deadline is the "timeout" of the handoff section either way
+
+the broker is this module, it runs next to the functions, e.g. on a tinyFaaS node or in emulator.py:
+    python notify.py [--host 0.0.0.0] [--port 8090]
+lambda and gcp functions can't be called back directly, they don't accept incoming connections,
+so the waiting instance always subscribes at the broker
+"""
+
+import argparse
+import base64
+import http.server
+import json
+import threading
+import time
+import typing
+import urllib.error
+import urllib.parse
+import urllib.request
+
+
+LONG_POLL = 20          # seconds
+TTL = 600               # seconds a notification is kept
+MAX_VALUE = 64 * 1024   # bytes, larger values aren't passed along
+
+
+class ChannelError(Exception):
+    pass
+
+
+class Channel:
+
+    def publish(self, key: str, value: typing.Optional[bytes] = None) -> None:
+        raise NotImplementedError
+
+    def wait(self, key: str, timeout: float) -> tuple[bool, typing.Optional[bytes]]:
+        """
+        block until `key` is published or `timeout` seconds have passed
+        :return: (published, the value if it was passed along), raises ChannelError if the channel doesn't work
+        """
+        raise NotImplementedError
+
+
+class HttpChannel(Channel):
+    """
+    client of a broker, see `serve`
+    """
+
+    def __init__(self, url: str, longPoll: float = LONG_POLL) -> None:
+        self.url = url.rstrip("/")
+        self.longPoll = longPoll
+
+    def _request(self, method: str, path: str, timeout: float, data: typing.Optional[bytes] = None) -> dict:
+        request = urllib.request.Request(f"{self.url}{path}", method=method, data=data)
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                return json.loads(response.read())
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            raise ChannelError(f"{method} {self.url}{path} failed: {e}")
+
+    def publish(self, key: str, value: typing.Optional[bytes] = None) -> None:
+        if value is None or len(value) > MAX_VALUE:
+            value = b""
+        self._request("POST", f"/publish/{urllib.parse.quote(key)}", 10, value)
+
+    def wait(self, key: str, timeout: float) -> tuple[bool, typing.Optional[bytes]]:
+        timeout = min(timeout, self.longPoll)
+        # the socket timeout leaves the broker time to answer a long poll that timed out
+        response = self._request("GET", f"/wait/{urllib.parse.quote(key)}?timeout={timeout:.3f}", timeout + 5)
+        value = response.get("value", None)
+        return response.get("notified", False), base64.b64decode(value) if value is not None else None
+
+
+def new_channel(options: typing.Optional[dict]) -> typing.Optional[Channel]:
+    """
+    :param options: the "notify" part of the handoff section
+    :return: the channel or None if steps poll the store
+    """
+    if options is None:
+        return None
+    type = options.get("type", "http").lower()
+    if type == "http":
+        return HttpChannel(options["url"], options.get("long_poll", LONG_POLL))
+    raise ValueError(f"unknown notification channel type: {options['type']}")
+
+
+class Broker:
+    """
+    in-memory pub/sub with retained notifications
+    """
+
+    def __init__(self, ttl: float = TTL) -> None:
+        self.ttl = ttl
+        self._published = {}  # key -> (when it was published, value or None)
+        self._condition = threading.Condition()
+
+    def _expire(self, now: float) -> None:
+        for key in [k for k, (t, _) in self._published.items() if now - t > self.ttl]:
+            del self._published[key]
+
+    def publish(self, key: str, value: typing.Optional[bytes] = None) -> None:
+        with self._condition:
+            now = time.monotonic()
+            self._expire(now)
+            self._published[key] = (now, value)
+            self._condition.notify_all()
+
+    def wait(self, key: str, timeout: float) -> tuple[bool, typing.Optional[bytes]]:
+        with self._condition:
+            if not self._condition.wait_for(lambda: key in self._published, timeout):
+                return False, None
+            return True, self._published[key][1]
+
+
+def serve(host: str = "127.0.0.1", port: int = 0, broker: typing.Optional[Broker] = None) -> http.server.ThreadingHTTPServer:
+    """
+    :return: a running broker server, `server.server_address` has the port if it was 0
+    """
+    broker = broker or Broker()
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        # headers and body are written separately, don't let them wait for the client's delayed ack
+        disable_nagle_algorithm = True
+
+        def _reply(self, body: dict) -> None:
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self) -> None:
+            parsed = urllib.parse.urlsplit(self.path)
+            if not parsed.path.startswith("/publish/"):
+                self.send_error(404)
+                return
+            value = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            broker.publish(urllib.parse.unquote(parsed.path[len("/publish/"):]), value if 0 < len(value) <= MAX_VALUE else None)
+            self._reply({"published": True})
+
+        def do_GET(self) -> None:
+            parsed = urllib.parse.urlsplit(self.path)
+            if not parsed.path.startswith("/wait/"):
+                self.send_error(404)
+                return
+            query = urllib.parse.parse_qs(parsed.query)
+            timeout = min(float(query.get("timeout", [LONG_POLL])[0]), 60)
+            notified, value = broker.wait(urllib.parse.unquote(parsed.path[len("/wait/"):]), timeout)
+            self._reply({"notified": notified, "value": base64.b64encode(value).decode("ascii") if value is not None else None})
+
+        def log_message(self, format: str, *args: typing.Any) -> None:
+            pass
+
+    server = http.server.ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="notification broker for waiting workflow steps")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8090)
+    args = parser.parse_args()
+    server = serve(args.host, args.port)
+    print(f"notification broker listening on {args.host}:{server.server_address[1]}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
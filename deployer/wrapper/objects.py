@@ -0,0 +1,147 @@
+"""
+streaming access to the objects a workflow works on (e.g. the pdf in the s3 bucket)
+
+everything here reads in chunks, so peak memory depends on CHUNK_SIZE and SPOOL_SIZE instead of the object size
+temporary files always live in a directory that is unique to the invocation, so concurrent invocations
+in the same container (e.g. tinyFaaS with threads > 1) don't overwrite each other's files
+
+handlers get bucket stores from the resource cache:
+    bucket = data["resources"].bucket(input["bucket"], "us-east-1")
+    sha256 = objects.sha256(bucket, input["filename"])
+"""
+
+import concurrent.futures
+import contextlib
+import hashlib
+import os
+import shutil
+import tempfile
+import typing
+
+import handoff
+
+
+CHUNK_SIZE = 1024 * 1024       # 1 MiB
+SPOOL_SIZE = 8 * 1024 * 1024   # objects up to 8 MiB stay in memory, larger ones are spilled to a temporary file
+UPLOAD_WORKERS = 8
+
+
+def _open(store: handoff.HandoffStore, key: str) -> typing.BinaryIO:
+    stream = store.open(key)
+    if stream is None:
+        raise FileNotFoundError(f"object {key} doesn't exist")
+    return stream
+
+
+def read_chunks(stream: typing.BinaryIO, chunkSize: int = CHUNK_SIZE) -> typing.Iterator[bytes]:
+    while True:
+        chunk = stream.read(chunkSize)
+        if not chunk:
+            return
+        yield chunk
+
+
+def chunks(store: handoff.HandoffStore, key: str, chunkSize: int = CHUNK_SIZE) -> typing.Iterator[bytes]:
+    """
+    iterate over the contents of an object
+    """
+    stream = _open(store, key)
+    try:
+        yield from read_chunks(stream, chunkSize)
+    finally:
+        stream.close()
+
+
+def copy(store: handoff.HandoffStore, key: str, dst: typing.BinaryIO, hashers: typing.Iterable[typing.Any] = ()) -> int:
+    """
+    copy an object into a writable stream, feeding every chunk to `hashers` on the way
+    :return: the number of bytes copied
+    """
+    size = 0
+    for chunk in chunks(store, key):
+        for hasher in hashers:
+            hasher.update(chunk)
+        dst.write(chunk)
+        size += len(chunk)
+    return size
+
+
+def sha256(store: handoff.HandoffStore, key: str) -> str:
+    """
+    hash an object while it is downloaded, without storing it
+    """
+    hasher = hashlib.sha256()
+    for chunk in chunks(store, key):
+        hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def sha256_stream(stream: typing.BinaryIO) -> str:
+    """
+    hash a readable stream chunk by chunk (e.g. a pre-fetched object)
+    """
+    hasher = hashlib.sha256()
+    for chunk in read_chunks(stream):
+        hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def spool(store: handoff.HandoffStore, key: str, hashers: typing.Iterable[typing.Any] = ()) -> typing.BinaryIO:
+    """
+    download an object into a seekable buffer (e.g. for parsers), positioned at the start
+    small objects stay in memory, large ones are spilled to an anonymous temporary file
+    the caller has to close it
+    """
+    buffer = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    copy(store, key, buffer, hashers)
+    buffer.seek(0)
+    return buffer
+
+
+def download(store: handoff.HandoffStore, key: str, path: str, hashers: typing.Iterable[typing.Any] = ()) -> str:
+    """
+    download an object to `path`, e.g. for tools that need a file name
+    :return: the path
+    """
+    with open(path, "wb") as f:
+        copy(store, key, f, hashers)
+    return path
+
+
+def upload(store: handoff.HandoffStore, key: str, path: str) -> None:
+    with open(path, "rb") as f:
+        store.put_stream(key, f)
+
+
+def upload_all(store: handoff.HandoffStore, files: dict, workers: int = UPLOAD_WORKERS) -> list[str]:
+    """
+    upload several files at the same time, every file is streamed (and multipart for large files on s3, see handoff.S3Store)
+    :param files: object key -> path
+    :return: the keys, raises the first error after all uploads are done
+    """
+    if len(files) == 0:
+        return []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(workers, len(files))) as executor:
+        futures = [executor.submit(upload, store, key, path) for key, path in files.items()]
+    for future in futures:
+        future.result()
+    return list(files)
+
+
+@contextlib.contextmanager
+def workdir() -> typing.Iterator[str]:
+    """
+    a temporary directory that is unique to this invocation and removed afterwards
+    """
+    path = tempfile.mkdtemp(prefix="workflow-")
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def path(directory: str, key: str) -> str:
+    """
+    a file name inside `directory` for an object key
+    """
+    return os.path.join(directory, os.path.basename(key) or "object")
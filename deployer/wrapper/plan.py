@@ -0,0 +1,235 @@
+"""
+compiled execution plan for a workflow
+
+the deployer compiles workflow.json into a plan once, the wrappers then resolve the
+current step, its predecessors and its successors with dict lookups instead of scanning the steps list
+
+# plan example
+plan = {
+    "id": "3f2a...",            # content hash of the plan
+    "entries": [0, 1],          # steps without predecessors, ordered by id
+    "order": [0, 1, 2, 3],      # topological order, ties broken by id
+    "steps": {
+        "0": {"id": 0, "function_name": "check", "pre-fetch": true, "predecessors": [], "successors": [2]},
+        ...
+    }
+}
+step ids are stored as strings in "steps" because the plan travels as json
+
+the wrappers work on `State`: the plan as arrays (see `Plan`) and a cursor, the position of the current step
+states are immutable, the state of a successor shares everything with its predecessor but the cursor,
+so fan-out and retried invocations can use the same state without copying it
+"""
+
+import collections.abc
+import hashlib
+import json
+import threading
+import typing
+
+
+def step_dependencies(steps: list[dict]) -> dict:
+    """
+    :return: step id -> list of predecessor ids
+    if no step declares "depends_on", the steps form a chain ordered by id
+    """
+    if any("depends_on" in step for step in steps):
+        return {step["id"]: list(step.get("depends_on", [])) for step in steps}
+    ids = sorted(step["id"] for step in steps)
+    dependencies = {ids[0]: []} if len(ids) > 0 else {}
+    for previous, id in zip(ids, ids[1:]):
+        dependencies[id] = [previous]
+    return dependencies
+
+
+def compile_steps(steps: list[dict]) -> dict:
+    """
+    compile a list of workflow steps into a plan
+    raises ValueError for duplicate ids, unknown dependencies and cycles
+    """
+    byId = {}
+    for step in steps:
+        if step["id"] in byId:
+            raise ValueError(f"duplicate step id {step['id']}")
+        byId[step["id"]] = step
+
+    dependencies = step_dependencies(steps)
+    successors = {id: [] for id in byId}
+    for id in sorted(byId):
+        for dependency in dependencies[id]:
+            if dependency not in byId:
+                raise ValueError(f"step {id} depends on unknown step {dependency}")
+            successors[dependency].append(id)
+
+    # kahn's algorithm, always continue with the smallest ready id to keep the order stable
+    remaining = {id: len(dependencies[id]) for id in byId}
+    ready = sorted(id for id in byId if remaining[id] == 0)
+    entries = list(ready)
+    order = []
+    while len(ready) > 0:
+        id = ready.pop(0)
+        order.append(id)
+        for successor in successors[id]:
+            remaining[successor] -= 1
+            if remaining[successor] == 0:
+                ready.append(successor)
+                ready.sort()
+    if len(order) != len(byId):
+        raise ValueError("workflow steps contain a dependency cycle")
+
+    compiled = {}
+    for id in order:
+        step = {k: v for k, v in byId[id].items() if k != "depends_on"}
+        step["predecessors"] = dependencies[id]
+        step["successors"] = successors[id]
+        compiled[str(id)] = step
+
+    plan = {
+        "entries": entries,
+        "order": order,
+        "steps": compiled
+    }
+    plan["id"] = plan_id(plan)
+    return plan
+
+
+def plan_id(plan: dict) -> str:
+    """
+    content hash of a plan, everything but its "id" field is hashed
+    """
+    content = {k: v for k, v in plan.items() if k != "id"}
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def compile_workflow(workflow: dict) -> dict:
+    """
+    :return: a copy of the workflow with the "steps" list replaced by a compiled "plan"
+    workflows that are already compiled are returned unchanged
+    """
+    if "plan" in workflow:
+        return workflow
+    compiled = {k: v for k, v in workflow.items() if k != "steps"}
+    compiled["plan"] = compile_steps(workflow["steps"])
+    return compiled
+
+
+def get_step(plan: dict, id: typing.Any) -> dict:
+    try:
+        return plan["steps"][str(id)]
+    except KeyError:
+        raise KeyError(f"workflow has no step with id {id}")
+
+
+class Plan:
+    """
+    read-only, array-backed view of a compiled plan, built once per plan and container (see `view`)
+    steps are addressed by their position in "order", predecessors and successors are tuples of steps
+    """
+
+    __slots__ = ("id", "source", "steps", "positions", "predecessors", "successors", "entries")
+
+    def __init__(self, source: dict) -> None:
+        self.id = source["id"]
+        self.source = source
+        self.steps = tuple(get_step(source, id) for id in source["order"])
+        # ids are looked up as they are and as strings, the cursor of an envelope can be either
+        self.positions = {}
+        for i, step in enumerate(self.steps):
+            self.positions[step["id"]] = i
+            self.positions[str(step["id"])] = i
+        self.predecessors = tuple(tuple(self.steps[self.positions[id]] for id in step["predecessors"]) for step in self.steps)
+        self.successors = tuple(tuple(self.steps[self.positions[id]] for id in step["successors"]) for step in self.steps)
+        self.entries = tuple(self.steps[self.positions[id]] for id in source["entries"])
+
+    def position(self, id: typing.Any) -> int:
+        try:
+            return self.positions[id]
+        except KeyError:
+            raise KeyError(f"workflow has no step with id {id}")
+
+    def step(self, id: typing.Any) -> dict:
+        return self.steps[self.position(id)]
+
+
+_views = {}
+_viewsLock = threading.Lock()
+
+
+def view(plan: dict) -> Plan:
+    """
+    :return: the `Plan` of a compiled plan, cached by plan id
+    """
+    with _viewsLock:
+        cached = _views.get(plan["id"], None)
+        if cached is None:
+            cached = _views[plan["id"]] = Plan(plan)
+        return cached
+
+
+class State(collections.abc.Mapping):
+    """
+    immutable workflow state, reads like the "workflow" dict of the envelope (see wrapper.py)
+    derive new states with `advance` and `replace` instead of assigning to one
+    - `fields`: everything but "plan" and "current", shared between states and never modified
+    - `plan`: the `Plan`
+    - `cursor`: position of the current step, -1 before the first step of a run (no "current")
+    """
+
+    __slots__ = ("fields", "plan", "cursor")
+
+    def __init__(self, fields: dict, plan: Plan, cursor: int = -1) -> None:
+        # read-only by convention, blocking __setattr__ would make deriving states twice as expensive
+        self.fields = fields
+        self.plan = plan
+        self.cursor = cursor
+
+    def __getitem__(self, key: str) -> typing.Any:
+        if key == "plan":
+            return self.plan.source
+        if key == "current":
+            if self.cursor < 0:
+                raise KeyError(key)
+            return self.plan.steps[self.cursor]["id"]
+        return self.fields[key]
+
+    def __iter__(self) -> typing.Iterator[str]:
+        yield from self.fields
+        yield "plan"
+        if self.cursor >= 0:
+            yield "current"
+
+    def __len__(self) -> int:
+        return len(self.fields) + (2 if self.cursor >= 0 else 1)
+
+    def __repr__(self) -> str:
+        return f"State(plan={self.plan.id}, cursor={self.cursor}, run_id={self.fields.get('run_id', None)})"
+
+    def current(self) -> dict:
+        """
+        :return: the current step, the first entry step if the run hasn't started
+        """
+        return self.plan.steps[self.cursor] if self.cursor >= 0 else self.plan.entries[0]
+
+    def advance(self, step: dict) -> "State":
+        """
+        :return: the state that is sent along when invoking `step`
+        """
+        return State(self.fields, self.plan, self.plan.position(step["id"]))
+
+    def replace(self, **fields: typing.Any) -> "State":
+        """
+        :return: a state with some fields replaced, e.g. the run id of a batch item
+        """
+        return State({**self.fields, **fields}, self.plan, self.cursor)
+
+
+def state(workflow: typing.Mapping) -> State:
+    """
+    :return: the state of a compiled workflow dict, a state is returned unchanged
+    """
+    if isinstance(workflow, State):
+        return workflow
+    fields = {k: v for k, v in workflow.items() if k not in ("plan", "current")}
+    compiled = view(workflow["plan"])
+    current = workflow.get("current", None)
+    return State(fields, compiled, -1 if current is None else compiled.position(current))
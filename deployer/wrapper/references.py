@@ -0,0 +1,107 @@
+"""
+pass-by-reference for large step inputs
+
+invocation payloads are limited (lambda async invocations, pub/sub messages, ...) and every byte adds latency,
+so values above a threshold are written to the handoff store and only a reference travels:
+    {"$ref": {"key": "<run_id>/<step_id>/body-<uuid>", "bytes": 1234567}}
+
+the receiving wrapper hands the handler a `LazyInput` instead, it behaves like the original dict
+but is only loaded from the store when the handler touches it:
+    def handler(data, input):
+        input["filename"]                    # loads the value on first access
+        for chunk in objects.read_chunks(input.open()):  # or streams the raw json without loading it
+            ...
+a `LazyInput` that is returned (or forwarded) by a handler is sent on as the same reference, without loading it
+
+the threshold is "spill_bytes" in the "handoff" section of the workflow, in bytes of json
+"""
+
+import collections.abc
+import json
+import threading
+import typing
+
+import handoff
+
+
+REF = "$ref"
+DEFAULT_THRESHOLD = 64 * 1024
+
+
+def is_reference(value: typing.Any) -> bool:
+    return isinstance(value, dict) and len(value) == 1 and REF in value
+
+
+class LazyInput(collections.abc.Mapping):
+    """
+    a value in the handoff store, loaded on first access
+    """
+
+    def __init__(self, store: handoff.HandoffStore, reference: dict) -> None:
+        self.store = store
+        self.reference = reference
+        self._value = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def open(self) -> typing.BinaryIO:
+        """
+        :return: a stream of the json encoded value, the caller has to close it
+        """
+        stream = self.store.open(self.reference[REF]["key"])
+        if stream is None:
+            raise FileNotFoundError(f"referenced input {self.reference[REF]['key']} doesn't exist")
+        return stream
+
+    def value(self) -> typing.Any:
+        with self._lock:
+            if not self._loaded:
+                with self.open() as stream:
+                    self._value = json.load(stream)
+                self._loaded = True
+            return self._value
+
+    def __getitem__(self, key: typing.Any) -> typing.Any:
+        return self.value()[key]
+
+    def __iter__(self) -> typing.Iterator:
+        return iter(self.value())
+
+    def __len__(self) -> int:
+        return len(self.value())
+
+    def __repr__(self) -> str:
+        return f"LazyInput({self.reference[REF]['key']}, {self.reference[REF]['bytes']} bytes)"
+
+
+def spill(store: handoff.HandoffStore, key: str, value: typing.Any, threshold: int = DEFAULT_THRESHOLD) -> typing.Any:
+    """
+    :return: `value` if its json encoding fits into `threshold` bytes, otherwise a reference to it under `key`
+    the result is always json serializable, lazy inputs in `value` are replaced by their references
+    """
+    lazy = []
+
+    def default(v: typing.Any) -> typing.Any:
+        if not isinstance(v, LazyInput):
+            raise TypeError(f"object of type {type(v).__name__} is not json serializable")
+        lazy.append(v)
+        return v.reference
+
+    encoded = json.dumps(value, default=default).encode("utf-8")
+    if len(encoded) > threshold:
+        store.put(key, encoded)
+        return {REF: {"key": key, "bytes": len(encoded)}}
+    if len(lazy) > 0:
+        return json.loads(encoded)
+    return value
+
+
+def resolve(store: handoff.HandoffStore, value: typing.Any) -> typing.Any:
+    """
+    replace references with lazy inputs, at the top level and one level down (the merged inputs of joins)
+    """
+    if is_reference(value):
+        return LazyInput(store, value)
+    if isinstance(value, dict) and any(is_reference(v) for v in value.values()):
+        return {k: LazyInput(store, v) if is_reference(v) else v for k, v in value.items()}
+    return value
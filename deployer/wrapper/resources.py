@@ -0,0 +1,100 @@
+"""
+resources that are expensive to create and are kept for the lifetime of the container
+
+the wrappers pass the cache to the function handler as `data["resources"]`, e.g.
+    def handler(data, input):
+        s3 = data["resources"].s3("us-east-1")
+        bucket = data["resources"].bucket(input["bucket"], "us-east-1")  # for streaming access, see objects.py
+
+the deployer puts two files next to the wrapper modules, both are parsed once per container:
+- function.json: the function's entry from config.json
+- workflow.json: the compiled workflow (see plan.py)
+"""
+
+import json
+import os
+import threading
+import typing
+
+import handoff
+
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+class Resources:
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self._cache = {}
+        self._lock = threading.Lock()
+        self._creating = {}  # key -> lock held while the resource is created
+
+    def get(self, key: typing.Hashable, factory: typing.Callable[[], typing.Any]) -> typing.Any:
+        """
+        return the cached resource for `key`, `factory` creates it on first use
+        factories can do I/O (e.g. load a plan from s3), only callers of the same key wait for them
+        """
+        with self._lock:
+            if key in self._cache:
+                return self._cache[key]
+            creating = self._creating.setdefault(key, threading.Lock())
+        with creating:
+            with self._lock:
+                if key in self._cache:
+                    return self._cache[key]
+            resource = factory()
+            with self._lock:
+                self._cache[key] = resource
+                self._creating.pop(key, None)
+            return resource
+
+    def s3(self, region: typing.Optional[str] = None) -> typing.Any:
+
+        def factory():
+            import boto3
+            return boto3.client("s3", region_name=region)
+
+        return self.get(("s3", region), factory)
+
+    def store(self, options: typing.Optional[dict], bucket: typing.Optional[str] = None) -> handoff.HandoffStore:
+        """
+        the handoff store (or, with `bucket`, a store for the workflow's data objects)
+        """
+
+        def factory():
+            if bucket is None:
+                return handoff.new_store(options)
+            return handoff.open_bucket(options, bucket)
+
+        return self.get(("store", json.dumps(options, sort_keys=True), bucket), factory)
+
+    def bucket(self, name: str, region: typing.Optional[str] = None) -> handoff.HandoffStore:
+        """
+        a store for the objects in bucket `name`, to be used with objects.py
+        this is s3 unless the WORKFLOW_OBJECT_STORE environment variable holds other store options (json, see handoff.py)
+        """
+        options = {"type": "s3", "region": region}
+        if os.environ.get("WORKFLOW_OBJECT_STORE", "") != "":
+            options = json.loads(os.environ["WORKFLOW_OBJECT_STORE"])
+        return self.store(options, name)
+
+    def _load(self, filename: str) -> typing.Optional[dict]:
+        path = os.path.join(self.directory, filename)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def config(self) -> typing.Optional[dict]:
+        return self.get(("file", "function.json"), lambda: self._load("function.json"))
+
+    def workflow(self) -> typing.Optional[dict]:
+        return self.get(("file", "workflow.json"), lambda: self._load("workflow.json"))
+
+
+_resources = Resources(DIRECTORY)
+
+
+def get_resources() -> Resources:
+    return _resources
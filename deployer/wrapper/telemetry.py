@@ -0,0 +1,134 @@
+"""
+one structured timing record per invocation, written to stdout as a json line
+
+the platform wrappers import this module before anything else, so the time until `imported()` is called
+covers the import of the handler and its requirements (only reported for cold starts)
+
+# record example
+{
+    "type": "invocation",
+    "platform": "aws",
+    "function": "check",
+    "run_id": "...",
+    "step_id": 0,
+    "cold": true,
+    "start": 1700000000.123,    # unix time
+    "import_ms": 812.4,         # cold starts only
+    "prefetch_ms": 120.3,
+    "input_wait_ms": 15.0,
+    "handler_ms": 230.9,
+    "handoff_ms": 12.2,         # early invocations, delivering the output and waiting for pending invocations
+    "total_ms": 380.1,
+    "cache": "hit",             # steps with a result cache only, "hit" or "miss" (see cache.py)
+    "batch_size": 20,           # batched invocations only, one record per item (see batch.py)
+    "adaptive": {"3": {"mode": "delayed", "delay_ms": 120.0}},  # how "auto" successors were invoked (see adaptive.py)
+    "error": "TimeoutError: ...",   # failed invocations only, the record is emitted anyway (see `recorded`)
+    "timeline": [               # every measured phase with unix start and end time, in the order they ended
+                                # (handoff, prefetch and input_wait can overlap, see wrapper.gather_inputs)
+        ["handoff", 1700000000.124, 1700000000.125],
+        ...
+    ],
+    # trace context, see wrapper.trace_fields
+    "span": "...", "parent": "...", "sent": 1700000000.01, "received": 1700000000.12, "predecessors": [...]
+}
+"""
+
+import contextlib
+import json
+import sys
+import threading
+import time
+import typing
+
+
+PHASES = ["prefetch", "input_wait", "handler", "handoff"]
+
+_importStart = time.perf_counter()
+_importMs = None
+_cold = True
+_outputLock = threading.Lock()  # concurrent invocations of one container share stdout
+
+
+def imported() -> None:
+    """
+    called by the platform wrappers once all of their imports are done
+    """
+    global _importMs
+    if _importMs is None:
+        _importMs = (time.perf_counter() - _importStart) * 1000
+
+
+class Invocation:
+
+    def __init__(self, platform: str) -> None:
+        global _cold
+        self.platform = platform
+        self.cold = _cold
+        _cold = False
+        self.start = time.time()
+        self._start = time.perf_counter()
+        self.phases = {phase: 0.0 for phase in PHASES}
+        self.timeline = []
+        self.fields = {}
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> typing.Iterator[None]:
+        """
+        measure a phase, phases that run several times (e.g. handoff) are summed up
+        """
+        start = time.perf_counter()
+        startUnix = time.time()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + (time.perf_counter() - start) * 1000
+            self.timeline.append([name, round(startUnix, 6), round(time.time(), 6)])
+
+    def set(self, **fields: typing.Any) -> None:
+        self.fields.update(fields)
+
+    def record(self) -> dict:
+        record = {
+            "type": "invocation",
+            "platform": self.platform,
+            "cold": self.cold,
+            "start": self.start
+        }
+        record.update(self.fields)
+        if self.cold:
+            record["import_ms"] = round(_importMs, 3) if _importMs is not None else None
+        for name, ms in self.phases.items():
+            record[f"{name}_ms"] = round(ms, 3)
+        record["total_ms"] = round((time.perf_counter() - self._start) * 1000, 3)
+        record["timeline"] = self.timeline
+        return record
+
+    def emit(self) -> None:
+        """
+        write the record as one line, in a single write so that records of concurrent invocations don't interleave
+        """
+        line = json.dumps(self.record()) + "\n"
+        with _outputLock:
+            sys.stdout.write(line)
+            sys.stdout.flush()
+
+
+def start(platform: str) -> Invocation:
+    return Invocation(platform)
+
+
+@contextlib.contextmanager
+def recorded(invocations: list[Invocation]) -> typing.Iterator[None]:
+    """
+    emit the records of `invocations` when the block is left, also if it raised, then with the error
+    the list is read on exit, invocations that are added to it inside the block are emitted as well
+    """
+    try:
+        yield
+    except BaseException as e:
+        for invocation in invocations:
+            invocation.set(error=f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        for invocation in invocations:
+            invocation.emit()
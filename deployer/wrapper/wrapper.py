@@ -1,68 +1,820 @@
 """
 # workflow example
 wf = {
-    "steps": [
+    "run_id": "...",                # set by the first step if missing
+    "current": 0,                   # id of the step the receiving function runs, set by the predecessor
+    "trace": {"parent": "...", "sent": 1700000000.0},  # set by the invoking step, see trace_fields
+    "plan": {...},                  # compiled from "steps" by the deployer, see plan.py
+                                    # compact envelopes carry "plan_id" instead, see envelope.py
+    "handoff": {"type": "local"},   # see handoff.py, "spill_bytes" sets the size limit for inline inputs (see references.py)
+                                    # "notify" wakes up waiting steps (see notify.py), "timeout", "poll_interval" and
+                                    # "max_poll_interval" (seconds) bound the wait for inputs, a polling step misses its
+                                    # input by up to "max_poll_interval" (default 0.1), lower costs more store requests
+    "data": [                       # objects that pre-fetching steps download before their input is ready
+        {"bucket": "...", "key": "..."}
+    ],
+    "steps": [                      # as written in workflow.json, replaced by "plan" once compiled
         {
             "id": 0,
             "function_name": "check",
-            "node": "..."
+            "node": "...",
+            "batch": {"size": 20},  # optional, several runs share an invocation (see batch.py)
+            "prewarm": true,        # optional, see below
+            "pre-fetch": true,      # true, false or "auto" (see below)
+            "cache": true           # optional, results are memoized by the content of the input (see cache.py)
+        },
+        {
+            "id": 1,
+            "function_name": "virus",
+            "depends_on": [0]       # optional, see below
         }
     ]
 }
+
+# dependencies
+- if no step declares "depends_on", the steps form a chain ordered by id
+- otherwise every step runs once all steps listed in its "depends_on" have finished
+  - steps with multiple successors fan out, all successors are invoked concurrently
+  - steps with multiple predecessors are joins, they fire once all predecessors have delivered
+    their output and receive {predecessor function_name: output, ...} as input
+- the plan is never modified, the "current" field is the only thing that changes between hops
+- the wrapper works on an immutable `plan.State` that reads like this dict, `prepare_workflow` creates it,
+  `update_workflow` derives the state of a next step without copying anything but the cursor
+
+# execution
+- `execute` runs one invocation, the platform wrappers (wrapper_aws.py, ...) only decode the event and
+  encode the response, so every provider runs the same choreography
+
+# batches
+- invocations of steps with a "batch" section are collected and sent as one batch envelope (see batch.py),
+  the receiving wrapper runs the handler once per item with `handle_batch`
+- every item is a run of its own, its continuation is the same as if it had been invoked alone
+
+# pre-warming
+- when a run starts, the first step pings the steps with "prewarm" that aren't invoked right away (see invoke.ping),
+  so their cold start overlaps with the steps before them, e.g. for docker images or gcp functions
+- "prewarm": true or {"interval": 60}, a container pings a step at most once per interval (seconds, default 60)
+- every wrapper answers pings with `handle_ping` without running the handler
+
+# adaptive pre-fetching
+- for steps with "pre-fetch": "auto", the predecessor decides per invocation whether to invoke them early,
+  after a delay or with the input (see adaptive.py), `choose_invocations` makes the decision before the handler runs
+- the steps measure their own timings after the handler (`observe_timing`), the decision of a join is made
+  by every predecessor, the one that fires first invokes it
 """
 
-def get_current_step(workflow: dict) -> dict:
+import concurrent.futures
+import contextlib
+import contextvars
+import json
+import threading
+import time
+import typing
+import uuid
+
+import adaptive
+import batch
+import cache
+import envelope
+import handoff
+import invoke
+import notify
+import objects
+import plan
+import references
+import resources
+import telemetry
+
+
+def prepare_workflow(workflow: typing.Mapping) -> plan.State:
+    """
+    compile the workflow if it still has a raw steps list (see plan.py) and make sure it has a run id
+    the deployer ships a compiled workflow, so this normally doesn't do anything but the run id
+    a workflow without steps and plan is completed with the compiled workflow deployed next to the function
+    an interned plan (see envelope.py) is replaced by the plan it refers to
+    :return: the state of this invocation (see plan.State), `workflow` isn't modified
+    """
+    if "plan" not in workflow and "plan_id" in workflow:
+        planId = workflow["plan_id"]
+        workflow = {k: v for k, v in workflow.items() if k != "plan_id"}
+        workflow["plan"] = load_plan(workflow, planId)
+    elif "plan" not in workflow and "steps" not in workflow:
+        deployed = resources.get_resources().workflow()
+        if deployed is None:
+            raise ValueError("workflow has neither steps nor a plan and no workflow.json is deployed")
+        workflow = {**deployed, **workflow}
+    workflow = plan.compile_workflow(workflow)
+
+    # the first step of a run generates its id
+    fields = {}
+    if workflow.get("run_id", None) is None:
+        fields["run_id"] = uuid.uuid4().hex
+    # trace context: a new span for this invocation, the invoking step's span is the parent
+    incoming = workflow.get("trace", None) or {}
+    fields["trace"] = {
+        "span": uuid.uuid4().hex[:16],
+        "parent": incoming.get("parent", None),
+        "sent": incoming.get("sent", None),
+        "received": time.time()
+    }
+    return plan.state(workflow).replace(**fields)
+
+
+def trace_fields(workflow: plan.State, current_step: dict) -> dict:
+    """
+    :return: the fields that identify this invocation in the timing record (see telemetry.py and collector.py)
+    """
+    return {
+        "function": current_step["function_name"],
+        "run_id": workflow["run_id"],
+        "step_id": current_step["id"],
+        "predecessors": current_step["predecessors"],
+        **workflow["trace"]
+    }
+
+
+def plan_key(id: str) -> str:
+    return f"plans/{id}"
+
+
+def load_plan(workflow: typing.Mapping, id: str) -> dict:
+    """
+    :return: the plan with the given id, the one deployed next to the function or the one published in the handoff store
+    """
+    deployed = resources.get_resources().workflow()
+    if deployed is not None and deployed.get("plan", {}).get("id", None) == id:
+        return deployed["plan"]
+
+    store = get_store(workflow)
+
+    def factory():
+        published = store.get_json(plan_key(id))
+        if published is None:
+            raise ValueError(f"plan {id} is neither deployed nor published in the handoff store")
+        return published
+
+    return resources.get_resources().get(("plan", id), factory)
+
+
+def publish_plan(workflow: plan.State) -> None:
     """
-    return the function with the smallest id
+    make the plan available to receivers of interned envelopes, once per plan and container
     """
-    minId = 1e12
-    min = None
-    for function in workflow["steps"]:
-        if function["id"] < minId:
-            minId = function["id"]
-            min = function
-    return min
+    id = workflow["plan"]["id"]
+    store = get_store(workflow)
+    resources.get_resources().get(("published", id), lambda: store.create(plan_key(id), json.dumps(workflow["plan"]).encode("utf-8")))
+
+
+def get_step(workflow: plan.State, id: typing.Any) -> dict:
+    return workflow.plan.step(id)
 
 
-def update_workflow(workflow: dict) -> dict:
+def get_predecessors(workflow: plan.State, step: dict) -> tuple[dict, ...]:
+    return workflow.plan.predecessors[workflow.plan.position(step["id"])]
+
+
+def get_successors(workflow: plan.State, step: dict) -> tuple[dict, ...]:
+    return workflow.plan.successors[workflow.plan.position(step["id"])]
+
+
+def get_entry_steps(workflow: plan.State) -> tuple[dict, ...]:
     """
-    :return: updated workflow and the current step
+    return the steps without predecessors, ordered by id
+    """
+    return workflow.plan.entries
+
+
+def get_current_step(workflow: plan.State) -> dict:
+    """
+    return the step the receiving function runs
+    if the workflow doesn't specify it, this is the first invocation of the run: use the entry step with the smallest id
+    """
+    return workflow.current()
+
+
+def update_workflow(workflow: plan.State, step: dict) -> plan.State:
+    """
+    :return: the state that is sent along when invoking `step`
+    everything but the cursor is shared with the original, which isn't modified
+    """
+    return workflow.advance(step)
+
+
+def get_next_steps(workflow: plan.State) -> tuple[dict, ...]:
+    """
+    find the next steps to invoke, there can be multiple (fan-out) or none (end of the workflow)
+    on the first invocation of a run, the remaining entry steps are started as well
     """
-    steps = workflow["steps"]
     current = get_current_step(workflow)
-    steps.remove(current)
-    workflow["steps"] = steps
-    return workflow
+    successors = get_successors(workflow, current)
+    if workflow.get("current", None) is None:
+        successors = get_entry_steps(workflow)[1:] + successors
+    return successors
 
 
-def get_next_step(workflow: dict) -> dict:
+def get_run_id(workflow: plan.State) -> str:
     """
-    find the next step to invoke
-    # TODO update to enable fan-out, there could be multiple next steps to invoke
+    return the id of this workflow run, the first step generates it (see prepare_workflow)
     """
-    return get_current_step(update_workflow(workflow))
+    return workflow["run_id"]
 
-#
-# TODO 
-#
 
-def upload_function_input(input: dict) -> None:
-    pass
+def get_store(workflow: typing.Mapping, bucket: typing.Optional[str] = None) -> handoff.HandoffStore:
+    return resources.get_resources().store(workflow.get("handoff", None), bucket)
 
 
-def invoke_next(function: dict, input: dict) -> dict:
-    # TODO change inputs according to how function is actually used in function wrappers
+def get_channel(workflow: typing.Mapping) -> typing.Optional[notify.Channel]:
+    """
+    :return: the notification channel of the handoff store or None if waiting steps poll it
+    """
+    options = (workflow.get("handoff", None) or {}).get("notify", None)
+    if options is None:
+        return None
+    return resources.get_resources().get(("channel", json.dumps(options, sort_keys=True)), lambda: notify.new_channel(options))
+
+
+def input_key(workflow: plan.State, step: dict, predecessor: dict) -> str:
+    return handoff.step_key(get_run_id(workflow), step["id"], f"input-{predecessor['id']}")
+
+
+def spill_input(workflow: plan.State, step: dict, input: typing.Any) -> typing.Any:
+    """
+    :return: `input` or, if it's too large to be sent inline, a reference to it in the handoff store
+    """
+    options = workflow.get("handoff", None) or {}
+    key = handoff.step_key(get_run_id(workflow), step["id"], f"body-{uuid.uuid4().hex}")
+    return references.spill(get_store(workflow), key, input, options.get("spill_bytes", references.DEFAULT_THRESHOLD))
+
+
+def resolve_input(workflow: plan.State, input: typing.Any) -> typing.Any:
+    """
+    :return: the input for the function handler, referenced values are loaded when the handler accesses them
+    """
+    return references.resolve(get_store(workflow), input)
+
 
+def upload_function_input(workflow: plan.State, current_step: dict, next_step: dict, input: dict) -> None:
     """
-    this function assumes that the url for the next function triggers async invocation
+    store the input record that `current_step` produced for `next_step` and notify it if it's waiting
+    large inputs are stored separately, so waiting for the record stays cheap
     """
+    record = json.dumps({"body": spill_input(workflow, next_step, input)}).encode("utf-8")
+    key = input_key(workflow, next_step, current_step)
+    get_store(workflow).put(key, record)
+    channel = get_channel(workflow)
+    if channel is not None:
+        try:
+            channel.publish(key, record)
+        except notify.ChannelError as e:
+            # the waiting step reads the store again once its long poll ends
+            print(f"notifying step {next_step['id']} failed: {e}")
 
-    pass
+
+def join_inputs(workflow: plan.State, step: dict, records: dict) -> typing.Any:
+    """
+    :param records: predecessor id -> input record
+    :return: the function input for a step, merged by predecessor function name for joins
+    """
+    predecessors = get_predecessors(workflow, step)
+    if len(predecessors) == 1:
+        return records[predecessors[0]["id"]]["body"]
+    return {p["function_name"]: records[p["id"]]["body"] for p in predecessors}
+
+
+def claim(workflow: plan.State, step: dict, name: str) -> bool:
+    """
+    join primitive: only the first caller for a (run, step, name) gets True
+    """
+    return get_store(workflow).create(handoff.step_key(get_run_id(workflow), step["id"], name), b"")
+
+
+def get_invoke_target(step: dict) -> dict:
+    """
+    :return: the invocation target of a step, see invoke.py
+    steps without an "invoke" field fall back to their "url" (http POST)
+    """
+    if "invoke" in step:
+        return step["invoke"]
+    if step.get("url", "...") != "...":
+        return {"type": "http", "url": step["url"]}
+    raise ValueError(f"step {step['id']} ({step['function_name']}) has no invocation target")
 
 
-def prefetch_data(current_step: dict) -> None:
-    pass
+def invoked_early(step: dict) -> bool:
+    """
+    :return: True if `step` pre-fetches and is invoked before its input is ready
+    steps with a synchronous target (see invoke.is_synchronous) are invoked with their input instead,
+    an early invocation would keep the request open while the step waits for its input
+    """
+    return bool(step["pre-fetch"]) and not invoke.is_synchronous(get_invoke_target(step))
+
+
+def invoke_next(workflow: plan.State, input: typing.Any) -> concurrent.futures.Future:
+    """
+    invoke the step the workflow's cursor points to with {"workflow": ..., "body": input}
+    inputs above the spill threshold are sent as a reference (see references.py)
+    the envelope is encoded as the target's "encoding" says (see envelope.py)
+    steps with a "batch" section are invoked together with the other runs that are sent to them (see batch.py)
+    this doesn't wait for the invocation, call `wait_for_invocations` before the wrapper returns
+    """
+    step = get_current_step(workflow)
+    options = step.get("batch", None)
+    if options is not None:
+        key = (workflow["plan"]["id"], step["id"])
+        return invoke.track(_batcher.add(key, (workflow, input), options.get("size", None), options.get("window", 0.0)))
+    return _invoke_one(workflow, input)
+
+
+def _encode(target: dict, workflow: plan.State, payload: dict) -> bytes:
+    if target.get("encoding", "json") != "json":
+        publish_plan(workflow)
+    payload["workflow"]["trace"] = {"parent": workflow["trace"]["span"], "sent": time.time()}
+    return envelope.encode(payload, target.get("encoding", "json"))
+
+
+def _invoke_one(workflow: plan.State, input: typing.Any) -> concurrent.futures.Future:
+    step = get_current_step(workflow)
+    payload = {"workflow": dict(workflow)}
+    if input is not None:
+        payload["body"] = spill_input(workflow, step, input)
+    target = get_invoke_target(step)
+    return invoke.invoke(target, _encode(target, workflow, payload))
+
+
+def _invoke_batch(calls: list[tuple[plan.State, typing.Any]]) -> concurrent.futures.Future:
+    """
+    invoke a step once for several runs with {"workflow": ..., "batch": [{"run_id": ..., "body": ..., "data": ...}, ...]}
+    the calls come from `invoke_next`, they all have the same plan and cursor
+    """
+    if len(calls) == 1:
+        return _invoke_one(*calls[0])
+    workflow = calls[0][0]
+    step = get_current_step(workflow)
+    items = []
+    for w, input in calls:
+        item = {"run_id": get_run_id(w), "data": w.get("data", [])}
+        if input is not None:
+            item["body"] = spill_input(w, step, input)
+        items.append(item)
+    payload = {"workflow": {k: v for k, v in workflow.items() if k not in ("run_id", "data")}, "batch": items}
+    target = get_invoke_target(step)
+    return invoke.invoke(target, _encode(target, workflow, payload))
+
+
+# container-wide, so that concurrent invocations of a container can share batches
+_batcher = batch.Batcher(_invoke_batch)
+
+
+def wait_for_invocations() -> None:
+    # early invocations run on the phase threads and can still add items to batches without a window,
+    # so the due batches are sent again whenever flush has waited for the futures tracked so far
+    invoke.flush(due=_batcher.flush_due)
+
+
+def _invoke_all(workflow: plan.State, calls: list[tuple[plan.State, typing.Any]]) -> None:
+    """
+    invoke several steps concurrently, each with its own copy of the workflow cursor
+    """
+    for step, input in calls:
+        invoke_next(update_workflow(workflow, step), input)
 
 
-def get_function_input(current_step: dict) -> dict:
-    pass
+PING_INTERVAL = 60  # seconds
+MAX_HOLD = 10       # seconds
+
+# step -> when this container pinged it last
+_pinged = {}
+_pingedLock = threading.Lock()
+
+
+def prewarm(workflow: plan.State, next_steps: typing.Sequence[dict]) -> None:
+    """
+    on the first invocation of a run, ping the steps with "prewarm" that aren't invoked now
+    """
+    if workflow.get("current", None) is not None:
+        return
+    now = time.monotonic()
+    invokedNow = {get_current_step(workflow)["id"]} | {step["id"] for step in next_steps if invoked_early(step) or len(step["predecessors"]) == 0}
+    for id in workflow["plan"]["order"]:
+        step = get_step(workflow, id)
+        options = step.get("prewarm", False)
+        if options is False or id in invokedNow:
+            continue
+        interval = options.get("interval", PING_INTERVAL) if isinstance(options, dict) else PING_INTERVAL
+        key = (workflow["plan"]["id"], id)
+        with _pingedLock:
+            if now - _pinged.get(key, -interval) < interval:
+                continue
+            _pinged[key] = now
+        print(f"pinging step {id} ({step['function_name']})")
+        invoke.ping(get_invoke_target(step))
+
+
+def handle_ping(ping: dict, invocation: telemetry.Invocation) -> None:
+    """
+    answer a warm-up ping (see invoke.ping): the imports are done, stay busy for "hold" seconds
+    so that concurrent pings start separate instances, then emit a record with type "ping"
+    """
+    print("warm-up ping")
+    time.sleep(min(max(ping.get("hold", 0.0), 0.0), MAX_HOLD))
+    invocation.set(type="ping", sent=ping.get("sent", None))
+    invocation.emit()
+
+
+def get_stats(workflow: plan.State) -> adaptive.Stats:
+    """
+    :return: the timing statistics of the steps (see adaptive.py), one per container and handoff store
+    """
+    store = get_store(workflow)
+    key = ("stats", json.dumps(workflow.get("handoff", None), sort_keys=True))
+    return resources.get_resources().get(key, lambda: adaptive.Stats(store))
+
+
+def stats_key(workflow: plan.State, step: dict) -> str:
+    return adaptive.Stats.key(workflow["plan"]["id"], step["id"])
+
+
+def _invoke_claimed(workflow: plan.State, step: dict) -> None:
+    """
+    invoke a pre-fetching step without input, a join only if no other predecessor has invoked it yet
+    """
+    if len(get_predecessors(workflow, step)) > 1 and not claim(workflow, step, "invoked"):
+        return
+    invoke_next(update_workflow(workflow, step), None)
+
+
+def choose_invocations(invocation: telemetry.Invocation, workflow: plan.State, current_step: dict, next_steps: typing.Sequence[dict]) -> dict:
+    """
+    decide how the successors with "pre-fetch": "auto" are invoked, from the busy time of this step
+    and the startup time of the successor (see adaptive.py), the decisions are added to the timing record
+    :return: step id -> (mode, adaptive.Delayed or None), pass it to `invoke_early` and `deliver`
+    """
+    decisions = {}
+    for step in next_steps:
+        predecessors = get_predecessors(workflow, step)
+        if not adaptive.is_auto(step) or len(predecessors) == 0 or not invoked_early(step):
+            continue
+        options = step.get("adaptive", None) or {}
+        minSamples = options.get("min_samples", adaptive.MIN_SAMPLES)
+        stats = get_stats(workflow)
+        busy = stats.get(stats_key(workflow, current_step), "busy_ms", minSamples)
+        startup = stats.get(stats_key(workflow, step), "startup_ms", minSamples)
+        mode, delay = adaptive.decide(busy, startup, options, len(predecessors) > 1)
+        delayed = None
+        if mode == adaptive.DELAYED:
+            delayed = adaptive.Delayed(delay, lambda step=step: _invoke_claimed(workflow, step))
+        decisions[step["id"]] = (mode, delayed)
+    if len(decisions) > 0:
+        invocation.set(adaptive={
+            str(id): {"mode": mode, "delay_ms": round(delayed.delay * 1000, 3) if delayed is not None else 0.0}
+            for id, (mode, delayed) in decisions.items()
+        })
+    return decisions
+
+
+def observe_timing(invocation: telemetry.Invocation, workflow: plan.State, current_step: dict, next_steps: typing.Sequence[dict]) -> None:
+    """
+    update this step's statistics after the handler, only those a decision is based on:
+    busy_ms if a successor is "auto", startup_ms if this step is
+    """
+    ends = {name: end for name, _, end in invocation.timeline}
+    trace = workflow["trace"]
+    samples = {}
+    if "handler" in ends and any(adaptive.is_auto(step) for step in next_steps):
+        samples["busy_ms"] = (ends["handler"] - trace["received"]) * 1000
+    if "prefetch" in ends and adaptive.is_auto(current_step) and trace.get("sent", None) is not None:
+        samples["startup_ms"] = (ends["prefetch"] - trace["sent"]) * 1000
+    if len(samples) == 0:
+        return
+    stats = get_stats(workflow)
+    stats.observe(stats_key(workflow, current_step), **samples)
+    invoke.track(_submit(stats.publish))
+
+
+def invoke_early(workflow: plan.State, next_steps: typing.Sequence[dict], input: typing.Any, decisions: typing.Optional[dict] = None) -> None:
+    """
+    invoke all pre-fetching successors without input, they will wait for it in the handoff store
+    (except those with a synchronous target, see `invoked_early`)
+    for joins, only the first predecessor to get here invokes the step
+    entry steps that are started together with this one get the same `input` as this invocation
+    "auto" steps are invoked as `decisions` says (see `choose_invocations`), delayed ones are only scheduled here
+    the first step of a run also pings the steps that should be warmed up (see `prewarm`)
+    """
+    prewarm(workflow, next_steps)
+    calls = []
+    for step in next_steps:
+        predecessors = get_predecessors(workflow, step)
+        if len(predecessors) == 0:
+            calls.append((step, input))
+            continue
+        if not invoked_early(step):
+            continue
+        mode, delayed = (decisions or {}).get(step["id"], (adaptive.EARLY, None))
+        if mode == adaptive.PUSH:
+            continue
+        if delayed is not None:
+            invoke.track(delayed.start())
+            continue
+        if len(predecessors) > 1 and not claim(workflow, step, "invoked"):
+            continue
+        calls.append((step, None))
+    _invoke_all(workflow, calls)
+
+
+def deliver(workflow: plan.State, current_step: dict, next_steps: typing.Sequence[dict], result: typing.Any, decisions: typing.Optional[dict] = None) -> None:
+    """
+    hand the output of `current_step` to all of its successors
+    - pre-fetching successors have already been invoked, they get their input through the handoff store
+      (unless their target is synchronous, those are invoked now like the others, see `invoked_early`)
+      delayed invocations (see `choose_invocations`) are sent now, the input is ready
+    - others are invoked with {"workflow": ..., "body": result}, so are "auto" steps that were pushed
+    - joins are invoked by the predecessor that completes them, with the merged outputs of all predecessors
+    """
+    calls = []
+    for step in next_steps:
+        predecessors = get_predecessors(workflow, step)
+        if len(predecessors) == 0:
+            # another entry step, already started by `invoke_early`
+            continue
+        mode, delayed = (decisions or {}).get(step["id"], (adaptive.EARLY, None))
+        if invoked_early(step) and mode != adaptive.PUSH:
+            upload_function_input(workflow, current_step, step, result)
+            if delayed is not None:
+                delayed.fire()
+            continue
+        if len(predecessors) == 1:
+            calls.append((step, result))
+            continue
+        upload_function_input(workflow, current_step, step, result)
+        records = {p["id"]: get_store(workflow).get_json(input_key(workflow, step, p)) for p in predecessors}
+        if any(r is None for r in records.values()):
+            print(f"step {step['id']} is still waiting for other predecessors")
+            continue
+        if claim(workflow, step, "fired"):
+            calls.append((step, join_inputs(workflow, step, records)))
+    _invoke_all(workflow, calls)
+
+
+def prefetch_data(workflow: plan.State, current_step: dict) -> typing.Optional[dict]:
+    """
+    download the workflow's data objects while the previous step is still running
+    :return: object key -> seekable buffer (see objects.spool), or None if there is nothing to pre-fetch
+    """
+    refs = workflow.get("data", [])
+    if len(refs) == 0:
+        return None
+    data = {}
+    for ref in refs:
+        try:
+            data[ref["key"]] = objects.spool(get_store(workflow, ref["bucket"]), ref["key"])
+        except FileNotFoundError:
+            print(f"pre-fetching {ref['bucket']}/{ref['key']} failed: object doesn't exist")
+            data[ref["key"]] = None
+    return data
+
+
+# the I/O before the handler runs on these threads, see `gather_inputs`
+_phases = concurrent.futures.ThreadPoolExecutor(max_workers=32, thread_name_prefix="phase")
+
+
+def _submit(fn: typing.Callable, *args: typing.Any) -> concurrent.futures.Future:
+    """
+    run `fn` on a phase thread in the caller's context, so the invocations it starts are tracked for
+    the workflow invocation that submitted it (see invoke.tracking)
+    """
+    return _phases.submit(contextvars.copy_context().run, fn, *args)
+
+
+def _timed(invocation: telemetry.Invocation, name: str, fn: typing.Callable, *args: typing.Any) -> typing.Any:
+    with invocation.phase(name):
+        return fn(*args)
+
+
+def gather_inputs(invocation: telemetry.Invocation, workflow: plan.State, current_step: dict, next_steps: typing.Sequence[dict], input: typing.Any, decisions: typing.Optional[dict] = None) -> tuple[typing.Optional[dict], typing.Any]:
+    """
+    do the independent I/O before the handler at the same time:
+    - invoke the pre-fetching next steps ("handoff", see `invoke_early`)
+    - download this step's data if it pre-fetches ("prefetch")
+    - wait for the input in the handoff store if it pre-fetches and the input isn't part of the event ("input_wait")
+    the phases overlap in the timing record
+    :return: (prefetched, input) as soon as both are there, the early invocations are waited for in `wait_for_invocations`
+    """
+    invoke.track(_submit(_timed, invocation, "handoff", invoke_early, workflow, next_steps, input, decisions))
+    if not current_step["pre-fetch"]:
+        return None, input
+    fetching = _submit(_timed, invocation, "prefetch", prefetch_data, workflow, current_step)
+    if input is None:
+        input = _timed(invocation, "input_wait", get_function_input, workflow, current_step)
+    return fetching.result(), input
+
+
+def handler_data(prefetched: typing.Optional[dict]) -> dict:
+    """
+    :return: the `data` argument of the function handler
+    """
+    return {
+        "prefetched": prefetched,
+        "resources": resources.get_resources()
+    }
+
+
+def get_cache(workflow: plan.State, step: dict, options: dict) -> cache.Cache:
+    """
+    :return: the result cache of a step, one per container
+    """
+    store = get_store(workflow) if options.get("backend", "store") == "store" else None
+    key = ("cache", step["function_name"], json.dumps(options, sort_keys=True))
+    return resources.get_resources().get(key, lambda: cache.Cache(step["function_name"], options, store))
+
+
+def call_handler(invocation: telemetry.Invocation, handler: typing.Callable, workflow: plan.State, current_step: dict, prefetched: typing.Optional[dict], input: typing.Any) -> typing.Any:
+    """
+    call the function handler with (data, input), references in the input are loaded when the handler accesses them
+    for steps with "cache" (see cache.py), a result that was computed for the same content before is returned instead
+    """
+    input = resolve_input(workflow, input)
+    options = current_step.get("cache", None)
+    if not options:
+        return handler(handler_data(prefetched), input)
+
+    options = options if isinstance(options, dict) else {}
+    results = get_cache(workflow, current_step, options)
+    hash = cache.key(current_step["function_name"], options, input, prefetched)
+    if hash is None:
+        return handler(handler_data(prefetched), input)
+    entry = results.get(hash)
+    if entry is not None:
+        print(f"cached result {hash[:16]}, skipping the handler")
+        invocation.set(cache="hit")
+        return entry["result"]
+    invocation.set(cache="miss")
+    result = handler(handler_data(prefetched), input)
+    results.put(hash, result)
+    return result
+
+
+def get_function_input(workflow: plan.State, current_step: dict) -> typing.Any:
+    """
+    block until all predecessors have uploaded their input for this step
+    waiting steps are notified if the handoff store has a notification channel, otherwise they poll it
+    the timeout and the polling intervals can be set in the "handoff" section of the workflow (in seconds)
+    """
+    options = workflow.get("handoff", None) or {}
+    deadline = time.monotonic() + options.get("timeout", 120)
+    store = get_store(workflow)
+    channel = get_channel(workflow)
+    records = {}
+    for predecessor in get_predecessors(workflow, current_step):
+        record = store.wait(
+            input_key(workflow, current_step, predecessor),
+            max(deadline - time.monotonic(), 0),
+            interval=options.get("poll_interval", handoff.POLL_INTERVAL),
+            maxInterval=options.get("max_poll_interval", handoff.MAX_POLL_INTERVAL),
+            channel=channel
+        )
+        if record is None:
+            raise TimeoutError(f"input for step {current_step['id']} of run {get_run_id(workflow)} didn't arrive in time")
+        records[predecessor["id"]] = json.loads(record)
+    return join_inputs(workflow, current_step, records)
+
+
+def handle_batch(workflow: typing.Mapping, items: list[dict], handler: typing.Callable, invocations: list[telemetry.Invocation]) -> None:
+    """
+    run the current step for every item of a batch envelope, see batch.py
+    the items share the step's clients and pre-fetched objects, every item then continues its own run,
+    the invocations of the next steps are batched again if they have a "batch" section
+    one timing record is emitted per item (see `execute`), `invocations` holds the one the platform wrapper started,
+    it's used for the first item, the records of the other items are added to it
+    """
+    workflow = prepare_workflow(workflow)
+    current_step = get_current_step(workflow)
+    next_steps = get_next_steps(workflow)
+    runs = [workflow.replace(run_id=item["run_id"], data=item.get("data", workflow.get("data", []))) for item in items]
+    inputs = [item.get("body", None) for item in items]
+    invocations.extend(telemetry.start(invocations[0].platform) for _ in runs[1:])
+    for run, invocation in zip(runs, invocations):
+        invocation.set(**trace_fields(run, current_step), batch_size=len(items))
+    print(f"handling a batch of {len(items)} runs")
+
+    decisions = [choose_invocations(invocation, run, current_step, next_steps) for run, invocation in zip(runs, invocations)]
+    for run, input, invocation, chosen in zip(runs, inputs, invocations, decisions):
+        invoke.track(_submit(_timed, invocation, "handoff", invoke_early, run, next_steps, input, chosen))
+
+    with objects.workdir() as directory:
+        shared = batch.SharedObjects(directory)
+        try:
+            if current_step["pre-fetch"]:
+                # the inputs of all items are waited for at the same time
+                waiting = [
+                    _submit(_timed, invocation, "input_wait", get_function_input, run, current_step) if input is None else None
+                    for run, input, invocation in zip(runs, inputs, invocations)
+                ]
+                # once for the whole batch, every item's record gets the same interval
+                with contextlib.ExitStack() as stack:
+                    for invocation in invocations:
+                        stack.enter_context(invocation.phase("prefetch"))
+                    for ref in [ref for run in runs for ref in run["data"]]:
+                        shared.fetch(get_store(workflow, ref["bucket"]), ref["bucket"], ref["key"])
+                inputs = [input if w is None else w.result() for input, w in zip(inputs, waiting)]
+
+            for run, input, invocation, chosen in zip(runs, inputs, invocations, decisions):
+                prefetched = shared.open(run["data"]) if current_step["pre-fetch"] else None
+                with invocation.phase("handler"):
+                    result = call_handler(invocation, handler, run, current_step, prefetched, input)
+                observe_timing(invocation, run, current_step, next_steps)
+                if len(next_steps) > 0:
+                    with invocation.phase("handoff"):
+                        deliver(run, current_step, next_steps, result, chosen)
+        finally:
+            shared.close()
+
+    if len(next_steps) == 0:
+        print("reached end of workflow")
+    with contextlib.ExitStack() as stack:
+        for invocation in invocations:
+            stack.enter_context(invocation.phase("handoff"))
+        wait_for_invocations()
+
+
+def handle_run(workflow: typing.Mapping, input: typing.Any, handler: typing.Callable, invocation: telemetry.Invocation) -> None:
+    """
+    run the current step for one run of the workflow
+    """
+    if input is None:
+        print("no function input: this function pre-fetches data or takes no arguments")
+    workflow = prepare_workflow(workflow)
+
+    # 1) find the current step and the steps that follow it
+    #    => with fan-out there can be several next steps, at the end of the workflow there are none
+    current_step = get_current_step(workflow)
+    invocation.set(**trace_fields(workflow, current_step))
+    next_steps = get_next_steps(workflow)
+
+    # 2) if next steps pre-fetch data, call them here
+    #    => this means they will get the actual function input from somewhere else (if any is expected)
+    #    => "auto" steps are invoked now, later or with the output, as their timings suggest (see adaptive.py)
+    # 3) if this current step pre-fetches
+    #    a) pre-fetch the data
+    #    b) if the handler expects an additional input, get the function input from somewhere (external)
+    # all of this is I/O and runs at the same time, the handler starts once (a) and (b) are done
+    # the invocations of (2) are waited for before returning
+    if current_step["pre-fetch"]:
+        print("pre-fetching data")
+        if input is None:
+            print("retreiving function input")
+    else:
+        print("nothing to pre-fetch")
+    decisions = choose_invocations(invocation, workflow, current_step, next_steps)
+    prefetched, input = gather_inputs(invocation, workflow, current_step, next_steps, input, decisions)
+
+    # 4) call the function handler with (data, function_input)
+    # data holds the pre-fetched objects (might be None) and the container's resource cache
+    # inputs that were passed by reference are loaded when the handler accesses them
+    # steps with "cache" return the result of an earlier invocation with the same input instead (see cache.py)
+    with invocation.phase("handler"):
+        result = call_handler(invocation, handler, workflow, current_step, prefetched, input)
+    observe_timing(invocation, workflow, current_step, next_steps)
+
+    # 5) hand the result to the next steps
+    #    => pre-fetching steps have been invoked earlier and get it through the handoff store
+    #    => other steps are invoked now with {"workflow": ..., "body": handler_output}
+    if len(next_steps) > 0:
+        print("delivering function output to next steps")
+        with invocation.phase("handoff"):
+            deliver(workflow, current_step, next_steps, result, decisions)
+    else:
+        print("reached end of workflow")
+
+    # 6) make sure all invocations have been sent before the container is frozen
+    with invocation.phase("handoff"):
+        wait_for_invocations()
+
+
+def execute(payload: dict, handler: typing.Callable, invocation: telemetry.Invocation) -> bool:
+    """
+    run one invocation of the function
+    :param payload: the decoded event (see envelope.decode), one of
+        {"workflow": {...}, "body": ...}    # "body" is missing for pre-fetching steps, they wait for it
+        {"workflow": {...}, "batch": [...]} # several runs, see batch.py
+        {"ping": {...}}                     # warm-up, see invoke.ping
+    :param invocation: the timing record the platform wrapper started before decoding the event (see telemetry.py)
+    :return: False if the event isn't a workflow invocation
+    """
+    # warm-up pings only load the function
+    if "ping" in payload:
+        handle_ping(payload["ping"], invocation)
+        return True
+    if "workflow" not in payload:
+        print("workflow information missing, ignoring the invocation")
+        return False
+
+    # concurrent invocations of the container only wait for the invocations they started themselves
+    # one structured timing record per invocation (see telemetry.py), failed ones are emitted with the error
+    invocations = [invocation]
+    with invoke.tracking(), telemetry.recorded(invocations):
+        # several runs in one invocation, the handler is called once per run
+        if "batch" in payload:
+            handle_batch(payload["workflow"], payload["batch"], handler, invocations)
+        else:
+            handle_run(payload["workflow"], payload.get("body", None), handler, invocation)
+    return True
@@ -1,11 +1,11 @@
 import time
 
-import boto3
+import objects # deployed next to the handler with the wrapper modules
 
 from pdfminer.pdfparser import PDFParser
 from pdfminer.pdfdocument import PDFDocument
 
-def handler(input: dict) -> dict: 
+def handler(data: dict, input: dict) -> dict:
 
     tStart = time.time()
     print(f"Start time: {tStart}")
@@ -21,26 +21,32 @@ def handler(input: dict) -> dict:
         print("KeyError: ", e)
         return {"error": f"KeyError: {e}"}
 
-    # download PDF from S3
-    client = boto3.client("s3", region_name="us-east-1")
-    with open("/tmp/file.pdf", "wb") as f:
-        client.download_fileobj(bucket, filename, f)
+    # stream the PDF from S3 into a buffer, it only spills to a temporary file for large documents
+    # (or use the copy the wrapper pre-fetched while the previous step was running)
+    f = (data["prefetched"] or {}).get(filename)
+    if f is None:
+        f = objects.spool(data["resources"].bucket(bucket, "us-east-1"), filename)
     print("Downloaded file from S3")
 
     # parse PDF
     try:
-        parser = PDFParser()
-        document = PDFDocument()
+        parser = PDFParser(f)
+        document = PDFDocument(parser)
         print("Parsed PDF")
     except Exception as e:
         print("Error parsing PDF: ", e)
         return {"error": f"Error parsing PDF: {e}"}
+    finally:
+        f.close()
 
     print("checked, this is actually a PDF")
 
     tEnd = time.time()
     print(f"total time: {tEnd - tStart}")
 
+    # ocr runs after check and virus (see workflow.json), it finds the document in their outputs
     return {
-        "status": 200
+        "status": 200,
+        "filename": filename,
+        "bucket": bucket
     }
@@ -1,8 +1,12 @@
+import time
+
+import objects # deployed next to the handler with the wrapper modules
+
 from pdfminer.pdfparser import PDFParser
 from pdfminer.pdfdocument import PDFDocument
 
 
-def handler(input):
+def handler(data: dict, input: dict) -> dict:
 
     tStart = time.time()
     print(f"Start time: {tStart}")
@@ -18,16 +22,20 @@ def handler(input):
         print("KeyError: ", e)
         return {"error": f"KeyError: {e}"}
 
-    # download PDF from S3
-    client = boto3.client("s3", region_name="us-east-1")
-    with open("/tmp/file.pdf", "wb") as f:
-        client.download_fileobj(bucket, filename, f)
+    # stream the PDF from S3 into a buffer, it only spills to a temporary file for large documents
+    # (or use the copy the wrapper pre-fetched while the previous step was running)
+    f = (data["prefetched"] or {}).get(filename)
+    if f is None:
+        f = objects.spool(data["resources"].bucket(bucket, "us-east-1"), filename)
     print("Downloaded file from S3")
 
     # parse PDF
-    parser = PDFParser()
-    document = PDFDocument()
-    print("Parsed PDF")
+    try:
+        parser = PDFParser(f)
+        document = PDFDocument(parser)
+        print("Parsed PDF")
+    finally:
+        f.close()
 
     tEnd = time.time()
     print(f"total time: {tEnd - tStart}")
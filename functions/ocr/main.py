@@ -0,0 +1,156 @@
+import time, os
+import concurrent.futures
+import shutil
+import subprocess
+
+import objects # deployed next to the handler with the wrapper modules
+
+
+# documents with more pages are split into page ranges that are OCR'd at the same time
+# the input is the join of check and virus, so the shard size is set per deployment (e.g. ENV in the Dockerfile)
+PAGES_PER_SHARD = int(os.environ.get("OCR_PAGES_PER_SHARD", 4))
+WORKERS = os.cpu_count() or 1
+
+
+def page_ranges(pages: int, pagesPerShard: int, workers: int) -> list[tuple[int, int]]:
+    """
+    :return: [(first page, end), ...], one range per `pagesPerShard` pages, but at most one per worker
+    """
+    shards = max(min(workers, -(-pages // max(pagesPerShard, 1))), 1)
+    bounds = [pages * i // shards for i in range(shards + 1)]
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+def page_count(src: str) -> int:
+    # pikepdf comes with ocrmypdf (see Dockerfile)
+    import pikepdf
+    with pikepdf.open(src) as pdf:
+        return len(pdf.pages)
+
+
+def split(src: str, directory: str, ranges: list[tuple[int, int]]) -> list[str]:
+    import pikepdf
+    shards = []
+    with pikepdf.open(src) as pdf:
+        for i, (start, end) in enumerate(ranges):
+            shard = pikepdf.new()
+            shard.pages.extend(pdf.pages[start:end])
+            shards.append(os.path.join(directory, f"shard-{i}.pdf"))
+            shard.save(shards[-1])
+    return shards
+
+
+def merge(paths: list[str], dst: str) -> None:
+    import pikepdf
+    merged = pikepdf.new()
+    parts = [pikepdf.open(path) for path in paths]
+    try:
+        for part in parts:
+            merged.pages.extend(part.pages)
+        merged.save(dst)
+    finally:
+        for part in parts:
+            part.close()
+
+
+def ocr(src: str, dst: str, sidecar: str, jobs: int) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        ["ocrmypdf", src, dst, "--use-threads", "--force-ocr", "--output-type", "pdf", "--jobs", str(jobs), "--sidecar", sidecar],
+        capture_output=True, text=True
+    )
+
+
+def document(input: dict) -> tuple[str, str]:
+    """
+    ocr is a join of check and virus (see workflow.json), its input is {"check": {...}, "virus": {...}},
+    both pass the document through, a plain {"filename": ..., "bucket": ...} works as well
+    raises ValueError if a predecessor failed and KeyError if no predecessor names the document
+    :return: (filename, bucket)
+    """
+    outputs = [input] if "filename" in input else [output for output in input.values() if isinstance(output, dict)]
+    for output in outputs:
+        if "error" in output:
+            raise ValueError(output["error"])
+    for output in outputs:
+        if "filename" in output and "bucket" in output:
+            return output["filename"], output["bucket"]
+    raise KeyError("filename")
+
+
+def handler(data: dict, input: dict) -> dict:
+
+    tStart = time.time() * 1000
+    print(tStart)
+
+    # get input parameters
+    try:
+        filename, bucket = document(input)
+    except KeyError as e:
+        print("error retrieving input parameters: %s", e)
+        return {"statusCode": 400, "body": "missing input parameters filename or bucket"}
+    except ValueError as e:
+        print("previous step failed: %s", e)
+        return {"statusCode": 400, "body": f"previous step failed: {e}"}
+    print(f"inputs: {filename}, {bucket}")
+
+    # everything happens in a directory that is unique to this invocation
+    with objects.workdir() as tmp:
+
+        # ocrmypdf needs a file: use the copy the wrapper pre-fetched while the previous steps were running
+        # or stream the pdf from s3 to disk
+        store = data["resources"].bucket(bucket, "us-east-1")
+        src = os.path.join(tmp, "file.pdf")
+        prefetched = (data["prefetched"] or {}).get(filename)
+        if prefetched is not None:
+            with prefetched, open(src, "wb") as f:
+                shutil.copyfileobj(prefetched, f)
+        else:
+            objects.download(store, filename, src)
+        print("stored file in tmp dir")
+
+        # one ocrmypdf process per page range, they run at the same time and share the cpus
+        # small documents and single-cpu containers are OCR'd in one piece
+        pages = page_count(src)
+        if pages == 0:
+            return {"statusCode": 400, "body": f"{filename} has no pages"}
+        ranges = page_ranges(pages, PAGES_PER_SHARD, WORKERS)
+        print(f"{pages} pages in {len(ranges)} shards")
+        if len(ranges) == 1:
+            shards = [src]
+        else:
+            shards = split(src, tmp, ranges)
+        outputs = [(f"{shard}.ocr.pdf", f"{shard}.txt") for shard in shards]
+        jobs = max(WORKERS // len(shards), 1)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(shards)) as executor:
+            futures = [executor.submit(ocr, shard, pdf, txt, jobs) for shard, (pdf, txt) in zip(shards, outputs)]
+        results = [future.result() for future in futures]
+
+        for ret in results:
+            print({"stdout": ret.stdout, "stderr": ret.stderr})
+        failed = [ret for ret in results if ret.returncode != 0]
+        if len(failed) > 0:
+            return {"statusCode": 500, "body": f"ocrmypdf failed: {failed[0].stderr[-1000:]}"}
+
+        # the shards are merged in page order, the pages in ocrmypdf's text sidecars are separated by form feeds
+        dst, text = outputs[0]
+        if len(outputs) > 1:
+            dst, text = os.path.join(tmp, "out.pdf"), os.path.join(tmp, "out.txt")
+            merge([pdf for pdf, _ in outputs], dst)
+            with open(text, "wb") as f:
+                for _, txt in outputs:
+                    with open(txt, "rb") as part:
+                        shutil.copyfileobj(part, f)
+        print(f"ocr done after {time.time() * 1000 - tStart:.0f} ms")
+
+        # upload the output artifacts (not the input or the shards) to s3 at the same time,
+        # files are streamed (multipart for large files) instead of read into memory
+        # the output pdfs never travel in invocation payloads, the next steps get their keys
+        name = os.path.basename(filename)
+        keys = objects.upload_all(store, {f"ocr_{name}": dst, f"ocr_{name}.txt": text})
+
+    return {
+        "statusCode": 200,
+        "bucket": bucket,
+        "filename": filename,
+        "outputs": [{"bucket": bucket, "key": key} for key in keys]
+    }
@@ -1,8 +1,8 @@
-import time, hashlib
+import time
 
-import boto3 as boto3
+import objects # deployed next to the handler with the wrapper modules
 
-def handler(event, context):
+def handler(data: dict, input: dict) -> dict:
 
     tStart = time.time()
     print(f"Start time: {tStart}")
@@ -18,22 +18,25 @@ def handler(event, context):
         print("KeyError: ", e)
         return {"error": f"KeyError: {e}"}
 
-    # download PDF from S3
-    client = boto3.client("s3", region_name="us-east-1")
-    with open("/tmp/file.pdf", "wb") as f:
-        client.download_fileobj(bucket, filename, f)
-    print("Downloaded file from S3")
-
     # perform "virus check" on file
     # 1. calculate sha256 hash of file
+    #    the hash is computed chunk by chunk while the file is streamed from S3, it is never stored completely
+    #    (if the wrapper pre-fetched the file while the previous step was running, hash that copy)
     #sha256 = subprocess.run(["sha256sum", f"/tmp/{filename}"], stdout=subprocess.PIPE).stdout.decode('utf-8').split(" ")[0]
-    with open(f"/tmp/file.pdf", "rb") as f:
-        sha256 = hashlib.sha256(f.read()).hexdigest()
-        print(f"(use case: {sha256})")
+    f = (data["prefetched"] or {}).get(filename)
+    if f is not None:
+        with f:
+            sha256 = objects.sha256_stream(f)
+    else:
+        sha256 = objects.sha256(data["resources"].bucket(bucket, "us-east-1"), filename)
+    print(f"(use case: {sha256})")
 
     tEnd = time.time()
     print(f"total time: {tEnd - tStart}")
 
+    # ocr runs after check and virus (see workflow.json), it finds the document in their outputs
     return {
-        "status": 200
+        "status": 200,
+        "filename": filename,
+        "bucket": bucket
     }